@@ -0,0 +1,225 @@
+#!/usr/bin/env/python3
+
+""" Build images with `docker buildx bake` from a generated JSON bake file
+
+All images (or variants) of a run become targets of a single build graph so
+BuildKit schedules them together and builds stages they share only once. """
+
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from build_log import PROGRESS_ARGS, get_log_file, run_logged
+from batch import BatchImage, get_levels
+from builder import create_builder, create_temporary_builder, remove_builder
+from config import Config
+from docker_build import (
+    get_cache_args,
+    get_output_options,
+    get_tags,
+    get_variant_tags,
+    report_layers,
+    resolve_build_args,
+    reuse_published,
+    rotate_local_cache,
+    uses_builder,
+)
+from metrics import record_build
+
+
+def get_target_name(image_name: str) -> str:
+    """bake target name for an image (ex. openzim_zimit)"""
+    return re.sub(r"[^a-zA-Z0-9_-]", "_", image_name)
+
+
+def get_output(output_options: str) -> List[str]:
+    """bake target output pushing its tags, with exporter options"""
+    return [",".join(filter(None, ["type=image,push=true", output_options]))]
+
+
+def get_target(config: Config, labels: Dict[str, str], scope: str = "") -> Dict:
+    """bake target definition for an image config"""
+    target = {
+        "context": config.context,
+        "dockerfile": config.dockerfile,
+        "args": resolve_build_args(config.build_args, config.tag),
+        "platforms": config.platforms,
+        "tags": get_tags(
+            config.registries, config.image_name, config.tag, config.latest
+        ),
+        "labels": labels,
+        "output": get_output(get_output_options(config)),
+    }
+    if config.target:
+        target["target"] = config.target
+
+    # --cache-from/--cache-to pairs to their target attributes
+    cache_args = get_cache_args(
+        config.cache,
+        config.cache_mode,
+        config.cache_path,
+        config.registries,
+        config.image_name,
+        config.tag,
+        scope=scope,
+    )
+    for option, value in zip(cache_args[::2], cache_args[1::2]):
+        target.setdefault(option.lstrip("-"), []).append(value)
+    return target
+
+
+def get_variant_target(target: Dict, config: Config, variant: str) -> Dict:
+    """target for a variant of target's image, recompressed with variant
+
+    it only differs by its output so BuildKit builds the image once"""
+    return {
+        **{key: value for key, value in target.items() if key != "cache-to"},
+        "tags": get_variant_tags(target["tags"], variant),
+        "output": get_output(get_output_options(config, variant)),
+    }
+
+
+def run_bake(
+    configs: Dict[str, Config], builder: str = ""
+) -> Dict[str, Tuple[int, float]]:
+    """bake and push all images at once, returning {name: (returncode, duration)}
+
+    images for which an already published one is reused are not built"""
+    results: Dict[str, Tuple[int, float]] = {}
+    # builds are {target name: (image name, build name, report sizes)}
+    targets, builds, scopes = {}, {}, {}
+    for name, config in configs.items():
+        ret, labels = reuse_published(config)
+        if ret is not None:
+            results[name] = (ret, 0.0)
+            continue
+        # local cache folder is shared by all images
+        scopes[name] = get_target_name(name) if len(configs) > 1 else ""
+        target_name = get_target_name(name)
+        targets[target_name] = get_target(config, labels, scopes[name])
+        builds[target_name] = (name, "bake", bool(get_output_options(config)))
+        if config.zstd_variant:
+            targets[f"{target_name}-zstd"] = get_variant_target(
+                targets[target_name], config, "zstd"
+            )
+            builds[f"{target_name}-zstd"] = (name, "bake-zstd", True)
+
+    if targets:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bake_file = os.path.join(tmpdir, "docker-bake.json")
+            metadata_file = os.path.join(tmpdir, "metadata.json")
+            with open(bake_file, "w") as fh:
+                json.dump(
+                    {
+                        "group": {"default": {"targets": list(targets)}},
+                        "target": targets,
+                    },
+                    fh,
+                    indent=2,
+                )
+
+            cmd = ["docker", "buildx", "bake", "--file", bake_file]
+            cmd += ["--metadata-file", metadata_file] + PROGRESS_ARGS
+            if builder:
+                cmd += ["--builder", builder]
+            print(f"Running: {' '.join(cmd)} ({', '.join(targets)})")
+            # logs dir is action-wide, log is named after this bake's first target
+            log_file = get_log_file(
+                next(iter(configs.values())).get_build_logs_dir(),
+                "bake",
+                next(iter(targets)),
+            )
+            started_on = time.monotonic()
+            returncode = run_logged(cmd, "bake", log_file)
+            duration = time.monotonic() - started_on
+            metadata = read_metadata(metadata_file) if returncode == 0 else {}
+
+        if returncode != 0:
+            print(f"Unable to bake images: {returncode}")
+        for target_name, (name, build_name, report_sizes) in builds.items():
+            digest = metadata.get(target_name, {}).get("containerimage.digest")
+            size = None
+            if digest and report_sizes:
+                size = report_layers(
+                    f"{configs[name].registries[0]}/{name}@{digest}", build_name
+                )
+            record_build(
+                build_name, duration, returncode, digest, image=name, size=size
+            )
+            results[name] = (returncode, duration)
+        for name, scope in scopes.items():
+            if returncode == 0 and configs[name].cache == "local":
+                rotate_local_cache(configs[name].cache_path, scope)
+
+    # keep images order
+    return {name: results[name] for name in configs}
+
+
+def read_metadata(metadata_file: str) -> Dict[str, Dict]:
+    """{target: metadata} from a bake --metadata-file"""
+    try:
+        with open(metadata_file, "r") as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        return {}
+
+
+def bake_and_push(config: Config) -> int:
+    """build and push a single image using bake"""
+    if config.mode != "build":
+        print(f"bake is not supported in {config.mode} mode")
+        return 1
+    # builder created for this build only is removed afterwards
+    builder = config.builder
+    if not builder and uses_builder(config):
+        builder = create_temporary_builder(config)
+        if not builder:
+            print("Unable to create builder instance")
+            return 1
+    try:
+        return run_bake({config.image_name: config}, builder)[config.image_name][0]
+    finally:
+        if builder != config.builder:
+            remove_builder(builder)
+
+
+def bake_levels(
+    images: Dict[str, BatchImage], builder: str
+) -> Dict[str, Tuple[Optional[int], float]]:
+    """bake batch images on builder, a dependency level at a time
+
+    images depending on a failed one are skipped (None)"""
+    results: Dict[str, Tuple[Optional[int], float]] = {}
+    for level in get_levels(images):
+        configs = {}
+        for name in level:
+            if any(results[dep][0] != 0 for dep in images[name].depends_on):
+                print(f"[{name}] skipped: a dependency failed")
+                results[name] = (None, 0.0)
+            else:
+                configs[name] = images[name].config
+        if configs:
+            results.update(run_bake(configs, builder))
+    return {name: results[name] for name in images}
+
+
+def bake_batch(
+    images: Dict[str, BatchImage], builder: str = ""
+) -> Dict[str, Tuple[Optional[int], float]]:
+    """bake_levels on builder or on a shared one, created for the occasion"""
+    if builder:
+        return bake_levels(images, builder)
+
+    # builder settings are action-wide, the same for all images
+    config = next(iter(images.values())).config
+    ret = create_builder(config.builder, config)
+    if ret != 0:
+        print(f"Unable to create builder {config.builder}: {ret}")
+        return {name: (ret, 0.0) for name in images}
+    try:
+        return bake_levels(images, config.builder)
+    finally:
+        remove_builder(config.builder)
@@ -0,0 +1,229 @@
+#!/usr/bin/env/python3
+
+""" Batch mode: several images published by a single run, after a single setup
+
+Images are given as a JSON list in `batch`, each inheriting action's inputs.
+Independent images build concurrently on a shared builder while images
+listed in `depends-on` are built (and pushed) first. """
+
+import concurrent.futures
+import dataclasses
+import json
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from builder import create_builder, remove_builder
+from config import Config, parse_key_values
+
+IMAGE_KEYS = (
+    "image-name",
+    "context",
+    "dockerfile",
+    "target",
+    "build-args",
+    "platforms",
+    "depends-on",
+    "repo_description",
+    "repo_overview",
+)
+
+
+@dataclasses.dataclass
+class BatchImage:
+    config: Config
+    depends_on: List[str]
+
+
+def as_list(value) -> List[str]:
+    """list from a space or newline separated string or a list"""
+    return value.split() if isinstance(value, str) else list(value)
+
+
+def get_batch_builder(config: Config) -> str:
+    """name of the builder shared by batch images, unique to this run"""
+    parts = ["docker-publish-batch", config.github_run_id, config.github_job]
+    name = "-".join([part for part in parts if part] + [str(os.getpid())])
+    return re.sub(r"[^a-zA-Z0-9_.-]+", "-", name)
+
+
+def parse_batch(config: Config) -> Dict[str, BatchImage]:
+    """{image name: image} from batch input, raising ValueError if invalid"""
+    try:
+        items = json.loads(config.batch)
+    except ValueError as exc:
+        raise ValueError(f"not valid JSON: {exc}")
+    if not isinstance(items, list) or not items:
+        raise ValueError("must be a non-empty list of images")
+
+    builder = config.builder_name or get_batch_builder(config)
+    images = {}
+    for item in items:
+        if not isinstance(item, dict) or not item.get("image-name"):
+            raise ValueError(f"missing `image-name` in {item}")
+        unknown = set(item) - set(IMAGE_KEYS)
+        if unknown:
+            raise ValueError(f"unknown keys {', '.join(sorted(unknown))}")
+        name = item["image-name"]
+        if name in images:
+            raise ValueError(f"duplicate image `{name}`")
+
+        build_args = item.get("build-args", config.build_args)
+        if isinstance(build_args, str):
+            build_args = parse_key_values(build_args)
+        images[name] = BatchImage(
+            config=dataclasses.replace(
+                config,
+                image_name=name,
+                context=item.get("context", config.context),
+                dockerfile=item.get("dockerfile", config.dockerfile),
+                target=item.get("target", config.target),
+                build_args=dict(build_args),
+                platforms=as_list(item.get("platforms", config.platforms)),
+                repo_description=item.get("repo_description", config.repo_description),
+                repo_full_description=item.get(
+                    "repo_overview", config.repo_full_description
+                ),
+                builder=builder,
+                batch="",
+            ),
+            depends_on=as_list(item.get("depends-on", [])),
+        )
+
+    get_levels(images)
+    return images
+
+
+def get_levels(images: Dict[str, BatchImage]) -> List[List[str]]:
+    """image names grouped by dependency level (dependencies first)
+
+    raise ValueError on unknown dependencies or cycles"""
+    for name, image in images.items():
+        for dependency in image.depends_on:
+            if dependency not in images:
+                raise ValueError(f"`{name}` depends on unknown image `{dependency}`")
+
+    # remove images without remaining dependencies until none is left
+    levels = []
+    remaining = {name: set(image.depends_on) for name, image in images.items()}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"dependency cycle between {', '.join(sorted(remaining))}")
+        levels.append(ready)
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return levels
+
+
+def get_setup_config(config: Config, images: Dict[str, BatchImage]) -> Config:
+    """config to run setup once for all images (all their platforms)"""
+    platforms = []
+    for image in images.values():
+        platforms += [p for p in image.config.platforms if p not in platforms]
+    return dataclasses.replace(
+        config,
+        platforms=platforms,
+        builder=config.builder_name or get_batch_builder(config),
+    )
+
+
+def display_batch(images: Dict[str, BatchImage]):
+    for name, image in images.items():
+        print(
+            "{name}: {platforms} from {context}{after}".format(
+                name=name,
+                platforms=",".join(image.config.platforms),
+                context=os.path.join(image.config.context, image.config.dockerfile),
+                after=f" after {', '.join(image.depends_on)}"
+                if image.depends_on
+                else "",
+            )
+        )
+
+
+def run_batch(
+    images: Dict[str, BatchImage],
+    build: Callable[[Config], int],
+    max_parallel: int,
+) -> Dict[str, Tuple[Optional[int], float]]:
+    """build images, max_parallel at a time, in dependencies order
+
+    returns {name: (returncode, duration)}. returncode is None for images
+    skipped because a dependency failed"""
+    results: Dict[str, Tuple[Optional[int], float]] = {}
+    pending = dict(images)
+
+    def timed_build(name: str, config: Config) -> Tuple[int, float]:
+        started_on = time.monotonic()
+        try:
+            ret = build(config)
+        except Exception as exc:
+            print(f"[{name}] build failed: {exc}")
+            ret = 1
+        return ret, time.monotonic() - started_on
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        running = {}
+        while pending or running:
+            # skipping an image can make its dependents skippable
+            changed = True
+            while changed:
+                changed = False
+                for name, image in list(pending.items()):
+                    if any(results.get(dep, (0,))[0] != 0 for dep in image.depends_on):
+                        print(f"[{name}] skipped: a dependency failed")
+                        results[name] = (None, 0.0)
+                    elif all(dep in results for dep in image.depends_on):
+                        running[executor.submit(timed_build, name, image.config)] = name
+                    else:
+                        continue
+                    del pending[name]
+                    changed = True
+
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    # keep images order
+    return {name: results[name] for name in images}
+
+
+def build_batch(
+    images: Dict[str, BatchImage],
+    build: Callable[[Config], int],
+    max_parallel: int,
+    builder: str = "",
+) -> Dict[str, Tuple[Optional[int], float]]:
+    """run_batch on builder or on a shared one, created for the occasion"""
+    if builder:
+        return run_batch(images, build, max_parallel)
+
+    # builder settings are action-wide, the same for all images
+    config = next(iter(images.values())).config
+    ret = create_builder(config.builder, config)
+    if ret != 0:
+        print(f"Unable to create builder {config.builder}: {ret}")
+        return {name: (ret, 0.0) for name in images}
+    try:
+        return run_batch(images, build, max_parallel)
+    finally:
+        remove_builder(config.builder)
+
+
+def report(results: Dict[str, Tuple[Optional[int], float]]) -> int:
+    """display each image's result, returning non-zero if any failed"""
+    for name, (ret, duration) in results.items():
+        if ret is None:
+            status = "SKIPPED"
+        else:
+            status = "OK" if ret == 0 else f"FAILED ({ret})"
+        print(f"{name}: {status} ({duration:.3f}s)")
+    return max([1 if ret is None else abs(ret) for ret, _ in results.values()] or [0])
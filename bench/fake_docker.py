@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+""" Fake docker CLI recording its invocations, for offline runs of the action
+
+Each call is appended as a JSON line to FAKE_DOCKER_LOG. Behaviour is set
+through environ:
+- FAKE_DOCKER_DELAYS: `command=seconds` items (ex. `build=2 login=0.5`)
+- FAKE_DOCKER_FAILURES: `command=count` items, failing first count calls
+- FAKE_DOCKER_IMAGES: JSON file of published images {ref: {platform: labels}},
+  read by `imagetools inspect` and updated by `imagetools create` and builds
+  (OCI layout outputs are tracked as `oci-layout://dest@digest`)
+- FAKE_DOCKER_BUILDERS: JSON file of builder instances {name: [nodes create
+  args]}, updated by `buildx create` and `buildx rm`, read by `buildx inspect`
+
+builds and bakes with `--progress rawjson` print a cached step and a compile
+step (failing on injected failures) as rawjson events.
+
+commands are `build`, `bake`, `imagetools-create`, `login`, `pull`, `run`, etc. """
+
+import base64
+import hashlib
+import json
+import os
+import sys
+import time
+
+BUILDX_VERSION = "0.31.1"
+
+
+def parse_items(text):
+    return dict(item.split("=", 1) for item in text.split() if "=" in item)
+
+
+def get_command(args):
+    words = [arg for arg in args[:3] if not arg.startswith("-")]
+    if words[:1] == ["buildx"]:
+        words = words[1:]
+    if words[:1] in (["imagetools"], ["image"]):
+        return "-".join(words[:2])
+    return words[0] if words else ""
+
+
+def get_values(args, option):
+    """values of a repeatable `--option value` argument"""
+    return [args[index + 1] for index, arg in enumerate(args[:-1]) if arg == option]
+
+
+def read_log(path):
+    try:
+        with open(path, "r") as fh:
+            return [json.loads(line) for line in fh if line.strip()]
+    except IOError:
+        return []
+
+
+def read_images(path):
+    try:
+        with open(path, "r") as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_images(path, images):
+    with open(path, "w") as fh:
+        json.dump(images, fh, indent=2)
+
+
+def get_labels(args):
+    return dict(value.split("=", 1) for value in get_values(args, "--label"))
+
+
+def main(args):
+    command = get_command(args)
+    log_path = os.getenv("FAKE_DOCKER_LOG", "")
+    images_path = os.getenv("FAKE_DOCKER_IMAGES", "")
+    delay = float(parse_items(os.getenv("FAKE_DOCKER_DELAYS", "")).get(command, 0))
+    failures = int(parse_items(os.getenv("FAKE_DOCKER_FAILURES", "")).get(command, 0))
+
+    previous = [entry for entry in read_log(log_path) if entry["command"] == command]
+    returncode = 1 if len(previous) < failures else 0
+
+    if "--password-stdin" in args:
+        sys.stdin.read()
+
+    started_on = time.monotonic()
+    time.sleep(delay)
+
+    if returncode == 0:
+        returncode = run(command, args, images_path)
+    else:
+        if command in ("build", "bake"):
+            print_progress(args, f"process did not complete: exit code {returncode}")
+        print(f"fake docker: injected {command} failure", file=sys.stderr)
+
+    if log_path:
+        with open(log_path, "a") as fh:
+            fh.write(
+                json.dumps(
+                    {
+                        "command": command,
+                        "args": args,
+                        "returncode": returncode,
+                        "duration": round(time.monotonic() - started_on, 3),
+                    }
+                )
+                + "\n"
+            )
+    return returncode
+
+
+def run(command, args, images_path):
+    if command == "version":
+        print(f"github.com/docker/buildx v{BUILDX_VERSION}-fake 0000000")
+        return 0
+
+    if command in ("create", "inspect", "rm"):
+        return run_builder(command, args, os.getenv("FAKE_DOCKER_BUILDERS", ""))
+
+    images = read_images(images_path)
+
+    if command == "imagetools-inspect" and "--raw" in args:
+        print(json.dumps(get_manifest(args[3], images)))
+        return 0
+
+    if command == "imagetools-inspect":
+        ref = args[3]
+        if ref not in images:
+            print(f"ERROR: {ref}: not found", file=sys.stderr)
+            return 1
+        print(
+            json.dumps(
+                {
+                    platform: {"config": {"Labels": labels}}
+                    for platform, labels in images[ref].items()
+                }
+            )
+        )
+        return 0
+
+    if command == "imagetools-create":
+        tags = get_values(args, "--tag")
+        sources = [arg for arg in args[3:] if arg not in tags and arg != "--tag"]
+        # platforms images from digests aren't tracked, only tag to tag copies
+        for tag in tags:
+            images[tag] = {
+                platform: labels
+                for source in sources
+                for platform, labels in images.get(source, {}).items()
+            }
+
+    if command in ("build", "bake"):
+        print_progress(args)
+
+    if command == "build":
+        digest = "sha256:" + hashlib.sha256(" ".join(args).encode()).hexdigest()
+        labels = get_labels(args)
+        platforms = get_values(args, "--platform")
+        for tag in get_values(args, "--tag"):
+            images[tag] = {platform: labels for platform in platforms}
+            images[f"{tag.rsplit(':', 1)[0]}@{digest}"] = images[tag]
+        for output in get_values(args, "--output"):
+            options = parse_items(output.replace(",", " "))
+            if options.get("type") == "oci":
+                images[f"oci-layout://{options['dest']}@{digest}"] = {
+                    platform: labels for platform in platforms
+                }
+        if "--metadata-file" in args:
+            with open(get_values(args, "--metadata-file")[0], "w") as fh:
+                json.dump({"containerimage.digest": digest}, fh)
+
+    if command == "bake":
+        with open(get_values(args, "--file")[0], "r") as fh:
+            targets = json.load(fh)["target"]
+        metadata = {}
+        for name, target in targets.items():
+            digest = "sha256:" + hashlib.sha256(json.dumps(target).encode()).hexdigest()
+            metadata[name] = {"containerimage.digest": digest}
+            for tag in target["tags"]:
+                images[tag] = {
+                    platform: target.get("labels", {})
+                    for platform in target["platforms"]
+                }
+        if "--metadata-file" in args:
+            with open(get_values(args, "--metadata-file")[0], "w") as fh:
+                json.dump(metadata, fh)
+
+    if images_path and command in ("build", "bake", "imagetools-create"):
+        write_images(images_path, images)
+    return 0
+
+
+def print_progress(args, error=""):
+    """rawjson events of a build's steps, to stderr as buildx does"""
+    if get_values(args, "--progress") != ["rawjson"]:
+        return
+    now = "2026-01-01T00:00:00Z"
+    base = {
+        "digest": "sha256:" + hashlib.sha256(b"base").hexdigest(),
+        "name": "[1/2] FROM docker.io/library/alpine:3",
+        "started": now,
+        "completed": now,
+        "cached": True,
+    }
+    step = {
+        "digest": "sha256:" + hashlib.sha256(" ".join(args).encode()).hexdigest(),
+        "name": "[2/2] RUN make",
+        "started": now,
+    }
+    completed = dict(step, completed=now, **({"error": error} if error else {}))
+    output = "".join(f"compiling unit {index}\n" for index in range(100))
+    events = [
+        {"vertexes": [base, step]},
+        {
+            "logs": [
+                {
+                    "vertex": step["digest"],
+                    "stream": 1,
+                    "data": base64.b64encode(output.encode()).decode(),
+                    "timestamp": now,
+                }
+            ]
+        },
+        {"vertexes": [completed]},
+    ]
+    for event in events:
+        print(json.dumps(event), file=sys.stderr)
+
+
+def get_manifest(ref, images):
+    """index of ref's platforms if known as multi-platform, image manifest otherwise
+
+    image manifests all have the same gzip layers"""
+    platforms = list(images.get(ref, {}))
+    if len(platforms) > 1:
+        return {
+            "mediaType": "application/vnd.oci.image.index.v1+json",
+            "manifests": [
+                {
+                    "mediaType": "application/vnd.oci.image.manifest.v1+json",
+                    "digest": "sha256:"
+                    + hashlib.sha256(f"{ref} {platform}".encode()).hexdigest(),
+                    "platform": dict(
+                        zip(("os", "architecture", "variant"), platform.split("/"))
+                    ),
+                }
+                for platform in platforms
+            ],
+        }
+    return {
+        "mediaType": "application/vnd.oci.image.manifest.v1+json",
+        "layers": [
+            {
+                "mediaType": "application/vnd.oci.image.layer.v1.tar+gzip",
+                "digest": "sha256:" + hashlib.sha256(ref.encode()).hexdigest(),
+                "size": 3 * 2**20,
+            },
+            {
+                "mediaType": "application/vnd.oci.image.layer.v1.tar+gzip",
+                "digest": "sha256:" + hashlib.sha256(b"readme").hexdigest(),
+                "size": 512,
+            },
+        ],
+    }
+
+
+def run_builder(command, args, builders_path):
+    """builder instances commands, only tracked if builders_path is set"""
+    if not builders_path:
+        return 0
+    builders = read_images(builders_path)
+    names = [arg for arg in args[2:] if not arg.startswith("-")]
+    name = (get_values(args, "--name") or names or ["default"])[0]
+
+    if command == "inspect":
+        if name not in builders:
+            print(f"ERROR: no builder {name!r} found", file=sys.stderr)
+            return 1
+        print(f"Name:   {name}\nDriver: docker-container\n\nNodes:")
+        for index, node in enumerate(builders[name]):
+            node_name = (get_values(node, "--node") or [f"{name}{index}"])[0]
+            platforms = ",".join(get_values(node, "--platform"))
+            print(f"Name:      {node_name}\nStatus:    running")
+            print(f"Platforms: {platforms}\n")
+        return 0
+
+    if command == "create":
+        nodes = builders.get(name, []) if "--append" in args else []
+        builders[name] = nodes + [args[2:]]
+    elif builders.pop(name, None) is None:
+        print(f"ERROR: no builder {name!r} found", file=sys.stderr)
+        return 1
+    write_images(builders_path, builders)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+""" Offline benchmark and integration runs of the whole action
+
+Runs the step defined in action.yml (inputs defaults and env mapping included)
+against a fake docker CLI and local HTTP stand-ins, then reports each stage's
+duration and retries from the action's metrics file, along with docker calls
+and HTTP requests.
+
+    python3 -m bench.run [--scenario NAME ...] [--repeat N] [--cold] [--json PATH]
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from bench.stand_ins import StandIns
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+SHA = "0123456789abcdef0123456789abcdef01234567"
+BASE_INPUTS = {
+    "image-name": "openzim/bench",
+    "registries": "ghcr.io",
+    "credentials": (
+        "GHCRIO_USERNAME=bench GHCRIO_TOKEN=secret "
+        "DOCKERIO_USERNAME=bench DOCKERIO_TOKEN=secret"
+    ),
+    "on-master": "dev",
+    "tag-pattern": "/^v([0-9.]+)$/",
+}
+
+# inputs, event (ref, default_branch), fake docker delays/failures,
+# HTTP stand-ins latency/failures and images already published
+SCENARIOS = {
+    "single-platform": {},
+    "multi-platform-parallel": {
+        "inputs": {
+            "platforms": "linux/amd64 linux/arm64 linux/arm/v7",
+            "parallel": "true",
+        },
+        "docker_delays": "build=0.5",
+    },
+    "hub-and-webhook": {
+        "inputs": {
+            "registries": "ghcr.io docker.io",
+            "repo_description": "auto",
+            "webhook": "{webhook}",
+        },
+        "http_latency": {"hub": 0.05},
+        "http_failures": {"webhook": [503, 409]},
+        "retry_after": "0",
+    },
+    "flaky-login": {"docker_failures": "login=1"},
+    "failed-build": {"docker_failures": "build=1"},
+    "batch": {
+        "inputs": {
+            "image-name": "",
+            "max-parallel": "3",
+            "batch": json.dumps(
+                [
+                    {"image-name": "openzim/bench-base"},
+                    {"image-name": "openzim/bench-api", "platforms": "linux/arm64"},
+                    {
+                        "image-name": "openzim/bench-worker",
+                        "depends-on": ["openzim/bench-base"],
+                    },
+                ]
+            ),
+        },
+        "docker_delays": "build=0.3",
+    },
+    "batch-bake": {
+        "inputs": {
+            "image-name": "",
+            "bake": "true",
+            "batch": json.dumps(
+                [
+                    {"image-name": "openzim/bench-base"},
+                    {"image-name": "openzim/bench-api", "build-args": "FLAVOUR=api"},
+                    {
+                        "image-name": "openzim/bench-worker",
+                        "build-args": "FLAVOUR=worker",
+                        "depends-on": ["openzim/bench-base"],
+                    },
+                ]
+            ),
+        },
+        "docker_delays": "bake=0.3",
+    },
+    "persistent-builder": {
+        "inputs": {
+            "platforms": "linux/amd64 linux/arm64",
+            "builder-name": "bench-builder",
+            "buildkitd-max-parallelism": "2",
+        },
+        "docker_delays": "build=0.3 create=0.5",
+    },
+    "native-nodes": {
+        "inputs": {
+            "platforms": "linux/amd64 linux/arm64 linux/arm/v7",
+            "builder-name": "bench-nodes",
+            "builder-nodes": "linux/arm64=ssh://bench@arm-host",
+        },
+        "docker_delays": "build=0.3",
+    },
+    "zstd": {
+        "inputs": {
+            "platforms": "linux/amd64 linux/arm64",
+            "compression": "gzip",
+            "zstd-variant": "true",
+        },
+        "docker_delays": "build=0.3",
+    },
+    "separate-push": {
+        "inputs": {
+            "platforms": "linux/amd64 linux/arm64",
+            "separate-push": "true",
+        },
+        "docker_failures": "imagetools-create=1",
+    },
+    "mirror": {
+        "inputs": {
+            "registry-mirrors": "{mirror} ghcr.io=http://127.0.0.1:9",
+        },
+    },
+    "schedule": {"event": {"default_branch": ""}},
+    "promote": {
+        "inputs": {"promote": "true", "latest-on-tag": "true"},
+        "event": {"ref": "refs/tags/v1.0"},
+        "images": {
+            "ghcr.io/openzim/bench:dev": {
+                "linux/amd64": {"org.opencontainers.image.revision": SHA}
+            }
+        },
+    },
+}
+
+
+def read_action(path: pathlib.Path) -> Tuple[Dict[str, str], Dict[str, str], str]:
+    """(inputs defaults, step env, step run command) from action.yml
+
+    only handles the subset of YAML action.yml is written in"""
+    defaults, env, run = {}, {}, ""
+    section, current_input, in_env = "", None, False
+    for line in path.read_text().splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        indent = len(line) - len(line.lstrip())
+        key, _, value = line.strip().lstrip("- ").partition(":")
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+            value = value[1:-1]
+
+        if indent == 0:
+            section = key
+            continue
+        if section == "inputs":
+            if indent == 2:
+                current_input = key
+                defaults[key] = ""
+            elif key == "default":
+                defaults[current_input] = value
+        elif section == "runs":
+            if key == "run":
+                run = value
+            elif key == "env":
+                in_env = True
+            elif in_env and indent > 6:
+                env[key] = value
+            else:
+                in_env = False
+    return defaults, env, run
+
+
+def resolve(value: str, context: Dict[str, str]) -> str:
+    """value with ${{ expressions }} replaced from context, recursively"""
+
+    def replace(match):
+        return resolve(context.get(match.group(1), ""), context)
+
+    return re.sub(r"\$\{\{\s*([\w.-]+)\s*\}\}", replace, value)
+
+
+def prepare_workspace(folder: pathlib.Path):
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / "Dockerfile").write_text("FROM alpine:3\nCOPY README.md /\n")
+    (folder / "README.md").write_text("# bench image\n\nUsed for offline runs.\n")
+
+
+def make_docker_wrapper(folder: pathlib.Path):
+    """`docker` executable calling fake_docker.py"""
+    folder.mkdir(parents=True, exist_ok=True)
+    wrapper = folder / "docker"
+    wrapper.write_text(
+        '#!/bin/sh\nexec {} {} "$@"\n'.format(
+            sys.executable, ROOT / "bench" / "fake_docker.py"
+        )
+    )
+    wrapper.chmod(0o755)
+
+
+def run_scenario(
+    name: str, tmpdir: pathlib.Path, cache_dir: Optional[pathlib.Path] = None
+) -> Dict:
+    """run action once for scenario, returning its metrics, docker calls
+    and HTTP requests"""
+    scenario = SCENARIOS[name]
+    workspace, runner = tmpdir / "workspace", tmpdir / "runner"
+    prepare_workspace(workspace)
+    make_docker_wrapper(runner / "bin")
+    cache_dir = cache_dir or runner / "cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    images_file = runner / "images.json"
+    images_file.write_text(json.dumps(scenario.get("images", {})))
+
+    with StandIns(
+        latency=scenario.get("http_latency"),
+        failures=scenario.get("http_failures"),
+        retry_after=scenario.get("retry_after"),
+    ) as stand_ins:
+        event = {
+            "ref": "refs/heads/main",
+            "default_branch": "main",
+            **scenario.get("event", {}),
+        }
+        defaults, step_env, run = read_action(ROOT / "action.yml")
+        inputs = {**defaults, **BASE_INPUTS, **scenario.get("inputs", {})}
+        inputs = {
+            key: value.replace("{webhook}", f"{stand_ins.url}/webhook").replace(
+                "{mirror}", stand_ins.url
+            )
+            for key, value in inputs.items()
+        }
+        context = {f"inputs.{key}": value for key, value in inputs.items()}
+        context["github.token"] = "bench-token"
+        context["github.event.repository.default_branch"] = event["default_branch"]
+
+        env = {
+            "PATH": f"{runner / 'bin'}{os.pathsep}{os.getenv('PATH', '')}",
+            "HOME": str(runner),
+            "RUNNER_TEMP": str(runner),
+            "GITHUB_ACTION_PATH": str(ROOT),
+            "GITHUB_WORKSPACE": str(workspace),
+            "GITHUB_REPOSITORY": "openzim/bench",
+            "GITHUB_REF": event["ref"],
+            "GITHUB_SHA": SHA,
+            "GITHUB_ENV": str(runner / "github_env"),
+            "GITHUB_OUTPUT": str(runner / "github_output"),
+            "GITHUB_STEP_SUMMARY": str(runner / "step_summary.md"),
+            "HTTP_BASE_URL_OVERRIDES": stand_ins.get_overrides(),
+            "FAKE_DOCKER_LOG": str(runner / "docker.log"),
+            "FAKE_DOCKER_IMAGES": str(images_file),
+            # builder instances outlive the run, as on a self-hosted runner
+            "FAKE_DOCKER_BUILDERS": str(cache_dir / "fake-builders.json"),
+            "FAKE_DOCKER_DELAYS": scenario.get("docker_delays", ""),
+            "FAKE_DOCKER_FAILURES": scenario.get("docker_failures", ""),
+        }
+        env.update({key: resolve(value, context) for key, value in step_env.items()})
+        env["ACTION_CACHE_DIR"] = env.get("ACTION_CACHE_DIR") or str(cache_dir)
+        env["METRICS_FILE"] = str(runner / "metrics.json")
+
+        started_on = time.monotonic()
+        process = subprocess.run(
+            ["bash", "-c", run],
+            cwd=workspace,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+        wall = time.monotonic() - started_on
+
+        try:
+            metrics = json.loads((runner / "metrics.json").read_text())
+        except (IOError, ValueError):
+            metrics = {}
+        try:
+            docker = [
+                json.loads(line)
+                for line in (runner / "docker.log").read_text().splitlines()
+            ]
+        except IOError:
+            docker = []
+
+        return {
+            "scenario": name,
+            "returncode": process.returncode,
+            "output": process.stdout,
+            "wall": round(wall, 3),
+            "metrics": metrics,
+            "docker": docker,
+            "http": [
+                {"service": service, "method": method, "path": path, "status": status}
+                for service, method, path, status, _ in stand_ins.requests
+            ],
+            "hub_repositories": stand_ins.hub_repositories,
+            "webhook_payloads": stand_ins.webhook_payloads,
+            "images": json.loads(images_file.read_text()),
+        }
+
+
+def count_by(items: List[str]) -> str:
+    counts: Dict[str, int] = {}
+    for item in items:
+        counts[item] = counts.get(item, 0) + 1
+    return " ".join(f"{key}×{value}" for key, value in counts.items()) or "none"
+
+
+def report(name: str, results: List[Dict]):
+    print(f"== {name} ({len(results)} runs) ==")
+    failed = [result for result in results if result["returncode"] != 0]
+    if failed:
+        print(f"  {len(failed)} runs FAILED (exit {failed[0]['returncode']}):")
+        print("    " + "\n    ".join(failed[0]["output"].splitlines()[-15:]))
+
+    durations: Dict[str, List[float]] = {}
+    retries: Dict[str, int] = {}
+    for result in results:
+        for step in result["metrics"].get("steps", []):
+            durations.setdefault(step["name"], []).append(step["duration"])
+            retries[step["name"]] = retries.get(step["name"], 0) + step["retries"]
+
+    print(f"  {'stage':<36} {'median':>8} {'min':>8} {'max':>8} {'retries':>8}")
+    for stage, values in durations.items():
+        print(
+            f"  {stage:<36} {statistics.median(values):8.3f} {min(values):8.3f} "
+            f"{max(values):8.3f} {retries[stage] / len(results):8.1f}"
+        )
+    for label, values in (
+        ("action total", [r["metrics"].get("duration", 0) for r in results]),
+        ("process wall time", [r["wall"] for r in results]),
+    ):
+        print(
+            f"  {label:<36} {statistics.median(values):8.3f} {min(values):8.3f} "
+            f"{max(values):8.3f}"
+        )
+
+    last = results[-1]
+    print(f"  docker calls: {count_by([call['command'] for call in last['docker']])}")
+    requests = [
+        f"{request['service']} {request['method']} {request['status']}"
+        for request in last["http"]
+    ]
+    print(f"  http requests: {count_by(requests)}")
+    print()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="scenario to run (all by default)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario")
+    parser.add_argument(
+        "--cold",
+        action="store_true",
+        help="use an empty action cache for every run (warm after first by default)",
+    )
+    parser.add_argument("--json", help="write all results to this JSON file")
+    args = parser.parse_args(argv)
+
+    all_results, ret = {}, 0
+    for name in args.scenario or SCENARIOS:
+        results = []
+        with tempfile.TemporaryDirectory(prefix="docker-publish-bench-") as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            for index in range(args.repeat):
+                results.append(
+                    run_scenario(
+                        name,
+                        tmpdir / f"run-{index}",
+                        None if args.cold else tmpdir / "cache",
+                    )
+                )
+                shutil.rmtree(tmpdir / f"run-{index}", ignore_errors=True)
+        report(name, results)
+        all_results[name] = results
+        ret = ret or max(result["returncode"] for result in results)
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(all_results, fh, indent=2)
+    return ret
+
+
+if __name__ == "__main__":
+    sys.exit(main())
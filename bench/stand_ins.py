@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+""" Local HTTP stand-ins for GitHub API, docker.io's Hub API, webhook and mirror
+
+All are served by a single threaded server under /github, /hub and /webhook.
+Its root also answers registry API's /v2/ as a pull-through mirror would.
+Point the action to it with HTTP_BASE_URL_OVERRIDES (see `get_overrides()`).
+
+Latency (seconds) and failures (statuses returned to first requests) can be
+injected per service. """
+
+import base64
+import hashlib
+import http.server
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+SERVICES = ("github", "hub", "webhook", "v2")
+
+
+def make_jwt(lifetime: int = 3600) -> str:
+    """unsigned JWT expiring in lifetime seconds"""
+
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+    return "{}.{}.fake".format(
+        encode({"alg": "none"}), encode({"exp": int(time.time()) + lifetime})
+    )
+
+
+class StandIns:
+    def __init__(
+        self,
+        latency: Optional[Dict[str, float]] = None,
+        failures: Optional[Dict[str, List[int]]] = None,
+        retry_after: Optional[str] = None,
+    ):
+        self.latency = latency or {}
+        self.failures = {name: list(codes) for name, codes in (failures or {}).items()}
+        self.retry_after = retry_after
+        # (service, method, path, status, duration)
+        self.requests: List[Tuple[str, str, str, int, float]] = []
+        self.hub_repositories: Dict[str, Dict] = {}
+        self.webhook_payloads: List[Dict] = []
+        self.lock = threading.Lock()
+        self.server: Optional[http.server.ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def get_overrides(self) -> str:
+        """HTTP_BASE_URL_OVERRIDES value redirecting API hosts to stand-ins"""
+        return f"api.github.com={self.url}/github hub.docker.com={self.url}/hub"
+
+    def start(self):
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), make_handler(self)
+        )
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def count(self, service: str) -> int:
+        with self.lock:
+            return len([item for item in self.requests if item[0] == service])
+
+    def handle(
+        self, method: str, path: str, headers, body: bytes
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """(status, headers, body) response to a request"""
+        service, _, path = path.lstrip("/").partition("/")
+        path = "/" + path
+        time.sleep(self.latency.get(service, 0))
+
+        with self.lock:
+            failures = self.failures.get(service)
+            if failures:
+                extra = {"Retry-After": self.retry_after} if self.retry_after else {}
+                return failures.pop(0), extra, b'{"detail": "injected failure"}'
+
+        if service == "github" and method == "GET" and path.startswith("/repos/"):
+            return self.github_repository(path[len("/repos/") :], headers)
+
+        if service == "hub" and path == "/v2/users/login" and method == "POST":
+            return 200, {}, json.dumps({"token": make_jwt()}).encode()
+
+        if service == "hub" and path.startswith("/v2/repositories/"):
+            name = path[len("/v2/repositories/") :].strip("/")
+            with self.lock:
+                repository = self.hub_repositories.setdefault(
+                    name, {"name": name, "description": "", "full_description": ""}
+                )
+                if method == "PATCH":
+                    if not headers.get("Authorization"):
+                        return 401, {}, b'{"detail": "authentication required"}'
+                    repository.update(json.loads(body))
+                return 200, {}, json.dumps(repository).encode()
+
+        if service == "v2" and path == "/":
+            return 200, {"Docker-Distribution-Api-Version": "registry/2.0"}, b"{}"
+
+        if service == "webhook" and method == "POST":
+            with self.lock:
+                self.webhook_payloads.append(json.loads(body))
+            return 200, {}, b"{}"
+
+        return 404, {}, b'{"detail": "not found"}'
+
+    def github_repository(self, repository: str, headers):
+        data = json.dumps(
+            {
+                "full_name": repository,
+                "default_branch": "main",
+                "description": f"{repository} description",
+            }
+        ).encode()
+        etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"ETag": etag}, data
+
+
+def make_handler(stand_ins: StandIns):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def handle_request(self):
+            started_on = time.monotonic()
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            status, headers, data = stand_ins.handle(
+                self.command, self.path, self.headers, body
+            )
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            with stand_ins.lock:
+                stand_ins.requests.append(
+                    (
+                        self.path.lstrip("/").split("/", 1)[0],
+                        self.command,
+                        self.path,
+                        status,
+                        time.monotonic() - started_on,
+                    )
+                )
+
+        do_GET = do_POST = do_PATCH = handle_request
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,185 @@
+#!/usr/bin/env/python3
+
+""" Streaming display of buildx output, with memory use independent of its size
+
+buildx runs with `--progress rawjson`: each output line is a JSON update of
+the build steps (vertexes) and of their logs. Lines are handled as they come:
+- steps start, completion (duration or cached) and errors are displayed,
+  not their output
+- only the last `TAIL_LINES` of each running step's output are kept. They are
+  surfaced as an `::error` annotation if the step fails
+- all lines are written as-is to a gzip-compressed log file """
+
+import base64
+import binascii
+import collections
+import gzip
+import json
+import os
+import subprocess
+import time
+from typing import IO, Deque, Dict, List, Optional, Set, Tuple
+
+PROGRESS_ARGS = ["--progress", "rawjson"]
+TAIL_LINES = 30
+
+
+def escape_data(text: str) -> str:
+    """text as a workflow command message"""
+    return text.replace("%", "%25").replace("\r", "%0D").replace("\n", "%0A")
+
+
+def escape_property(text: str) -> str:
+    """text as a workflow command property (ex. title)"""
+    return escape_data(text).replace(":", "%3A").replace(",", "%2C")
+
+
+def decode(data: str) -> str:
+    """text of base64-encoded bytes from rawjson events"""
+    try:
+        return base64.b64decode(data).decode("utf-8", "replace")
+    except (ValueError, binascii.Error):
+        return data
+
+
+def get_log_file(logs_dir: str, image_name: str, name: str) -> str:
+    """path of the full log of build name (platform, `all`, etc.) of image_name"""
+    if not logs_dir:
+        return ""
+    slug = f"{image_name}-{name}".replace("/", "-").replace(":", "-")
+    return os.path.join(logs_dir, f"{slug}.log.gz")
+
+
+class BuildLog:
+    """compact display of a build's rawjson output, fed line by line
+
+    completed steps are only remembered by digest, their output is dropped
+    unless they failed"""
+
+    def __init__(self, name: str, prefix: str = "", tail_lines: int = TAIL_LINES):
+        self.name = name
+        self.prefix = prefix
+        self.tail_lines = tail_lines
+        # step digest to its number, in order of appearance
+        self.numbers: Dict[str, int] = {}
+        self.started_on: Dict[str, float] = {}
+        self.completed: Set[str] = set()
+        self.tails: Dict[str, Deque[str]] = {}
+        # (step name, error, output tail) of failed steps
+        self.failures: List[Tuple[str, str, List[str]]] = []
+        # lines that are not rawjson events (ex. buildx's own errors)
+        self.output: Deque[str] = collections.deque(maxlen=tail_lines)
+
+    def display(self, text: str):
+        print(f"{self.prefix}{text}")
+
+    def feed(self, line: str):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            event = None
+        if not isinstance(event, dict):
+            line = line.rstrip("\r\n")
+            if line:
+                self.display(line)
+                self.output.append(line)
+            return
+
+        # a step's last lines can come along with its completion
+        for log in event.get("logs") or []:
+            digest = log.get("vertex", "")
+            if digest in self.completed:
+                continue
+            if digest not in self.tails:
+                self.tails[digest] = collections.deque(maxlen=self.tail_lines)
+            self.tails[digest].extend(decode(log.get("data", "")).splitlines())
+        for vertex in event.get("vertexes") or []:
+            self.update_step(vertex)
+        for warning in event.get("warnings") or []:
+            number = self.numbers.get(warning.get("vertex", ""), 0)
+            self.display(f"#{number} WARNING: {decode(warning.get('short', ''))}")
+
+    def update_step(self, vertex: Dict):
+        digest = vertex.get("digest", "")
+        if digest in self.completed:
+            return
+        number = self.numbers.setdefault(digest, len(self.numbers) + 1)
+        name = vertex.get("name", "")
+        if not vertex.get("completed"):
+            if vertex.get("started") and digest not in self.started_on:
+                self.started_on[digest] = time.monotonic()
+                self.display(f"#{number} {name}")
+            return
+
+        self.completed.add(digest)
+        tail = list(self.tails.pop(digest, []))
+        if vertex.get("cached"):
+            self.started_on.pop(digest, None)
+            self.display(f"#{number} CACHED {name}")
+            return
+        if digest not in self.started_on:
+            self.display(f"#{number} {name}")
+        duration = time.monotonic() - self.started_on.pop(digest, time.monotonic())
+        if vertex.get("error"):
+            self.display(f"#{number} ERROR: {vertex['error']}")
+            self.failures.append((name, vertex["error"], tail))
+        else:
+            self.display(f"#{number} DONE {duration:.1f}s")
+
+    def annotate(self):
+        """`::error` annotations for failed steps, with their output tail
+
+        build's own output tail is used if no step failed"""
+        failures = self.failures or [("", "", list(self.output))]
+        for step, error, tail in failures:
+            title = f"{self.name}: {step}" if step else self.name
+            message = "\n".join(([error] if error else []) + tail)
+            # workflow commands are only parsed at beginning of lines
+            print(f"::error title={escape_property(title)}::{escape_data(message)}")
+
+
+def run_logged(cmd: List[str], name: str, log_file: str, prefix: str = "") -> int:
+    """run a buildx build or bake cmd (using PROGRESS_ARGS) through a BuildLog
+
+    its full output is written to log_file, if set. Returns its exit code"""
+    log = BuildLog(name, prefix)
+    fh: Optional[IO[str]] = None
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+        fh = gzip.open(log_file, "wt", encoding="utf-8")
+    try:
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            errors="replace",
+        )
+        for line in process.stdout:
+            if fh:
+                fh.write(line)
+            log.feed(line)
+        process.wait()
+    finally:
+        if fh:
+            fh.close()
+
+    if process.returncode != 0:
+        log.annotate()
+        if log_file:
+            print(f"{prefix}Full build log written to {log_file}")
+    return process.returncode
+
+
+def run_with_tail(cmd: List[str], tail_lines: int = TAIL_LINES) -> Tuple[int, str]:
+    """(exit code, last tail_lines of output) of cmd, keeping no more of it"""
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        errors="replace",
+    )
+    tail: Deque[str] = collections.deque(process.stdout, maxlen=tail_lines)
+    process.wait()
+    return process.returncode, "".join(tail)
@@ -0,0 +1,394 @@
+#!/usr/bin/env/python3
+
+""" buildx builder instances: named and persistent, or temporary
+
+A named builder is kept between runs so its BuildKit state (cache, pulled
+base images) stays warm on self-hosted runners. It is reused while healthy
+and configured the same, recreated otherwise.
+
+Nodes in `builder-nodes` are appended to it so their platforms build natively
+instead of under QEMU emulation.
+
+buildkitd config (tuning and `registry-mirrors`) applies to all builders
+created by the action. Mirrors are probed and their status logged, but all of
+them stay configured: BuildKit falls back to upstream registry on its own, and
+a mirror outage must not change the builder's config (and recreate it). """
+
+import hashlib
+import json
+import os
+import re
+import ssl
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Dict, List, Tuple
+
+from config import Config
+
+try:
+    import tomllib
+except ImportError:  # python < 3.11
+    tomllib = None
+
+DRIVER = "docker-container"
+# endpoints of buildkitd daemons (other endpoints are docker hosts or contexts)
+REMOTE_SCHEMES = ("tcp://",)
+PROBE_TIMEOUT = 5  # seconds
+
+# buildkitd config file written for this run, per config inputs
+_config_files: Dict[str, str] = {}
+_config_files_lock = threading.Lock()
+
+
+def read_buildkitd_config(value: str) -> str:
+    """buildkitd-config input: path to a TOML file or inline TOML"""
+    if value and "\n" not in value and os.path.isfile(value):
+        with open(value, "r") as fh:
+            return fh.read()
+    return value
+
+
+def parse_mirrors(items: List[str]) -> Dict[str, List[str]]:
+    """{registry: mirror URLs} from `[registry=]url` items (registry is docker.io)"""
+    mirrors: Dict[str, List[str]] = {}
+    for item in items:
+        registry, _, url = item.rpartition("=")
+        if "://" not in url:
+            url = f"https://{url}"
+        mirrors.setdefault(registry or "docker.io", []).append(url.rstrip("/"))
+    return mirrors
+
+
+def get_mirror_host(url: str) -> str:
+    """mirror as referenced in buildkitd config (ex. mirror.gcr.io:443/path)"""
+    parsed = urllib.parse.urlsplit(url)
+    return parsed.netloc + parsed.path
+
+
+def probe_mirror(url: str, insecure: bool = False) -> str:
+    """error reaching mirror's registry API, empty if it's up"""
+    context = None
+    if insecure and url.startswith("https://"):
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    try:
+        urllib.request.urlopen(f"{url}/v2/", timeout=PROBE_TIMEOUT, context=context)
+    except urllib.error.HTTPError as exc:
+        # authentication required still means registry is up
+        return f"HTTP {exc.code}" if exc.code >= 500 else ""
+    except (urllib.error.URLError, OSError) as exc:
+        return str(getattr(exc, "reason", exc))
+    return ""
+
+
+def log_mirrors(config: Config) -> Dict[str, List[str]]:
+    """registry-mirrors, logging whether each is reachable"""
+    mirrors = parse_mirrors(config.registry_mirrors)
+    for registry, urls in mirrors.items():
+        available = False
+        for url in urls:
+            error = probe_mirror(url, config.insecure_mirrors)
+            if error:
+                print(f"Mirror {url} for {registry} is unreachable ({error})")
+                continue
+            print(f"Using mirror {url} for {registry}")
+            available = True
+        if not available:
+            print(f"No mirror available for {registry}, BuildKit will pull upstream")
+    return mirrors
+
+
+def parse_buildkitd_config(value: str) -> Dict:
+    """buildkitd-config input as a dict, raising ValueError if it's invalid"""
+    text = read_buildkitd_config(value)
+    if not text.strip():
+        return {}
+    if tomllib is None:
+        raise ValueError("reading buildkitd-config requires python 3.11+")
+    # TOMLDecodeError is a ValueError
+    return tomllib.loads(text)
+
+
+def dump_toml_key(key: str) -> str:
+    return key if re.fullmatch(r"[A-Za-z0-9_-]+", key) else json.dumps(key)
+
+
+def dump_toml_value(value) -> str:
+    """TOML value of a buildkitd setting: string, number, boolean or array"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        # JSON strings escapes are valid in TOML basic strings
+        return json.dumps(value)
+    if isinstance(value, list):
+        return f"[{', '.join(dump_toml_value(item) for item in value)}]"
+    if isinstance(value, dict):
+        items = (f"{dump_toml_key(k)} = {dump_toml_value(v)}" for k, v in value.items())
+        return f"{{{', '.join(items)}}}"
+    raise ValueError(f"unsupported buildkitd-config value {value!r}")
+
+
+def is_table_array(value) -> bool:
+    return (
+        bool(value)
+        and isinstance(value, list)
+        and all(isinstance(item, dict) for item in value)
+    )
+
+
+def dump_toml(data: Dict, path: Tuple[str, ...] = (), header: str = "") -> List[str]:
+    """TOML lines of data, as a table at path (ex. `worker.oci`)
+
+    header is the table's own header line, if any (ex. `[[worker.oci.gcpolicy]]`)"""
+    lines = [header] if header else []
+    tables = []
+    for key, value in data.items():
+        if isinstance(value, dict) or is_table_array(value):
+            tables.append((key, value))
+        else:
+            lines.append(f"{dump_toml_key(key)} = {dump_toml_value(value)}")
+    for key, value in tables:
+        sub_path = path + (key,)
+        name = ".".join(dump_toml_key(part) for part in sub_path)
+        if isinstance(value, dict):
+            # tables only holding tables don't need a header
+            holds_values = not value or any(
+                not (isinstance(item, dict) or is_table_array(item))
+                for item in value.values()
+            )
+            lines += [""] if holds_values else []
+            lines += dump_toml(value, sub_path, f"[{name}]" if holds_values else "")
+        else:
+            for item in value:
+                lines += [""] + dump_toml(item, sub_path, f"[[{name}]]")
+    return lines
+
+
+def get_buildkitd_config(config: Config, mirrors=None) -> str:
+    """buildkitd TOML config: buildkitd-config with tuning inputs merged into it
+
+    inputs override buildkitd-config settings, mirrors are appended to its own.
+    mirrors are {registry: mirror URLs} to pull through, then from registry"""
+    settings = parse_buildkitd_config(config.buildkitd_config)
+    worker = {}
+    if config.buildkitd_max_parallelism:
+        worker["max-parallelism"] = int(config.buildkitd_max_parallelism)
+    if config.buildkitd_gc_keep_storage:
+        worker.update(gc=True, gckeepstorage=config.buildkitd_gc_keep_storage)
+    if worker:
+        settings.setdefault("worker", {}).setdefault("oci", {}).update(worker)
+
+    for registry, urls in (mirrors or {}).items():
+        registries = settings.setdefault("registry", {})
+        hosts = registries.setdefault(registry, {}).setdefault("mirrors", [])
+        hosts += [
+            get_mirror_host(url) for url in urls if get_mirror_host(url) not in hosts
+        ]
+        for url in urls:
+            options = registries.setdefault(get_mirror_host(url), {})
+            if url.startswith("http://"):
+                options["http"] = True
+            if config.insecure_mirrors:
+                options["insecure"] = True
+
+    text = "\n".join(dump_toml(settings)).strip()
+    return text + "\n" if text else ""
+
+
+def get_buildkitd_file(config: Config) -> str:
+    """path to buildkitd config for builders to create, empty if there's none
+
+    written (and mirrors probed) once per run"""
+    key = json.dumps(
+        [
+            config.buildkitd_config,
+            config.buildkitd_max_parallelism,
+            config.buildkitd_gc_keep_storage,
+            config.registry_mirrors,
+            config.insecure_mirrors,
+        ]
+    )
+    with _config_files_lock:
+        if key not in _config_files:
+            text = get_buildkitd_config(config, log_mirrors(config))
+            path = ""
+            if text:
+                digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+                folder = config.get_cache_dir() / "builders"
+                folder.mkdir(parents=True, exist_ok=True)
+                path = str(folder / f"buildkitd-{digest}.toml")
+                with open(path, "w") as fh:
+                    fh.write(text)
+            _config_files[key] = path
+        return _config_files[key]
+
+
+def get_config_args(config: Config) -> List[str]:
+    """`buildx create` arguments for buildkitd config, if any"""
+    path = get_buildkitd_file(config)
+    return ["--buildkitd-config", path] if path else []
+
+
+def get_node_platforms(config: Config) -> List[str]:
+    """platforms built natively on builder-nodes"""
+    return [
+        platform
+        for platforms in config.builder_nodes
+        for platform in platforms.split(",")
+    ]
+
+
+def get_platforms_without_node(config: Config, platforms: List[str]) -> List[str]:
+    """platforms no node can build: only with remote driver, lacking a local node"""
+    if get_driver(config) == DRIVER:
+        return []
+    node_platforms = get_node_platforms(config)
+    return [platform for platform in platforms if platform not in node_platforms]
+
+
+def get_driver(config: Config) -> str:
+    """buildx driver for builder-name: remote if nodes are buildkitd daemons"""
+    if config.builder_nodes and all(
+        endpoint.startswith(REMOTE_SCHEMES)
+        for endpoint in config.builder_nodes.values()
+    ):
+        return "remote"
+    return DRIVER
+
+
+def get_create_commands(config: Config, buildkitd_file: str = "") -> List[List[str]]:
+    """`buildx create` commands for builder-name and its nodes
+
+    with docker-container driver, local node comes first, serving platforms
+    without a node. With remote driver, there's no local node: nodes must serve
+    all platforms. buildkitd config only applies to nodes run by buildx"""
+    name = config.builder_name
+    driver = get_driver(config)
+    args = ["--driver", driver]
+    for key, value in config.builder_driver_opts.items():
+        args += ["--driver-opt", f"{key}={value}"]
+    if buildkitd_file and driver == DRIVER:
+        args += ["--buildkitd-config", buildkitd_file]
+
+    commands = []
+    if driver == DRIVER:
+        commands.append(["docker", "buildx", "create", "--name", name] + args)
+    for platforms, endpoint in config.builder_nodes.items():
+        node = f"{name}-{platforms.split(',')[0].replace('/', '-')}"
+        commands.append(
+            ["docker", "buildx", "create", "--name", name]
+            + (["--append"] if commands else [])
+            + args
+            + ["--node", node, "--platform", platforms, endpoint]
+        )
+    return commands
+
+
+def get_builder_hash(commands: List[List[str]]) -> str:
+    """digest of a builder's configuration, to detect changes
+
+    buildkitd config file is named after its content"""
+    return hashlib.sha256(json.dumps(commands).encode("utf-8")).hexdigest()
+
+
+def is_healthy(name: str) -> bool:
+    """whether builder exists and all its nodes are running (started if needed)"""
+    inspect = subprocess.run(
+        ["docker", "buildx", "inspect", "--bootstrap", name],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    if inspect.returncode != 0:
+        return False
+    statuses = [
+        line.split(":", 1)[1].strip()
+        for line in inspect.stdout.splitlines()
+        if line.strip().startswith("Status:")
+    ]
+    return bool(statuses) and all(status == "running" for status in statuses)
+
+
+def remove_builder(name: str):
+    subprocess.run(
+        ["docker", "buildx", "rm", name],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def ensure_builder(config: Config) -> int:
+    """reuse or create the builder-name builder, making it config's builder"""
+    name = config.builder_name
+    state_dir = config.get_cache_dir() / "builders"
+    if get_driver(config) == DRIVER:
+        commands = get_create_commands(config, get_buildkitd_file(config))
+    else:
+        if config.registry_mirrors:
+            print("registry-mirrors are to be configured on buildkitd nodes")
+        commands = get_create_commands(config)
+    builder_hash = get_builder_hash(commands)
+    state_file = state_dir / f"{name}.json"
+
+    try:
+        with open(state_file, "r") as fh:
+            previous_hash = json.load(fh).get("hash")
+    except (IOError, ValueError):
+        previous_hash = None
+
+    if is_healthy(name):
+        if previous_hash == builder_hash:
+            print(f"Using existing builder instance {name}")
+            config.builder = name
+            return 0
+        print(f"Builder instance {name} configuration changed, recreating it")
+    else:
+        print(f"Builder instance {name} is missing or not running, (re)creating it")
+    remove_builder(name)
+
+    for cmd in commands:
+        print(f"Running: {' '.join(cmd)}")
+        create = subprocess.run(cmd)
+        if create.returncode != 0:
+            print(f"Unable to create builder instance {name}: {create.returncode}")
+            return create.returncode
+
+    # starts all nodes, failing if one of them is unreachable
+    if not is_healthy(name):
+        print(f"Builder instance {name} is not running, a node may be unreachable")
+        return 1
+    state_dir.mkdir(parents=True, exist_ok=True)
+    with open(state_file, "w") as fh:
+        json.dump({"hash": builder_hash}, fh)
+    config.builder = name
+    return 0
+
+
+def create_builder(name: str, config: Config) -> int:
+    """create a docker-container builder using config's buildkitd config"""
+    config_args = get_config_args(config)
+    print(f"Create builder instance {name}")
+    return subprocess.run(
+        ["docker", "buildx", "create", "--name", name, "--driver", DRIVER] + config_args
+    ).returncode
+
+
+def create_temporary_builder(config: Config) -> str:
+    """create a builder for this run only, returning its name (empty on failure)"""
+    name = f"docker-publish-{os.getpid()}"
+    return name if create_builder(name, config) == 0 else ""
+
+
+if __name__ == "__main__":
+    config = Config.from_env()
+    if not config.builder_name:
+        print("no builder-name, skipping.")
+        sys.exit(0)
+    sys.exit(ensure_builder(config))
@@ -1,83 +1,180 @@
 #!/usr/bin/env python3
 
-import json
-import os
 import sys
-import urllib.request
 
+from batch import get_setup_config, parse_batch
+from builder import (
+    REMOTE_SCHEMES,
+    get_platforms_without_node,
+    parse_buildkitd_config,
+)
+from config import Config
+from github_api import get_repository
 
-def get_main_branch(repository):
-    url = "https://api.github.com/repos/{repository}".format(repository=repository)
-    with urllib.request.urlopen(url) as uh:
-        return json.load(uh).get("default_branch", None)
 
+def get_main_branch(repository, config):
+    return get_repository(repository, config).get("default_branch", None)
 
-def getenv(name, default=None):
-    """default branch is only available on repo-related trigger events (not schedule)"""
-    if name == "DEFAULT_BRANCH":
-        return (
-            os.getenv(name)
-            or get_main_branch(os.getenv("GITHUB_REPOSITORY"))
-            or default
-        )
-    return os.getenv(name, default)
 
+def check(config: Config) -> int:
+    """validate config, completing it with runner-provided info"""
 
-def main():
-    required_inputs = [
-        "IMAGE_NAME",
-        "REGISTRIES",
-        "CREDENTIALS",
-        "CONTEXT",
-        "DOCKERFILE",
-        "PLATFORMS",
-        "LATEST_ON_TAG",
-        "GITHUB_ENV",
-        "GITHUB_REF",
-        "GITHUB_ACTION_PATH",
-        "GITHUB_REPOSITORY",
-        "DEFAULT_BRANCH",
-    ]
-    optional_inputs = [
-        "ON_MASTER",
-        "BUILD_ARGS",
-        "TAG_PATTERN",
-        "MANUAL_TAG",
-        "RESTRICT_TO",
-        "DOCKER_BUILDX_VERSION",
-        "WEBHOOK_URL",
-        "REPO_DESCRIPTION",
-        "REPO_FULL_DESCRIPTION",
-        "SHOULD_UPDATE_DOCKERIO",
-    ]
+    # default branch is only available on repo-related trigger events (not schedule)
+    if not config.default_branch and config.github_repository:
+        config.default_branch = get_main_branch(config.github_repository, config) or ""
+
+    required_inputs = {
+        "IMAGE_NAME": config.image_name,
+        "REGISTRIES": config.registries,
+        "CREDENTIALS": config.credentials,
+        "CONTEXT": config.context,
+        "DOCKERFILE": config.dockerfile,
+        "PLATFORMS": config.platforms,
+        "GITHUB_ENV": config.github_env,
+        "GITHUB_REF": config.github_ref,
+        "GITHUB_ACTION_PATH": config.github_action_path,
+        "GITHUB_REPOSITORY": config.github_repository,
+        "DEFAULT_BRANCH": config.default_branch,
+    }
+
+    # images (and their context, dockerfile, platforms) are set in batch
+    if config.batch:
+        del required_inputs["IMAGE_NAME"]
 
     # fail early if missing this required info
-    for env in required_inputs:
-        if not getenv(env):
+    for env, value in required_inputs.items():
+        if not value:
             print(f"missing param `{env}`, exiting.")
             return 1
 
     # `RESTRICT_TO` env prevents this from running from forked repositories
-    if getenv("RESTRICT_TO") and getenv("GITHUB_REPOSITORY") != getenv("RESTRICT_TO"):
-        print("not triggered on restricted-to repo, skipping.", getenv("RESTRICT_TO"))
+    if config.restrict_to and config.github_repository != config.restrict_to:
+        print("not triggered on restricted-to repo, skipping.", config.restrict_to)
+        return 1
+
+    if config.cache not in ("inline", "registry", "local", "none"):
+        print(f"invalid cache `{config.cache}`, exiting.")
+        return 1
+
+    if config.cache_mode not in ("min", "max"):
+        print(f"invalid cache-mode `{config.cache_mode}`, exiting.")
+        return 1
+
+    if config.cache == "local" and not config.cache_path:
+        print("missing param `CACHE_PATH` for local cache, exiting.")
+        return 1
+
+    if config.max_parallel and (
+        not config.max_parallel.isdigit() or int(config.max_parallel) < 1
+    ):
+        print(f"invalid max-parallel `{config.max_parallel}`, exiting.")
         return 1
 
-    if "docker.io" in getenv("REGISTRIES", "").split() and (
-        getenv("REPO_DESCRIPTION") or getenv("REPO_FULL_DESCRIPTION")
+    for name, value in (
+        ("retry-attempts", config.retry_attempts),
+        ("retry-deadline", config.retry_deadline),
+        ("buildkitd-max-parallelism", config.buildkitd_max_parallelism),
     ):
-        os.environ["SHOULD_UPDATE_DOCKERIO"] = "1"
+        if value and (not value.isdigit() or int(value) < 1):
+            print(f"invalid {name} `{value}`, exiting.")
+            return 1
+
+    try:
+        parse_buildkitd_config(config.buildkitd_config)
+    except ValueError as exc:
+        print(f"invalid buildkitd-config: {exc}, exiting.")
+        return 1
+
+    if config.compression not in ("", "gzip", "zstd", "estargz", "uncompressed"):
+        print(f"invalid compression `{config.compression}`, exiting.")
+        return 1
+
+    if config.compression_level and not config.compression_level.isdigit():
+        print(f"invalid compression-level `{config.compression_level}`, exiting.")
+        return 1
+
+    if config.mode not in ("build", "build-shard", "merge"):
+        print(f"invalid mode `{config.mode}`, exiting.")
+        return 1
+
+    if config.mode == "build-shard" and len(config.platforms) != 1:
+        print("build-shard mode requires a single platform in `PLATFORMS`, exiting.")
+        return 1
 
-    with open(getenv("GITHUB_ENV"), "a") as fh:
-        for env in required_inputs + optional_inputs:
-            # don't write credentials to shared env! nor don't overwrite GH ones
-            if env == "CREDENTIALS" or env.startswith("GITHUB_"):
-                continue
+    if config.builder_nodes:
+        if not config.builder_name:
+            print("builder-nodes requires `BUILDER_NAME`, exiting.")
+            return 1
+        # a builder's nodes all use the same driver
+        remote = [
+            endpoint.startswith(REMOTE_SCHEMES)
+            for endpoint in config.builder_nodes.values()
+        ]
+        if any(remote) and not all(remote):
+            print("builder-nodes can't mix buildkitd and docker endpoints, exiting.")
+            return 1
+
+    if config.zstd_variant:
+        if config.mode != "build" or config.parallel:
+            print("zstd-variant is only supported in build mode, exiting.")
+            return 1
+        # reusing a published image would leave its variant out of date
+        if config.promote or config.skip_unchanged:
+            print("zstd-variant can't be used with promote or skip-unchanged.")
+            return 1
+
+    if config.separate_push:
+        if config.mode != "build" or config.parallel:
+            print("separate-push is only supported in build mode, exiting.")
+            return 1
+        # those push while building
+        if config.bake or config.zstd_variant:
+            print("separate-push can't be used with bake or zstd-variant.")
+            return 1
+
+    if config.bake and config.mode != "build":
+        print(f"bake is not supported in {config.mode} mode, exiting.")
+        return 1
+
+    platforms = config.platforms
+    if config.batch:
+        if config.mode != "build":
+            print(f"batch is not supported in {config.mode} mode, exiting.")
+            return 1
+        try:
+            platforms = get_setup_config(config, parse_batch(config)).platforms
+        except ValueError as exc:
+            print(f"invalid batch: {exc}, exiting.")
+            return 1
+
+    # buildkitd nodes replace the local one, QEMU included
+    missing = get_platforms_without_node(config, platforms)
+    if missing:
+        print(f"builder-nodes has no node for {', '.join(missing)}, exiting.")
+        return 1
+
+    return 0
+
+
+def write_env(config: Config):
+    """store inputs in GITHUB_ENV for next steps"""
+    with open(config.github_env, "a") as fh:
+        # don't write credentials to shared env! nor don't overwrite GH ones
+        for env, value in config.to_env().items():
             fh.write(
                 "{env}={value}\n".format(
-                    env=env, value=" ".join(getenv(env, "").strip().split("\n"))
+                    env=env, value=" ".join(value.strip().split("\n"))
                 )
             )
 
+
+def main():
+    config = Config.from_env()
+    ret = check(config)
+    if ret != 0:
+        return ret
+
+    write_env(config)
     return 0
 
 
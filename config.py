@@ -0,0 +1,270 @@
+#!/usr/bin/env/python3
+
+""" Action configuration, parsed once from environ """
+
+import os
+import pathlib
+import tempfile
+import dataclasses
+from typing import Dict, List, Optional, Tuple
+
+from retry import RetryPolicy
+
+
+def parse_key_values(text: str) -> Dict[str, str]:
+    """dict from space or newline separated `key=value` items"""
+    return dict(
+        [
+            [x.strip() for x in item.split("=", 1)]
+            if "=" in item
+            else (item.strip(), "")
+            for item in text.split()
+        ]
+    )
+
+
+def getenv_bool(name: str) -> bool:
+    return os.getenv(name, "").lower() == "true"
+
+
+@dataclasses.dataclass
+class Config:
+    image_name: str = ""
+    registries: List[str] = dataclasses.field(default_factory=list)
+    credentials: Dict[str, str] = dataclasses.field(default_factory=dict)
+    context: str = "."
+    dockerfile: str = "Dockerfile"
+    build_args: Dict[str, str] = dataclasses.field(default_factory=dict)
+    platforms: List[str] = dataclasses.field(default_factory=list)
+    on_master: str = ""
+    tag_pattern: str = ""
+    latest_on_tag: bool = False
+    manual_tag: str = ""
+    restrict_to: str = ""
+    default_branch: str = ""
+    webhook_url: str = ""
+    repo_description: Optional[str] = None
+    repo_full_description: Optional[str] = None
+    cache: str = "inline"
+    cache_mode: str = "max"
+    cache_path: str = ""
+    parallel: bool = False
+    max_parallel: str = ""
+    mode: str = "build"
+    shards_dir: str = ""
+    action_cache_dir: str = ""
+    binfmt_image: str = ""
+    buildx_version: str = "0.31.1"
+    retry_attempts: str = ""
+    retry_deadline: str = ""
+    metrics_file: str = ""
+    build_logs_dir: str = ""
+    skip_unchanged: bool = False
+    promote: bool = False
+    batch: str = ""
+    bake: bool = False
+    target: str = ""
+    builder_name: str = ""
+    builder_driver_opts: Dict[str, str] = dataclasses.field(default_factory=dict)
+    builder_nodes: Dict[str, str] = dataclasses.field(default_factory=dict)
+    buildkitd_config: str = ""
+    buildkitd_max_parallelism: str = ""
+    buildkitd_gc_keep_storage: str = ""
+    registry_mirrors: List[str] = dataclasses.field(default_factory=list)
+    insecure_mirrors: bool = False
+    compression: str = ""
+    compression_level: str = ""
+    force_compression: bool = False
+    oci_mediatypes: bool = False
+    zstd_variant: bool = False
+    separate_push: bool = False
+
+    # runner-provided
+    github_ref: str = ""
+    github_repository: str = ""
+    github_workspace: str = ""
+    github_action_path: str = ""
+    github_env: str = ""
+    github_token: str = ""
+    github_step_summary: str = ""
+    github_sha: str = ""
+    github_run_id: str = ""
+    github_job: str = ""
+
+    # found by find_tag
+    tag: str = ""
+    latest: bool = False
+
+    # builder instance to build on, shared by batch images
+    builder: str = ""
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        return cls(
+            image_name=os.getenv("IMAGE_NAME", ""),
+            registries=os.getenv("REGISTRIES", "").split(),
+            credentials=parse_key_values(os.getenv("CREDENTIALS", "")),
+            context=os.getenv("CONTEXT") or ".",
+            dockerfile=os.getenv("DOCKERFILE") or "Dockerfile",
+            build_args=parse_key_values(os.getenv("BUILD_ARGS", "")),
+            platforms=os.getenv("PLATFORMS", "").split(),
+            on_master=os.getenv("ON_MASTER", ""),
+            tag_pattern=os.getenv("TAG_PATTERN", ""),
+            latest_on_tag=getenv_bool("LATEST_ON_TAG"),
+            manual_tag=os.getenv("MANUAL_TAG", ""),
+            restrict_to=os.getenv("RESTRICT_TO", ""),
+            default_branch=os.getenv("DEFAULT_BRANCH", ""),
+            webhook_url=os.getenv("WEBHOOK_URL", ""),
+            repo_description=os.getenv("REPO_DESCRIPTION") or None,
+            repo_full_description=os.getenv("REPO_FULL_DESCRIPTION") or None,
+            cache=os.getenv("CACHE") or "inline",
+            cache_mode=os.getenv("CACHE_MODE") or "max",
+            cache_path=os.getenv("CACHE_PATH", ""),
+            parallel=getenv_bool("PARALLEL"),
+            max_parallel=os.getenv("MAX_PARALLEL", ""),
+            mode=os.getenv("MODE") or "build",
+            shards_dir=os.getenv("SHARDS_DIR", ""),
+            action_cache_dir=os.getenv("ACTION_CACHE_DIR", ""),
+            binfmt_image=os.getenv("BINFMT_IMAGE", ""),
+            buildx_version=os.getenv("DOCKER_BUILDX_VERSION") or "0.31.1",
+            retry_attempts=os.getenv("RETRY_ATTEMPTS", ""),
+            retry_deadline=os.getenv("RETRY_DEADLINE", ""),
+            metrics_file=os.getenv("METRICS_FILE", ""),
+            build_logs_dir=os.getenv("BUILD_LOGS_DIR", ""),
+            skip_unchanged=getenv_bool("SKIP_UNCHANGED"),
+            promote=getenv_bool("PROMOTE"),
+            batch=os.getenv("BATCH", ""),
+            bake=getenv_bool("BAKE"),
+            target=os.getenv("TARGET", ""),
+            builder_name=os.getenv("BUILDER_NAME", ""),
+            builder_driver_opts=parse_key_values(os.getenv("BUILDER_DRIVER_OPTS", "")),
+            builder_nodes=parse_key_values(os.getenv("BUILDER_NODES", "")),
+            buildkitd_config=os.getenv("BUILDKITD_CONFIG", ""),
+            buildkitd_max_parallelism=os.getenv("BUILDKITD_MAX_PARALLELISM", ""),
+            buildkitd_gc_keep_storage=os.getenv("BUILDKITD_GC_KEEP_STORAGE", ""),
+            registry_mirrors=os.getenv("REGISTRY_MIRRORS", "").split(),
+            insecure_mirrors=getenv_bool("INSECURE_MIRRORS"),
+            compression=os.getenv("COMPRESSION", ""),
+            compression_level=os.getenv("COMPRESSION_LEVEL", ""),
+            force_compression=getenv_bool("FORCE_COMPRESSION"),
+            oci_mediatypes=getenv_bool("OCI_MEDIATYPES"),
+            zstd_variant=getenv_bool("ZSTD_VARIANT"),
+            separate_push=getenv_bool("SEPARATE_PUSH"),
+            github_ref=os.getenv("GITHUB_REF", ""),
+            github_repository=os.getenv("GITHUB_REPOSITORY", ""),
+            github_workspace=os.getenv("GITHUB_WORKSPACE", ""),
+            github_action_path=os.getenv("GITHUB_ACTION_PATH", ""),
+            github_env=os.getenv("GITHUB_ENV", ""),
+            github_token=os.getenv("GITHUB_TOKEN", ""),
+            github_step_summary=os.getenv("GITHUB_STEP_SUMMARY", ""),
+            github_sha=os.getenv("GITHUB_SHA", ""),
+            github_run_id=os.getenv("GITHUB_RUN_ID", ""),
+            github_job=os.getenv("GITHUB_JOB", ""),
+            tag=os.getenv("DOCKER_TAG", "").strip(),
+            latest=getenv_bool("DOCKER_TAG_LATEST"),
+        )
+
+    def to_env(self) -> Dict[str, str]:
+        """inputs as environ variables for steps run after the action
+
+        credentials are never included"""
+        return {
+            "IMAGE_NAME": self.image_name,
+            "REGISTRIES": " ".join(self.registries),
+            "CONTEXT": self.context,
+            "DOCKERFILE": self.dockerfile,
+            "PLATFORMS": " ".join(self.platforms),
+            "LATEST_ON_TAG": str(self.latest_on_tag).lower(),
+            "DEFAULT_BRANCH": self.default_branch,
+            "ON_MASTER": self.on_master,
+            "BUILD_ARGS": " ".join(
+                f"{key}={value}" for key, value in self.build_args.items()
+            ),
+            "TAG_PATTERN": self.tag_pattern,
+            "MANUAL_TAG": self.manual_tag,
+            "RESTRICT_TO": self.restrict_to,
+            "DOCKER_BUILDX_VERSION": self.buildx_version,
+            "WEBHOOK_URL": self.webhook_url,
+            "REPO_DESCRIPTION": self.repo_description or "",
+            "REPO_FULL_DESCRIPTION": self.repo_full_description or "",
+            "SHOULD_UPDATE_DOCKERIO": "1" if self.should_update_dockerio else "",
+            "CACHE": self.cache,
+            "CACHE_MODE": self.cache_mode,
+            "CACHE_PATH": self.cache_path,
+            "PARALLEL": str(self.parallel).lower(),
+            "MAX_PARALLEL": self.max_parallel,
+            "MODE": self.mode,
+            "SHARDS_DIR": self.shards_dir,
+            "ACTION_CACHE_DIR": self.action_cache_dir,
+            "BINFMT_IMAGE": self.binfmt_image,
+            "RETRY_ATTEMPTS": self.retry_attempts,
+            "RETRY_DEADLINE": self.retry_deadline,
+            "METRICS_FILE": self.get_metrics_file(),
+            "BUILD_LOGS_DIR": self.get_build_logs_dir(),
+            "SKIP_UNCHANGED": str(self.skip_unchanged).lower(),
+            "PROMOTE": str(self.promote).lower(),
+            "BATCH": self.batch,
+            "BAKE": str(self.bake).lower(),
+            "TARGET": self.target,
+            "BUILDER_NAME": self.builder_name,
+            "BUILDER_DRIVER_OPTS": " ".join(
+                f"{key}={value}" for key, value in self.builder_driver_opts.items()
+            ),
+            "BUILDER_NODES": " ".join(
+                f"{key}={value}" for key, value in self.builder_nodes.items()
+            ),
+            "BUILDKITD_MAX_PARALLELISM": self.buildkitd_max_parallelism,
+            "BUILDKITD_GC_KEEP_STORAGE": self.buildkitd_gc_keep_storage,
+            "REGISTRY_MIRRORS": " ".join(self.registry_mirrors),
+            "INSECURE_MIRRORS": str(self.insecure_mirrors).lower(),
+            "COMPRESSION": self.compression,
+            "COMPRESSION_LEVEL": self.compression_level,
+            "FORCE_COMPRESSION": str(self.force_compression).lower(),
+            "OCI_MEDIATYPES": str(self.oci_mediatypes).lower(),
+            "ZSTD_VARIANT": str(self.zstd_variant).lower(),
+            "SEPARATE_PUSH": str(self.separate_push).lower(),
+        }
+
+    @property
+    def should_update_dockerio(self) -> bool:
+        return "docker.io" in self.registries and bool(
+            self.repo_description or self.repo_full_description
+        )
+
+    def get_credentials(self, registry: str) -> Tuple[str, str]:
+        """Username, password for a registry"""
+        prefix = registry.upper().replace(".", "")
+        return (
+            self.credentials.get(f"{prefix}_USERNAME", ""),
+            self.credentials.get(f"{prefix}_TOKEN", ""),
+        )
+
+    def get_cache_dir(self) -> pathlib.Path:
+        """persistent folder for action's downloads and state"""
+        return pathlib.Path(
+            self.action_cache_dir
+            or pathlib.Path(os.getenv("HOME")) / ".cache" / "docker-publish-action"
+        )
+
+    def get_metrics_file(self) -> str:
+        """path to write JSON metrics to"""
+        return self.metrics_file or os.path.join(
+            os.getenv("RUNNER_TEMP") or tempfile.gettempdir(),
+            "docker-publish-metrics.json",
+        )
+
+    def get_build_logs_dir(self) -> str:
+        """folder to write full (compressed) build logs to"""
+        return self.build_logs_dir or os.path.join(
+            os.getenv("RUNNER_TEMP") or tempfile.gettempdir(),
+            "docker-publish-logs",
+        )
+
+    def get_retry_policy(self) -> RetryPolicy:
+        """retry policy for HTTP calls, using inputs limits"""
+        policy = RetryPolicy()
+        if self.retry_attempts:
+            policy.max_attempts = int(self.retry_attempts)
+        if self.retry_deadline:
+            policy.deadline = float(self.retry_deadline)
+        return policy
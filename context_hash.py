@@ -0,0 +1,210 @@
+#!/usr/bin/env/python3
+
+""" Content hash of a build: context (honouring .dockerignore), Dockerfile,
+build args and platforms
+
+Files digests are cached along with their mtime and size so unchanged
+files are not read again on next runs. """
+
+import hashlib
+import json
+import os
+import pathlib
+import re
+import stat
+import tempfile
+from typing import Dict, List, Optional, Pattern, Tuple
+
+LABEL = "org.openzim.docker-publish.context-hash"
+CHUNK_SIZE = 2**20
+
+
+def read_dockerignore(context: str, dockerfile: str) -> List[str]:
+    """ignore patterns, from <Dockerfile>.dockerignore or context's .dockerignore"""
+    for path in (f"{dockerfile}.dockerignore", os.path.join(context, ".dockerignore")):
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                lines = fh.read().splitlines()
+        except IOError:
+            continue
+        return [
+            line.strip()
+            for line in lines
+            if line.strip() and not line.strip().startswith("#")
+        ]
+    return []
+
+
+def translate_pattern(pattern: str) -> Pattern:
+    """regex for a .dockerignore pattern (Go's filepath.Match plus `**`)"""
+    pattern = os.path.normpath(pattern.strip("/")).replace(os.sep, "/")
+    regex, index = "", 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**", index):
+            index += 2
+            # `**/` also matches no directory at all
+            if pattern.startswith("/", index):
+                index += 1
+                regex += "(?:.*/)?"
+            else:
+                regex += ".*"
+            continue
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[":
+            end = pattern.find("]", index + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                klass = pattern[index + 1 : end]
+                if klass.startswith("!"):
+                    klass = "^" + klass[1:]
+                regex += f"[{klass}]"
+                index = end
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            regex += re.escape(pattern[index])
+        else:
+            regex += re.escape(char)
+        index += 1
+    # matching a folder excludes its content
+    return re.compile(f"^{regex}(?:/.*)?$")
+
+
+class DockerIgnore:
+    """whether a context-relative path is excluded, last matching pattern wins"""
+
+    def __init__(self, patterns: List[str]):
+        self.rules: List[Tuple[bool, Pattern]] = []
+        for pattern in patterns:
+            negated = pattern.startswith("!")
+            pattern = pattern[1:].strip() if negated else pattern
+            if pattern:
+                self.rules.append((negated, translate_pattern(pattern)))
+
+    def is_excluded(self, path: str) -> bool:
+        excluded = False
+        for negated, regex in self.rules:
+            if regex.match(path):
+                excluded = not negated
+        return excluded
+
+    def has_exceptions(self) -> bool:
+        return any(negated for negated, _ in self.rules)
+
+
+def list_files(context: str, ignore: DockerIgnore) -> List[str]:
+    """context-relative paths of files (and symlinks) sent to builder, sorted"""
+    files = []
+    for root, dirs, filenames in os.walk(context):
+        rel_root = os.path.relpath(root, context).replace(os.sep, "/")
+        rel_root = "" if rel_root == "." else f"{rel_root}/"
+        # excluded folders can only be skipped if no `!` pattern re-includes
+        if not ignore.has_exceptions():
+            dirs[:] = [name for name in dirs if not ignore.is_excluded(rel_root + name)]
+        for name in filenames + [
+            name for name in dirs if os.path.islink(os.path.join(root, name))
+        ]:
+            if not ignore.is_excluded(rel_root + name):
+                files.append(rel_root + name)
+    return sorted(files)
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DigestCache:
+    """{path: (mtime_ns, size, digest)} of a context, persisted as JSON"""
+
+    def __init__(self, path: Optional[pathlib.Path]):
+        self.path = path
+        self.entries: Dict[str, List] = {}
+        self.hits = 0
+        if path:
+            try:
+                with open(path, "r") as fh:
+                    self.entries = json.load(fh)
+            except (IOError, ValueError):
+                self.entries = {}
+
+    def get_digest(self, path: str, stats: os.stat_result) -> str:
+        entry = self.entries.get(path)
+        if entry and entry[:2] == [stats.st_mtime_ns, stats.st_size]:
+            self.hits += 1
+            return entry[2]
+        digest = hash_file(path)
+        self.entries[path] = [stats.st_mtime_ns, stats.st_size, digest]
+        return digest
+
+    def save(self, paths: List[str]):
+        """persist entries, keeping only those of paths"""
+        if not self.path:
+            return
+        self.entries = {path: self.entries[path] for path in paths}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".hash-")
+            with os.fdopen(fd, "w") as fh:
+                json.dump(self.entries, fh)
+            os.replace(tmp_path, self.path)
+        except IOError as exc:
+            print(f"Unable to save context digests cache: {exc}")
+
+
+def get_context_hash(
+    context: str,
+    dockerfile: str,
+    build_args: Dict[str, str],
+    platforms: List[str],
+    cache_dir: Optional[pathlib.Path] = None,
+    target: str = "",
+) -> str:
+    """sha256 of everything that makes a build
+
+    cache_dir holds a digests cache per context folder.
+    target is the built stage, if not the last one"""
+    context = os.path.abspath(context)
+    dockerfile = os.path.abspath(dockerfile)
+    cache = DigestCache(
+        cache_dir / "{}.json".format(hashlib.sha256(context.encode()).hexdigest())
+        if cache_dir
+        else None
+    )
+
+    digest = hashlib.sha256()
+    digest.update(f"dockerfile:{hash_file(dockerfile)}\n".encode())
+    for key, value in sorted(build_args.items()):
+        digest.update(f"arg:{key}={value}\n".encode())
+    for platform in sorted(platforms):
+        digest.update(f"platform:{platform}\n".encode())
+    # hashes of builds without target are unchanged
+    if target:
+        digest.update(f"target:{target}\n".encode())
+
+    paths = []
+    ignore = DockerIgnore(read_dockerignore(context, dockerfile))
+    for name in list_files(context, ignore):
+        path = os.path.join(context, name)
+        stats = os.lstat(path)
+        if stat.S_ISLNK(stats.st_mode):
+            content = "link:" + os.readlink(path)
+        elif stat.S_ISREG(stats.st_mode):
+            content = cache.get_digest(path, stats)
+            paths.append(path)
+        else:
+            continue
+        # executable bit changes the image too
+        mode = "x" if stats.st_mode & stat.S_IXUSR else "-"
+        digest.update(f"file:{name}:{mode}:{content}\n".encode())
+
+    cache.save(paths)
+    print(f"Hashed {len(paths)} files ({cache.hits} unchanged) from {context}")
+    return digest.hexdigest()
@@ -1,33 +1,31 @@
-import os
 import sys
 
+from config import Config
 
-def main():
-    image_name = os.getenv("IMAGE_NAME")
-    tag = os.getenv("DOCKER_TAG").strip()
-    latest = os.getenv("DOCKER_TAG_LATEST", "") == "true"
 
+def display_tag(config: Config):
     print(
         "About to build and push a {platform} image to:".format(
-            platform=",".join(os.getenv("PLATFORMS", "").split())
+            platform=",".join(config.platforms)
         )
     )
-    for registry in os.getenv("REGISTRIES", "").split():
+    for registry in config.registries:
         print(
             "{registry}/{image_name}:{tag}".format(
-                registry=registry, image_name=image_name, tag=tag
+                registry=registry, image_name=config.image_name, tag=config.tag
             )
         )
-        if latest:
+        if config.latest:
             print(
                 "{registry}/{image_name}:{tag}".format(
-                    registry=registry, image_name=image_name, tag="latest"
+                    registry=registry, image_name=config.image_name, tag="latest"
                 )
             )
 
 
 if __name__ == "__main__":
-    if not os.getenv("DOCKER_TAG"):
+    config = Config.from_env()
+    if not config.tag:
         print("no tag to build, skipping.")
         sys.exit(0)
-    main()
+    display_tag(config)
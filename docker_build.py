@@ -2,66 +2,804 @@
 
 import os
 import sys
+import json
+import shutil
+import tempfile
+import time
 import subprocess
+import concurrent.futures
+from typing import Dict, Optional, Tuple
 
+from build_log import PROGRESS_ARGS, get_log_file, run_logged
+from builder import (
+    create_temporary_builder,
+    ensure_builder,
+    get_config_args,
+    remove_builder,
+)
+from config import Config
+from context_hash import LABEL as CONTEXT_HASH_LABEL, get_context_hash
+from docker_logout import docker_logout
+from imagetools import create_manifest, get_image_labels, get_layers
+from metrics import record_build, record_push, record_retry
+from retry import RetryPolicy
 
-def build_and_push_from_env():
-    image_name = os.getenv("IMAGE_NAME")
-    platforms = os.getenv("PLATFORMS", "").split()
-    registries = os.getenv("REGISTRIES", "").split()
-
-    tag = os.getenv("DOCKER_TAG").strip()
-    latest = os.getenv("DOCKER_TAG_LATEST", "") == "true"
-
-    context = os.getenv("CONTEXT", ".")
-    dockerfile = os.path.join(context, os.getenv("DOCKERFILE", "Dockerfile"))
-    build_args = build_args = dict(
-        [
-            [x.strip() for x in item.split("=")] if "=" in item else (item.strip(), "")
-            for item in os.getenv("BUILD_ARGS", "").split()
+REVISION_LABEL = "org.opencontainers.image.revision"
+
+
+def get_cache_args(
+    cache, cache_mode, cache_path, registries, image_name, tag, scope=""
+):
+    """buildx --cache-from/--cache-to arguments for the requested cache type
+
+    inline (default) reuses the previously pushed tag on first registry.
+    scope separates caches of builds running in parallel (one per platform)"""
+    if cache == "none" or not registries:
+        return []
+
+    ref = f"{registries[0]}/{image_name}"
+    if cache == "registry":
+        cache_tag = f"buildcache-{scope}" if scope else "buildcache"
+        return [
+            "--cache-from",
+            f"type=registry,ref={ref}:{cache_tag}",
+            "--cache-to",
+            f"type=registry,ref={ref}:{cache_tag},mode={cache_mode}",
         ]
-    )
 
-    if len(platforms) > 1:
-        print("Create and use a new builder instance")
-        subprocess.run(["docker", "buildx", "create", "--use"])
+    if cache == "local":
+        if scope:
+            cache_path = os.path.join(cache_path, scope)
+        # exporting to a new folder prevents local cache from growing forever
+        return [
+            "--cache-from",
+            f"type=local,src={cache_path}",
+            "--cache-to",
+            f"type=local,dest={cache_path}-new,mode={cache_mode}",
+        ]
+
+    return [
+        "--cache-from",
+        f"type=registry,ref={ref}:{tag}",
+        "--cache-to",
+        "type=inline",
+    ]
+
 
-    build_cmd = ["docker", "buildx", "build", context, "-f", dockerfile, "--push"]
+def rotate_local_cache(cache_path, scope=""):
+    """replace local cache with the one exported by last build"""
+    if scope:
+        cache_path = os.path.join(cache_path, scope)
+    if not os.path.isdir(f"{cache_path}-new"):
+        return
+    shutil.rmtree(cache_path, ignore_errors=True)
+    os.rename(f"{cache_path}-new", cache_path)
 
-    if build_args:
-        for arg, value in build_args.items():
-            if value == "{tag}":
-                value = tag
-            build_cmd += ["--build-arg", f"{arg}={value}"]
 
+def get_platform_slug(platform):
+    """filesystem and tag-friendly version of a platform (linux/arm/v7: linux-arm-v7)"""
+    return platform.replace("/", "-")
+
+
+def get_build_args(build_args, tag):
+    """--build-arg arguments, replacing special {tag} value"""
+    args = []
+    for arg, value in resolve_build_args(build_args, tag).items():
+        args += ["--build-arg", f"{arg}={value}"]
+    return args
+
+
+def resolve_build_args(build_args, tag):
+    """build_args with special {tag} value replaced"""
+    return {
+        arg: tag if value == "{tag}" else value for arg, value in build_args.items()
+    }
+
+
+def get_tags(registries, image_name, tag, latest):
+    """all fully qualified tags to push to"""
+    tags = []
     for registry in registries:
-        build_cmd += ["--tag", f"{registry}/{image_name}:{tag}"]
+        tags.append(f"{registry}/{image_name}:{tag}")
         if latest:
-            build_cmd += ["--tag", f"{registry}/{image_name}:latest"]
+            tags.append(f"{registry}/{image_name}:latest")
+    return tags
+
+
+def read_digest(metadata_file):
+    """pushed image digest from a buildx --metadata-file"""
+    try:
+        with open(metadata_file, "r") as fh:
+            return json.load(fh).get("containerimage.digest")
+    except (IOError, ValueError):
+        return None
+
+
+def get_output_options(config: Config, variant: str = "") -> str:
+    """image exporter options for layers compression and media types
+
+    variant is a compression overriding config's (ex. zstd)"""
+    compression = variant or config.compression
+    options = []
+    if compression:
+        options.append(f"compression={compression}")
+    if config.compression_level:
+        options.append(f"compression-level={config.compression_level}")
+    # layers from cache keep their compression unless forced
+    if config.force_compression or variant:
+        options.append("force-compression=true")
+    # zstd and estargz layers can only be referenced from OCI manifests
+    if config.oci_mediatypes or compression in ("zstd", "estargz"):
+        options.append("oci-mediatypes=true")
+    return ",".join(options)
+
+
+def get_variant_tags(tags, variant):
+    """tags of a variant (ex. ghcr.io/openzim/test:1.0-zstd)"""
+    return [f"{tag}-{variant}" for tag in tags]
+
+
+def report_layers(ref, name) -> Optional[int]:
+    """display media type and size of ref's pushed layers, returning total size
+
+    registries only hold compressed layers: uncompressed sizes aren't known"""
+    layers = get_layers(ref)
+    if layers is None:
+        print(f"[{name}] Unable to read layers of {ref}")
+        return None
+    total = 0
+    for platform, descriptors in layers.items():
+        prefix = f"[{platform or name}]"
+        for layer in descriptors:
+            print(
+                f"{prefix} {layer['digest'][7:19]} {layer['mediaType']} "
+                f"{layer['size']} bytes"
+            )
+        size = sum(layer["size"] for layer in descriptors)
+        print(f"{prefix} {len(descriptors)} layers, {size / 2**20:.1f}MiB compressed")
+        total += size
+    return total
+
+
+def has_label(ref, name, value, platforms):
+    """whether ref's images for all platforms are labelled name=value"""
+    labels = get_image_labels(ref)
+    return bool(labels) and all(
+        labels.get(platform, {}).get(name) == value for platform in platforms
+    )
+
+
+def publish_existing(tags, candidates, platforms, name, value) -> Optional[int]:
+    """point tags to an already published image labelled name=value
+
+    tags themselves are looked-up first, then candidates.
+    None if no such image is published"""
+    matching = [ref for ref in tags if has_label(ref, name, value, platforms)]
+    source = next(iter(matching), None) or next(
+        (ref for ref in candidates if has_label(ref, name, value, platforms)), None
+    )
+    if not source:
+        return None
+
+    print(f"{source} is already built with {name}={value}, skipping build")
+    missing = [ref for ref in tags if ref not in matching]
+    if not missing:
+        print("All tags are up to date")
+        return 0
+    return create_manifest(missing, [source])
+
+
+def can_promote(config: Config):
+    """whether release tag can reuse the image built on default branch"""
+    if not config.promote or not config.on_master or not config.github_sha:
+        return False
+    if config.tag == config.on_master:
+        return False
+    if "{tag}" in config.build_args.values():
+        print("Not promoting: build-args use {tag} so image depends on tag")
+        return False
+    return True
+
+
+def build_platform(
+    platform,
+    build_cmd,
+    registries,
+    image_name,
+    builder=None,
+    output_options="",
+    create_args=None,
+    logs_dir="",
+):
+    """build and push-by-digest a single platform on its own builder
+
+    builder, if specified, is used instead (and kept).
+    create_args are extra `buildx create` arguments for its own builder.
+    Full build log is written to logs_dir.
+    Returns pushed digest or None on failure"""
+    own_builder = not builder
+    if own_builder:
+        # named per run: jobs sharing a docker daemon don't use (or remove) it
+        builder = f"docker-publish-{os.getpid()}-{get_platform_slug(platform)}"
+        print(f"[{platform}] Create builder instance {builder}")
+        create = subprocess.run(
+            [
+                "docker",
+                "buildx",
+                "create",
+                "--name",
+                builder,
+                "--driver",
+                "docker-container",
+            ]
+            + (create_args or [])
+        )
+        if create.returncode != 0:
+            print(
+                f"[{platform}] Unable to create builder instance: {create.returncode}"
+            )
+            record_build(platform, 0.0, create.returncode, image=image_name)
+            return None
+
+    names = ",".join(f"{registry}/{image_name}" for registry in registries)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        metadata_file = os.path.join(tmpdir, "metadata.json")
+        cmd = build_cmd + [
+            "--builder",
+            builder,
+            "--platform",
+            platform,
+            "--metadata-file",
+            metadata_file,
+            "--output",
+            f'type=image,"name={names}",push-by-digest=true,'
+            "name-canonical=true,push=true"
+            + (f",{output_options}" if output_options else ""),
+        ]
+        cmd += PROGRESS_ARGS
+        print(f"[{platform}] Running: {' '.join(cmd)}")
+        started_on = time.monotonic()
+        try:
+            # prefix output so interleaved platforms logs remain readable
+            returncode = run_logged(
+                cmd,
+                platform,
+                get_log_file(logs_dir, image_name, get_platform_slug(platform)),
+                prefix=f"[{platform}] ",
+            )
+        finally:
+            if own_builder:
+                subprocess.run(["docker", "buildx", "rm", builder])
+
+        duration = time.monotonic() - started_on
+        if returncode != 0:
+            print(f"[{platform}] Unable to build image: {returncode}")
+            record_build(platform, duration, returncode, image=image_name)
+            return None
+        digest = read_digest(metadata_file)
+
+    size = None
+    if not digest:
+        print(f"[{platform}] Unable to read pushed digest")
+    elif output_options:
+        size = report_layers(f"{registries[0]}/{image_name}@{digest}", platform)
+    record_build(platform, duration, 0, digest, image=image_name, size=size)
+    return digest
+
+
+def build_and_push_parallel(
+    build_cmd,
+    platforms,
+    registries,
+    image_name,
+    tag,
+    latest,
+    cache,
+    cache_mode,
+    cache_path,
+    max_parallel,
+    builder=None,
+    output_options="",
+    create_args=None,
+    logs_dir="",
+):
+    """build each platform on its own builder then assemble multi-arch tags"""
+    digests = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = {
+            executor.submit(
+                build_platform,
+                platform,
+                build_cmd
+                + get_cache_args(
+                    cache,
+                    cache_mode,
+                    cache_path,
+                    registries,
+                    image_name,
+                    tag,
+                    scope=get_platform_slug(platform),
+                ),
+                registries,
+                image_name,
+                builder,
+                output_options,
+                create_args,
+                logs_dir,
+            ): platform
+            for platform in platforms
+        }
+        for future in concurrent.futures.as_completed(futures):
+            digests[futures[future]] = future.result()
+
+    failed = [platform for platform in platforms if not digests.get(platform)]
+    if failed:
+        print(f"Unable to build image for {', '.join(failed)}")
+        return 1
+
+    if cache == "local":
+        for platform in platforms:
+            rotate_local_cache(cache_path, scope=get_platform_slug(platform))
+
+    for registry in registries:
+        ret = create_manifest(
+            get_tags([registry], image_name, tag, latest),
+            [f"{registry}/{image_name}@{digests[platform]}" for platform in platforms],
+        )
+        if ret != 0:
+            return ret
+    return 0
+
+
+def get_shards_dir(config: Config):
+    """folder to exchange shard state files through"""
+    return config.shards_dir or os.path.join(
+        os.getenv("RUNNER_TEMP") or tempfile.gettempdir(), "docker-publish-shards"
+    )
+
+
+def build_shard(
+    build_cmd,
+    platform,
+    registries,
+    image_name,
+    shards_dir,
+    builder=None,
+    output_options="",
+    create_args=None,
+    logs_dir="",
+    tag="",
+    run_id="",
+):
+    """build and push-by-digest a single platform, recording its digest
+
+    state is written as JSON to shards_dir and digest to GITHUB_OUTPUT.
+    tag and run_id (workflow run) identify the merge it's meant for"""
+    digest = build_platform(
+        platform,
+        build_cmd,
+        registries,
+        image_name,
+        builder,
+        output_options,
+        create_args,
+        logs_dir,
+    )
+    if not digest:
+        return 1
+
+    os.makedirs(shards_dir, exist_ok=True)
+    # images of a batch or matrix can share shards_dir
+    slug = f"{image_name}-{platform}".replace("/", "-").replace(":", "-")
+    state_file = os.path.join(shards_dir, f"{slug}.json")
+    with open(state_file, "w") as fh:
+        json.dump(
+            {
+                "image_name": image_name,
+                "platform": platform,
+                "digest": digest,
+                "registries": registries,
+                "tag": tag,
+                "run_id": run_id,
+            },
+            fh,
+        )
+    print(f"[{platform}] pushed {digest}, state written to {state_file}")
+
+    if os.getenv("GITHUB_OUTPUT"):
+        with open(os.getenv("GITHUB_OUTPUT"), "a") as fh:
+            fh.write(f"digest={digest}\n")
+            fh.write(f"shard-state={state_file}\n")
+    return 0
+
+
+def read_shards(shards_dir, image_name, tag, run_id):
+    """{platform: digest} from shard state files for this image, tag and run
+
+    files left by other runs in a reused shards_dir are ignored"""
+    digests = {}
+    if not os.path.isdir(shards_dir):
+        return digests
+    for fname in sorted(os.listdir(shards_dir)):
+        if not fname.endswith(".json"):
+            continue
+        with open(os.path.join(shards_dir, fname), "r") as fh:
+            state = json.load(fh)
+        if (
+            state.get("image_name") == image_name
+            and state.get("tag") == tag
+            and state.get("run_id") == run_id
+            and state.get("digest")
+        ):
+            digests[state["platform"]] = state["digest"]
+    return digests
+
+
+def merge_shards(shards_dir, platforms, registries, image_name, tag, latest, run_id=""):
+    """create final tags on all registries from platforms' shard digests
+
+    shards of other platforms are left out"""
+    digests = read_shards(shards_dir, image_name, tag, run_id)
+    if not digests:
+        print(f"No shard found in {shards_dir}")
+        return 1
+
+    missing = [platform for platform in platforms if platform not in digests]
+    if missing:
+        print(f"Missing shards for {', '.join(missing)}")
+        return 1
+
+    print(f"Merging {', '.join(platforms)}")
+    for registry in registries:
+        ret = create_manifest(
+            get_tags([registry], image_name, tag, latest),
+            [f"{registry}/{image_name}@{digests[platform]}" for platform in platforms],
+        )
+        if ret != 0:
+            return ret
+    return 0
+
+
+def uses_builder(config: Config):
+    """whether build runs on a builder instance instead of docker daemon"""
+    # docker driver can't build multiple platforms nor export registry/local cache
+    # daemon's own mirrors configuration can't be changed, nor can it export OCI
+    # and its classic image store ignores exporter compression options
+    return (
+        bool(config.builder or config.builder_name or config.registry_mirrors)
+        or config.separate_push
+        or bool(get_output_options(config))
+        or config.zstd_variant
+        or len(config.platforms) > 1
+        or config.cache in ("registry", "local")
+        or config.mode == "build-shard"
+    )
+
+
+def reuse_published(config: Config) -> Tuple[Optional[int], Dict[str, str]]:
+    """(result, labels): whether an already published image can be used instead
+
+    result is set if build is not needed (image promoted or unchanged).
+    Otherwise labels are to be set on the built image"""
+    labels = {}
+    if config.github_sha:
+        labels[REVISION_LABEL] = config.github_sha
+    if config.mode != "build":
+        return None, labels
+
+    tags = get_tags(config.registries, config.image_name, config.tag, config.latest)
+    if can_promote(config):
+        ret = publish_existing(
+            tags,
+            [
+                f"{registry}/{config.image_name}:{config.on_master}"
+                for registry in config.registries
+            ],
+            config.platforms,
+            REVISION_LABEL,
+            config.github_sha,
+        )
+        if ret is not None:
+            return ret, labels
+
+    if config.skip_unchanged:
+        context_hash = get_context_hash(
+            config.context,
+            os.path.join(config.context, config.dockerfile),
+            resolve_build_args(config.build_args, config.tag),
+            config.platforms,
+            config.get_cache_dir() / "context-hash",
+            config.target,
+        )
+        ret = publish_existing(
+            tags, [], config.platforms, CONTEXT_HASH_LABEL, context_hash
+        )
+        if ret is not None:
+            return ret, labels
+        labels[CONTEXT_HASH_LABEL] = context_hash
+    return None, labels
+
+
+def build_and_push(config: Config):
+    image_name = config.image_name
+    platforms = config.platforms
+    registries = config.registries
+
+    tag = config.tag
+    latest = config.latest
+
+    context = config.context
+    dockerfile = os.path.join(context, config.dockerfile)
+    cache = config.cache
+    cache_mode = config.cache_mode
+    cache_path = config.cache_path
+    max_parallel = int(
+        config.max_parallel or min(len(platforms), os.cpu_count() or 1) or 1
+    )
+
+    if config.mode == "merge":
+        return merge_shards(
+            get_shards_dir(config),
+            platforms,
+            registries,
+            image_name,
+            tag,
+            latest,
+            config.github_run_id,
+        )
+
+    ret, labels = reuse_published(config)
+    if ret is not None:
+        return ret
+
+    build_cmd = ["docker", "buildx", "build", context, "-f", dockerfile]
+    build_cmd += get_build_args(config.build_args, tag)
+    if config.target:
+        build_cmd += ["--target", config.target]
+    for name, value in labels.items():
+        build_cmd += ["--label", f"{name}={value}"]
+
+    if config.mode == "build-shard":
+        return build_shard(
+            build_cmd
+            + get_cache_args(
+                cache,
+                cache_mode,
+                cache_path,
+                registries,
+                image_name,
+                tag,
+                scope=get_platform_slug(platforms[0]),
+            ),
+            platforms[0],
+            registries,
+            image_name,
+            get_shards_dir(config),
+            config.builder,
+            get_output_options(config),
+            get_config_args(config),
+            config.get_build_logs_dir(),
+            tag,
+            config.github_run_id,
+        )
+
+    if config.parallel and len(platforms) > 1:
+        print(f"Building {len(platforms)} platforms, {max_parallel} at a time")
+        return build_and_push_parallel(
+            build_cmd,
+            platforms,
+            registries,
+            image_name,
+            tag,
+            latest,
+            cache,
+            cache_mode,
+            cache_path,
+            max_parallel,
+            config.builder,
+            get_output_options(config),
+            get_config_args(config),
+            config.get_build_logs_dir(),
+        )
+
+    # builder created for this build only is removed afterwards
+    temporary_builder = ""
+    if config.builder:
+        build_cmd += ["--builder", config.builder]
+    elif uses_builder(config):
+        temporary_builder = create_temporary_builder(config)
+        if not temporary_builder:
+            print("Unable to create builder instance")
+            return 1
+        build_cmd += ["--builder", temporary_builder]
 
     for platform in platforms:
         build_cmd += ["--platform", platform]
 
-    print(f"Running: {' '.join(build_cmd)}")
-    build = subprocess.run(build_cmd)
+    tags = get_tags(registries, image_name, tag, latest)
+    output_options = get_output_options(config)
+    cache_args = get_cache_args(
+        cache, cache_mode, cache_path, registries, image_name, tag
+    )
+    try:
+        if config.separate_push:
+            ret = build_then_push(build_cmd + cache_args, config)
+        else:
+            ret = run_build(
+                build_cmd + cache_args + get_output_args(tags, output_options),
+                registries[0],
+                image_name,
+                "all",
+                bool(output_options),
+                config.get_build_logs_dir(),
+            )
+        # builder has all layers already: variant is only recompressed and pushed
+        if ret == 0 and config.zstd_variant:
+            ret = run_build(
+                build_cmd
+                + get_output_args(
+                    get_variant_tags(tags, "zstd"), get_output_options(config, "zstd")
+                ),
+                registries[0],
+                image_name,
+                "zstd",
+                True,
+                config.get_build_logs_dir(),
+            )
+    finally:
+        if temporary_builder:
+            remove_builder(temporary_builder)
+    if ret != 0:
+        return ret
 
-    if build.returncode != 0:
-        print(f"Unable to build image: {build.returncode}")
-        return build.returncode
+    if cache == "local":
+        rotate_local_cache(cache_path)
     return 0
 
 
+def get_output_args(tags, output_options):
+    """buildx arguments to push image to tags, with exporter options"""
+    if output_options:
+        args = ["--output", f"type=image,push=true,{output_options}"]
+    else:
+        args = ["--push"]
+    for fqtag in tags:
+        args += ["--tag", fqtag]
+    return args
+
+
+def build_image(
+    build_cmd, image_name, name, logs_dir=""
+) -> Tuple[int, Optional[str], float]:
+    """(exit code, digest, duration) of a buildx build of image_name
+
+    Full build log is written to logs_dir, named after name"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        metadata_file = os.path.join(tmpdir, "metadata.json")
+        build_cmd = build_cmd + ["--metadata-file", metadata_file] + PROGRESS_ARGS
+        print(f"Running: {' '.join(build_cmd)}")
+        started_on = time.monotonic()
+        returncode = run_logged(
+            build_cmd, name, get_log_file(logs_dir, image_name, name)
+        )
+        duration = time.monotonic() - started_on
+        digest = read_digest(metadata_file) if returncode == 0 else None
+
+    if returncode != 0:
+        print(f"Unable to build image: {returncode}")
+    return returncode, digest, duration
+
+
+def run_build(
+    build_cmd, registry, image_name, name, report_sizes=False, logs_dir=""
+) -> int:
+    """run a buildx build pushing image_name, recording it as name
+
+    report_sizes displays and records its pushed layers sizes.
+    Full build log is written to logs_dir"""
+    returncode, digest, duration = build_image(build_cmd, image_name, name, logs_dir)
+    size = None
+    if digest and report_sizes:
+        size = report_layers(f"{registry}/{image_name}@{digest}", name)
+    record_build(name, duration, returncode, digest, image=image_name, size=size)
+    return returncode
+
+
+def push_layout(source, tags, registry, policy: RetryPolicy, image_name="") -> int:
+    """push source image (from an OCI layout) to tags on registry, with retries
+
+    retried with policy's backoff but not bound to its deadline, a single push
+    of large layers can last longer"""
+    started_on = time.monotonic()
+    for attempt in range(1, policy.max_attempts + 1):
+        returncode = create_manifest(tags, [source])
+        if returncode == 0 or attempt == policy.max_attempts:
+            break
+        delay = policy.get_delay(attempt)
+        print(
+            f"push to {registry}: attempt {attempt}/{policy.max_attempts} failed. "
+            f"Retrying in {delay:.1f}s…"
+        )
+        record_retry(f"push {registry}")
+        time.sleep(delay)
+
+    if returncode != 0:
+        print(f"Unable to push to {registry} after {attempt} attempts: {returncode}")
+    record_push(
+        registry, time.monotonic() - started_on, returncode, attempt, image=image_name
+    )
+    return returncode
+
+
+def build_then_push(build_cmd, config: Config) -> int:
+    """build image to an OCI layout, then push it from there to each registry
+
+    a failed push is retried (and reported) on its own, without rebuilding"""
+    image_name = config.image_name
+    output_options = get_output_options(config)
+    with tempfile.TemporaryDirectory(prefix="docker-publish-layout-") as layout:
+        returncode, digest, duration = build_image(
+            build_cmd
+            + [
+                "--output",
+                f"type=oci,dest={layout},tar=false"
+                + (f",{output_options}" if output_options else ""),
+            ],
+            image_name,
+            "all",
+            config.get_build_logs_dir(),
+        )
+        if returncode != 0 or not digest:
+            if returncode == 0:
+                print("Unable to read built digest")
+            record_build("all", duration, returncode or 1, image=image_name)
+            return returncode or 1
+
+        policy = config.get_retry_policy()
+        print(f"Built {digest}, pushing to {', '.join(config.registries)}")
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(config.registries)
+        ) as executor:
+            # map() keeps registries order
+            results = list(
+                executor.map(
+                    lambda registry: push_layout(
+                        f"oci-layout://{layout}@{digest}",
+                        get_tags([registry], image_name, config.tag, config.latest),
+                        registry,
+                        policy,
+                        image_name,
+                    ),
+                    config.registries,
+                )
+            )
+
+    pushed = [reg for reg, ret in zip(config.registries, results) if ret == 0]
+    size = None
+    if pushed and output_options:
+        size = report_layers(f"{pushed[0]}/{image_name}@{digest}", "all")
+    record_build("all", duration, 0, digest, image=image_name, size=size)
+
+    failed = [reg for reg in config.registries if reg not in pushed]
+    if failed:
+        print(f"Image was built but could not be pushed to {', '.join(failed)}")
+        return 1
+    return 0
+
+
+def build_and_push_from_env():
+    return build_and_push(Config.from_env())
+
+
 if __name__ == "__main__":
-    if not os.getenv("DOCKER_TAG"):
+    config = Config.from_env()
+    if not config.tag:
         print("no tag to build, skipping.")
         sys.exit(0)
-    ret = build_and_push_from_env()
+    ret = ensure_builder(config) if config.builder_name else 0
+    if ret == 0:
+        ret = build_and_push(config)
     # make sure to logout before aborting rest of worflow
     if ret != 0:
-        subprocess.run(
-            [
-                "python3",
-                os.path.join(os.getenv("GITHUB_ACTION_PATH"), "docker_logout.py"),
-            ]
-        )
+        docker_logout(config)
     sys.exit(ret)
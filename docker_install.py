@@ -3,8 +3,59 @@
 import os
 import re
 import sys
+import shutil
+import hashlib
 import pathlib
+import platform
+import tempfile
 import subprocess
+import urllib.request
+
+from build_log import run_with_tail
+from builder import get_node_platforms
+from config import Config
+
+BUILDX_RELEASES_URL = "https://github.com/docker/buildx/releases/download"
+# platform.machine() to buildx release asset suffix
+BUILDX_ARCHS = {
+    "x86_64": "amd64",
+    "amd64": "amd64",
+    "aarch64": "arm64",
+    "arm64": "arm64",
+    "armv7l": "arm-v7",
+    "armv6l": "arm-v6",
+    "ppc64le": "ppc64le",
+    "s390x": "s390x",
+    "riscv64": "riscv64",
+}
+# platform arch to binfmt install name and binfmt_misc handler
+EMULATORS = {
+    "amd64": ("amd64", "qemu-x86_64"),
+    "386": ("386", "qemu-i386"),
+    "arm64": ("arm64", "qemu-aarch64"),
+    "arm": ("arm", "qemu-arm"),
+    "ppc64le": ("ppc64le", "qemu-ppc64le"),
+    "s390x": ("s390x", "qemu-s390x"),
+    "riscv64": ("riscv64", "qemu-riscv64"),
+    "mips64le": ("mips64le", "qemu-mips64el"),
+    "mips64": ("mips64", "qemu-mips64"),
+    "loong64": ("loong64", "qemu-loongarch64"),
+}
+# platform.machine() to platform archs it runs without emulation
+NATIVE_ARCHS = {
+    "x86_64": ["amd64", "386"],
+    "amd64": ["amd64", "386"],
+    "aarch64": ["arm64"],
+    "arm64": ["arm64"],
+}
+BINFMT_MISC_PATH = "/proc/sys/fs/binfmt_misc"
+# pinned: the image is only pulled when missing, a tag would never be updated
+BINFMT_IMAGE = (
+    "tonistiigi/binfmt:qemu-v7.0.0-28"
+    "@sha256:66e11bea77a5ea9d6f0fe79b57cd2b189b5d15b93a2bdb925be22949232e4e55"
+)
+DOWNLOAD_TIMEOUT = 60
+CHUNK_SIZE = 2**20
 
 
 def check_installed_version():
@@ -23,69 +74,179 @@ def check_installed_version():
     return None
 
 
-def install_docker():
-    req_version = os.getenv("DOCKER_BUILDX_VERSION", "0.31.1")
+def get_buildx_arch():
+    """buildx release asset architecture for this runner"""
+    machine = platform.machine().lower()
+    return BUILDX_ARCHS.get(machine, machine)
+
+
+def get_release_checksum(version, asset):
+    """expected sha256 of a buildx release asset from release's checksums file"""
+    url = f"{BUILDX_RELEASES_URL}/v{version}/checksums.txt"
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as uh:
+        for line in uh.read().decode("utf-8").splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1].lstrip("*") == asset:
+                return parts[0].lower()
+    raise ValueError(f"no checksum for {asset} in {url}")
+
+
+def download_buildx(version, arch, dest):
+    """download and verify buildx binary to dest, atomically"""
+    asset = f"buildx-v{version}.linux-{arch}"
+    url = f"{BUILDX_RELEASES_URL}/v{version}/{asset}"
+    expected = get_release_checksum(version, asset)
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    # download next to dest so concurrent jobs never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}-")
+    try:
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as fh, urllib.request.urlopen(
+            url, timeout=DOWNLOAD_TIMEOUT
+        ) as uh:
+            for chunk in iter(lambda: uh.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                fh.write(chunk)
+        if digest.hexdigest() != expected:
+            raise ValueError(
+                f"checksum mismatch for {asset}: "
+                f"{digest.hexdigest()} (expected {expected})"
+            )
+        os.chmod(tmp_path, 0o755)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def install_file(src, dest):
+    """copy src to dest atomically (dest is replaced, never partially written)"""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}-")
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.chmod(tmp_path, 0o755)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def install_docker(config: Config):
+    req_version = config.buildx_version
     inst_version = check_installed_version()
 
     if inst_version == req_version:
         print(f"already installed v{inst_version}")
         return 0
 
-    print(f"Installing buildx v{req_version} (detected: {inst_version})")
-    url = (
-        f"https://github.com/docker/buildx/releases/download/v{req_version}/"
-        f"buildx-v{req_version}.linux-amd64"
-    )
+    arch = get_buildx_arch()
+    cached = config.get_cache_dir() / "buildx" / req_version / arch / "docker-buildx"
     dest = pathlib.Path(os.getenv("HOME")) / ".docker" / "cli-plugins" / "docker-buildx"
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    wget = subprocess.run(
-        ["wget", "-O", str(dest), str(url)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
-    )
-    if wget.returncode != 0:
-        print(f"Unable to download buildx binary: {wget.returncode}")
-        print(wget.stdout)
+
+    if cached.exists():
+        print(f"Installing buildx v{req_version} from cache (detected: {inst_version})")
+    else:
+        print(f"Installing buildx v{req_version} for {arch} (detected: {inst_version})")
+        try:
+            download_buildx(req_version, arch, cached)
+        except Exception as exc:
+            print(f"Unable to download buildx binary: {exc}")
+            return 1
+
+    try:
+        install_file(cached, dest)
+    except Exception as exc:
+        print(f"Unable to install buildx binary: {exc}")
         return 1
-    dest.chmod(0o755)
 
     return 0
 
 
-def install_platforms():
-    if not os.getenv("PLATFORMS", "").split():
+def get_required_emulators(platforms, machine=None):
+    """binfmt emulators (install name, binfmt_misc handler) needed for platforms
+
+    host's native architectures are excluded"""
+    machine = (machine or platform.machine()).lower()
+    native = NATIVE_ARCHS.get(machine, [BUILDX_ARCHS.get(machine, machine)])
+    emulators = []
+    for target in platforms:
+        parts = target.split("/")
+        arch = parts[1] if len(parts) > 1 else parts[0]
+        if arch in native:
+            continue
+        emulator = EMULATORS.get(arch, (arch, f"qemu-{arch}"))
+        if emulator not in emulators:
+            emulators.append(emulator)
+    return emulators
+
+
+def is_emulator_registered(handler):
+    """whether a binfmt_misc handler is already registered and enabled"""
+    try:
+        with open(os.path.join(BINFMT_MISC_PATH, handler), "r") as fh:
+            return fh.readline().strip() == "enabled"
+    except IOError:
+        return False
+
+
+def ensure_binfmt_image(image):
+    """pull binfmt image only if not already present locally"""
+    inspect = subprocess.run(
+        ["docker", "image", "inspect", image],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    if inspect.returncode == 0:
         return 0
+    pull = subprocess.run(["docker", "pull", image])
+    return pull.returncode
 
-    print("Installing qemu binaries")
-    install = subprocess.run(
-        [
-            "docker",
-            "run",
-            "--rm",
-            "--privileged",
-            "tonistiigi/binfmt:latest",
-            "--install",
-            "all",
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
+
+def install_platforms(config: Config):
+    # merging shards doesn't run any build
+    if not config.platforms or config.mode == "merge":
+        return 0
+
+    # platforms with a builder node build natively there
+    node_platforms = get_node_platforms(config)
+    emulators = get_required_emulators(
+        [platform for platform in config.platforms if platform not in node_platforms]
+    )
+    missing = [
+        name for name, handler in emulators if not is_emulator_registered(handler)
+    ]
+    if not missing:
+        print("No qemu binary to install")
+        return 0
+
+    image = config.binfmt_image or BINFMT_IMAGE
+    if ensure_binfmt_image(image) != 0:
+        print(f"Unable to pull {image}")
+        return 1
+
+    print(f"Installing qemu binaries for {', '.join(missing)}")
+    # only its last lines are kept, to display on failure
+    returncode, output = run_with_tail(
+        ["docker", "run", "--rm", "--privileged", image, "--install", ",".join(missing)]
     )
-    if install.returncode != 0:
-        print(f"Unable to download buildx binary: {install.returncode}")
-        print(install.stdout)
+    if returncode != 0:
+        print(f"Unable to install qemu binaries: {returncode}")
+        print(output)
         return 1
     return 0
 
 
 if __name__ == "__main__":
-    if not os.getenv("DOCKER_TAG"):
+    config = Config.from_env()
+    if not config.tag:
         print("no tag to build, skipping.")
         sys.exit(0)
 
-    ret = install_docker()
+    ret = install_docker(config)
     if ret != 0:
         sys.exit(ret)
 
-    sys.exit(install_platforms())
+    sys.exit(install_platforms(config))
@@ -1,42 +1,126 @@
 #!/usr/bin/env/python3
 
-import os
 import sys
+import time
 import subprocess
+import concurrent.futures
+from typing import Optional, Tuple
 
+from config import Config
+from docker_logout import CONFIG_LOCK, docker_logout
+from metrics import record_retry
+from retry import RetryPolicy
 
-def docker_login_from_env():
-    credentials = dict(
-        [
-            [x.strip() for x in item.split("=")] if "=" in item else (item.strip(), "")
-            for item in os.getenv("CREDENTIALS", "").split()
-        ]
-    )
-
-    def get_credentials(registry):
-        prefix = registry.upper().replace(".", "")
-        return (
-            credentials.get(f"{prefix}_USERNAME", ""),
-            credentials.get(f"{prefix}_TOKEN", ""),
+LOGIN_TIMEOUT = 30  # seconds
+LOGIN_ATTEMPTS = 3
+
+
+def login_registry(
+    registry: str, username: str, token: str, policy: Optional[RetryPolicy] = None
+) -> Tuple[int, str]:
+    """login to a single registry, retrying with policy's backoff and deadline
+
+    no docker login runs past the deadline. Returns (returncode, output)"""
+    policy = policy or RetryPolicy(max_attempts=LOGIN_ATTEMPTS)
+    started_on = time.monotonic()
+
+    def get_remaining() -> float:
+        return policy.deadline - (time.monotonic() - started_on)
+
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            # retries wait outside of the lock
+            if not CONFIG_LOCK.acquire(timeout=max(0, get_remaining())):
+                raise subprocess.TimeoutExpired("docker login", policy.deadline)
+            try:
+                timeout = min(LOGIN_TIMEOUT, get_remaining())
+                if timeout <= 0:
+                    raise subprocess.TimeoutExpired("docker login", policy.deadline)
+                login = subprocess.run(
+                    [
+                        "docker",
+                        "login",
+                        "--username",
+                        username,
+                        "--password-stdin",
+                        registry,
+                    ],
+                    input=f"{token}\n",
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    universal_newlines=True,
+                    timeout=timeout,
+                )
+            finally:
+                CONFIG_LOCK.release()
+            returncode, output = login.returncode, login.stdout.strip()
+        except subprocess.TimeoutExpired as exc:
+            returncode, output = -1, f"timed out after {exc.timeout:.0f}s"
+        if returncode == 0:
+            return returncode, output
+        delay = policy.get_delay(attempt)
+        if (
+            attempt == policy.max_attempts
+            or time.monotonic() - started_on + delay > policy.deadline
+        ):
+            break
+        record_retry(f"docker login {registry}")
+        time.sleep(delay)
+    return returncode, f"{output} (after {attempt} attempts)"
+
+
+def docker_login(config: Config, timeout: Optional[float] = None) -> int:
+    """login to all registries concurrently, within timeout seconds if set
+
+    registries we could login to are logged out of if any other failed"""
+    policy = RetryPolicy(max_attempts=LOGIN_ATTEMPTS)
+    if timeout:
+        policy.deadline = timeout
+    registries = config.registries
+    print(f"Logging into {', '.join(registries)}…")
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(len(registries), 1)
+    ) as executor:
+        # map() keeps registries order
+        results = list(
+            executor.map(
+                lambda registry: login_registry(
+                    registry, *config.get_credentials(registry), policy
+                ),
+                registries,
+            )
         )
 
-    for registry in os.getenv("REGISTRIES", "").split():
-        print(f"Logging into {registry}…")
-        username, token = get_credentials(registry)
-        login = subprocess.run(
-            ["docker", "login", "--username", username, "--password-stdin", registry],
-            input=f"{token}\n",
-            universal_newlines=True,
+    failed = 0
+    for registry, (returncode, output) in zip(registries, results):
+        if returncode != 0:
+            print(f"Unable to login to {registry}: {returncode}")
+            print(output)
+            failed = failed or returncode
+        else:
+            print(f"Successfuly logged into {registry}!")
+
+    if failed:
+        # don't leave credentials for registries we could login to
+        docker_logout(
+            config,
+            [
+                registry
+                for registry, (returncode, _) in zip(registries, results)
+                if returncode == 0
+            ],
         )
-        if login.returncode != 0:
-            print(f"Unable to login to {registry}: {login.returncode}")
-            sys.exit(login.returncode)
-        print(f"Successfuly logged into {registry}!")
+    return failed
+
+
+def docker_login_from_env():
+    return docker_login(Config.from_env())
 
 
 if __name__ == "__main__":
-    if not os.getenv("DOCKER_TAG"):
+    config = Config.from_env()
+    if not config.tag:
         print("no tag to build, skipping.")
         sys.exit(0)
 
-    docker_login_from_env()
+    sys.exit(docker_login(config))
@@ -1,22 +1,59 @@
 #!/usr/bin/env/python3
 
-import os
 import sys
+import threading
 import subprocess
+import concurrent.futures
+from typing import List, Optional, Tuple
+
+from config import Config
+
+LOGOUT_TIMEOUT = 30  # seconds
+# docker login/logout rewrite ~/.docker/config.json without locking it:
+# concurrent calls would drop each other's changes
+CONFIG_LOCK = threading.Lock()
+
+
+def logout_registry(registry: str) -> Tuple[int, str]:
+    """logout of a single registry. Returns (returncode, output)"""
+    try:
+        with CONFIG_LOCK:
+            logout = subprocess.run(
+                ["docker", "logout", registry],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                timeout=LOGOUT_TIMEOUT,
+            )
+        return logout.returncode, logout.stdout.strip()
+    except subprocess.TimeoutExpired:
+        return -1, f"timed out after {LOGOUT_TIMEOUT}s"
+
+
+def docker_logout(config: Config, registries: Optional[List[str]] = None):
+    registries = config.registries if registries is None else registries
+    if not registries:
+        return
+    print(f"Logging out of {', '.join(registries)}…")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(registries)) as executor:
+        results = list(executor.map(logout_registry, registries))
+
+    for registry, (returncode, output) in zip(registries, results):
+        if returncode != 0:
+            print(f"Unable to logout of {registry}: {returncode}")
+            print(output)
+        else:
+            print(f"Successfuly logged out of {registry}!")
 
 
 def docker_logout_from_env():
-    for registry in os.getenv("REGISTRIES", "").split():
-        print(f"Logging out of {registry}…")
-        logout = subprocess.run(["docker", "logout", registry])
-        if logout.returncode != 0:
-            print(f"Unable to login to {registry}: {logout.returncode}")
-        print(f"Successfuly logged out of {registry}!")
+    docker_logout(Config.from_env())
 
 
 if __name__ == "__main__":
-    if not os.getenv("DOCKER_TAG"):
+    config = Config.from_env()
+    if not config.tag:
         print("no tag to build, skipping.")
         sys.exit(0)
 
-    docker_logout_from_env()
+    docker_logout(config)
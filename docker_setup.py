@@ -0,0 +1,214 @@
+#!/usr/bin/env/python3
+
+""" Concurrent setup: buildx install, qemu, registries login and base images pull
+
+None of those depend on the others so they run in parallel threads,
+each with its own timeout. """
+
+import os
+import re
+import sys
+import time
+import threading
+import subprocess
+from typing import Callable, Dict, List, Tuple
+
+from config import Config
+from docker_build import uses_builder
+from docker_install import install_docker, install_platforms
+from docker_login import docker_login
+from docker_logout import docker_logout
+
+# seconds each task is allowed to run for
+TASK_TIMEOUTS = {
+    "docker install": 300,
+    "qemu install": 300,
+    "docker login": 120,
+    "base images pull": 600,
+}
+
+
+def read_instructions(dockerfile: str) -> List[str]:
+    """Dockerfile instructions, with continuation lines joined"""
+    instructions, current = [], ""
+    with open(dockerfile, "r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.endswith("\\"):
+                current += line[:-1] + " "
+                continue
+            instructions.append(current + line)
+            current = ""
+    if current:
+        instructions.append(current)
+    return instructions
+
+
+def expand_args(text: str, args: Dict[str, str]) -> str:
+    """replace $VAR, ${VAR} and ${VAR:-default} using args"""
+
+    def replace(match):
+        name = match.group("braced") or match.group("name")
+        value = args.get(name)
+        if not value and match.group("default") is not None:
+            return match.group("default")
+        return match.group(0) if value is None else value
+
+    return re.sub(
+        r"\$(?:\{(?P<braced>\w+)(?::-(?P<default>[^}]*))?\}|(?P<name>\w+))",
+        replace,
+        text,
+    )
+
+
+def parse_base_images(dockerfile: str, build_args: Dict[str, str]) -> List[str]:
+    """external images referenced in FROM instructions
+
+    stages and images with unresolvable variables are excluded"""
+    args, stages, images = {}, set(), []
+    for instruction in read_instructions(dockerfile):
+        parts = instruction.split()
+        keyword = parts[0].upper()
+
+        # global ARGs (before first FROM) can be used in FROM lines
+        if keyword == "ARG" and not stages and not images:
+            for item in parts[1:]:
+                name, _, default = item.partition("=")
+                args[name] = build_args.get(
+                    name, expand_args(default.strip("\"'"), args)
+                )
+            continue
+
+        if keyword != "FROM":
+            continue
+
+        parts = [part for part in parts[1:] if not part.startswith("--")]
+        if not parts:
+            continue
+        image = expand_args(parts[0], args)
+        is_stage = image.lower() in stages
+        if len(parts) >= 3 and parts[1].upper() == "AS":
+            stages.add(parts[2].lower())
+        if is_stage or "$" in image or image == "scratch" or image in images:
+            continue
+        images.append(image)
+    return images
+
+
+def pull_base_images(config: Config, timeout: int) -> int:
+    """pull FROM images for target platforms into docker daemon
+
+    only useful when building using docker driver. Failures are not fatal"""
+    if uses_builder(config):
+        print("Not pulling base images (build runs on a builder instance)")
+        return 0
+
+    dockerfile = os.path.join(config.context, config.dockerfile)
+    try:
+        images = parse_base_images(dockerfile, config.build_args)
+    except Exception as exc:
+        print(f"Unable to read base images from {dockerfile}: {exc}")
+        return 0
+
+    for image in images:
+        for platform in config.platforms:
+            print(f"Pulling {image} for {platform}")
+            try:
+                pull = subprocess.run(
+                    ["docker", "pull", "--quiet", "--platform", platform, image],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    universal_newlines=True,
+                    timeout=timeout,
+                )
+            except subprocess.TimeoutExpired:
+                print(f"Timed out pulling {image} for {platform}")
+                return 0
+            if pull.returncode != 0:
+                print(f"Unable to pull {image} for {platform}: {pull.stdout}")
+    return 0
+
+
+def run_concurrently(
+    tasks: Dict[str, Tuple[Callable, int]]
+) -> Dict[str, Tuple[int, float]]:
+    """run each task in a thread, returning {name: (returncode, duration)}
+
+    tasks still running after their timeout are considered failed (-1).
+    Threads are daemons so a stuck task never prevents exiting: tasks with
+    side effects (docker login) must stop by themselves within their timeout"""
+    results = {}
+    lock = threading.Lock()
+
+    def run(name, func):
+        started_on = time.monotonic()
+        try:
+            ret = func()
+        except Exception as exc:
+            print(f"{name} failed: {exc}")
+            ret = 1
+        with lock:
+            results[name] = (ret, time.monotonic() - started_on)
+
+    started_on = time.monotonic()
+    threads = {}
+    for name, (func, _) in tasks.items():
+        threads[name] = threading.Thread(target=run, args=(name, func), daemon=True)
+        threads[name].start()
+
+    for name, (_, timeout) in tasks.items():
+        threads[name].join(max(0, started_on + timeout - time.monotonic()))
+
+    with lock:
+        for name, (_, timeout) in tasks.items():
+            if name not in results:
+                print(f"{name} timed out after {timeout}s")
+                results[name] = (-1, float(timeout))
+        # keep tasks order
+        return {name: results[name] for name in tasks}
+
+
+def setup(config: Config) -> Dict[str, Tuple[int, float]]:
+    """run all setup tasks concurrently"""
+    return run_concurrently(
+        {
+            "docker install": (
+                lambda: install_docker(config),
+                TASK_TIMEOUTS["docker install"],
+            ),
+            "qemu install": (
+                lambda: install_platforms(config),
+                TASK_TIMEOUTS["qemu install"],
+            ),
+            "docker login": (
+                lambda: docker_login(config, TASK_TIMEOUTS["docker login"]),
+                TASK_TIMEOUTS["docker login"],
+            ),
+            "base images pull": (
+                lambda: pull_base_images(config, TASK_TIMEOUTS["base images pull"]),
+                TASK_TIMEOUTS["base images pull"],
+            ),
+        }
+    )
+
+
+def report(results: Dict[str, Tuple[int, float]]) -> int:
+    """display tasks results, returning non-zero if any failed"""
+    for name, (ret, duration) in results.items():
+        print(f"{name}: {'OK' if ret == 0 else 'FAILED'} ({duration:.3f}s)")
+    return max([abs(ret) for ret, _ in results.values()] or [0])
+
+
+if __name__ == "__main__":
+    config = Config.from_env()
+    if not config.tag:
+        print("no tag to build, skipping.")
+        sys.exit(0)
+
+    ret = report(setup(config))
+    # make sure to logout before aborting rest of worflow
+    if ret != 0:
+        docker_logout(config)
+    sys.exit(ret)
@@ -0,0 +1,126 @@
+#!/usr/bin/env/python3
+
+""" docker.io's Hub API JWT, cached across runs until it's about to expire """
+
+import base64
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import time
+import urllib.error
+from typing import Callable, Optional, TypeVar
+
+from config import Config
+from http_client import get_client
+
+# don't reuse tokens expiring in less than that (seconds)
+REFRESH_MARGIN = 300
+
+T = TypeVar("T")
+
+
+def get_dockerhub_jwt(username: str, password: str) -> str:
+    """docker.io's Hub API JWT from logging-in with username and password"""
+    response = get_client().request_json(
+        "POST",
+        "https://hub.docker.com/v2/users/login",
+        {"username": username, "password": password},
+    )
+
+    if not response.status == 200:
+        raise ValueError(
+            "Unable to login to docker.io's hub API: HTTP {}: {}".format(
+                response.status, response.reason
+            )
+        )
+
+    try:
+        return response.json().get("token")
+    except Exception as exc:
+        raise ValueError(
+            "Unable to read hub API's response: {} -- {}".format(exc, response.body)
+        )
+
+
+def get_jwt_expiry(token: str) -> Optional[float]:
+    """expiry timestamp (`exp` claim) of a JWT, without verifying it"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenCache:
+    """JWT stored per username in a folder, readable by owner only"""
+
+    def __init__(self, folder: pathlib.Path):
+        self.folder = folder
+
+    def get_path(self, username: str) -> pathlib.Path:
+        return self.folder / "{}.jwt".format(
+            hashlib.sha256(username.encode("utf-8")).hexdigest()
+        )
+
+    def get(self, username: str) -> Optional[str]:
+        """cached token for username if it's not about to expire"""
+        try:
+            token = self.get_path(username).read_text().strip()
+        except IOError:
+            return None
+        expiry = get_jwt_expiry(token)
+        if expiry is None or expiry - REFRESH_MARGIN < time.time():
+            return None
+        return token
+
+    def set(self, username: str, token: str):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        # mkstemp creates file as 0600
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix=".jwt-")
+        try:
+            with os.fdopen(fd, "w") as fh:
+                fh.write(token)
+            os.replace(tmp_path, self.get_path(username))
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def drop(self, username: str):
+        try:
+            self.get_path(username).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def get_token_cache(config: Config) -> TokenCache:
+    return TokenCache(config.get_cache_dir() / "dockerhub-tokens")
+
+
+def get_token(config: Config, refresh: bool = False) -> str:
+    """Hub API JWT for docker.io credentials, from cache if still valid"""
+    cache = get_token_cache(config)
+    username, password = config.get_credentials("docker.io")
+    token = None if refresh else cache.get(username)
+    if token:
+        return token
+
+    token = get_dockerhub_jwt(username, password)
+    try:
+        cache.set(username, token)
+    except IOError as exc:
+        print("Unable to cache hub API token: {}".format(exc))
+    return token
+
+
+def call_with_token(config: Config, func: Callable[[str], T]) -> T:
+    """func(token) result, logging-in again should the cached token be refused"""
+    try:
+        return func(get_token(config))
+    except urllib.error.HTTPError as exc:
+        if exc.code != 401:
+            raise
+        get_token_cache(config).drop(config.get_credentials("docker.io")[0])
+        return func(get_token(config, refresh=True))
@@ -6,20 +6,22 @@
 import os
 import re
 
+from config import Config
 
-def find_tag_from_env():
-    docker_tag_for_master = os.getenv("ON_MASTER")
-    manual_tag = os.getenv("MANUAL_TAG", "")
+
+def find_tag(config: Config):
+    docker_tag_for_master = config.on_master
+    manual_tag = config.manual_tag
     version_tag, latest = "", False
 
-    ref = os.getenv("GITHUB_REF").split("/", 2)[-1]
-    is_tag = os.getenv("GITHUB_REF").startswith("refs/tags/")
-    tag_regexp = os.getenv("TAG_PATTERN", "")
+    ref = config.github_ref.split("/", 2)[-1]
+    is_tag = config.github_ref.startswith("refs/tags/")
+    tag_regexp = config.tag_pattern
 
     # manual override tag is set
     if manual_tag:
         version_tag = manual_tag
-        latest = os.getenv("LATEST_ON_TAG", "").lower() == "true"
+        latest = config.latest_on_tag
     # this is a commit on tag
     elif is_tag and tag_regexp:
         # convert from perl syntax (/pattern/) to python one
@@ -35,9 +37,9 @@ def find_tag_from_env():
                 # we have a matching tag without a group, use git tag
                 version_tag = ref
 
-            latest = os.getenv("LATEST_ON_TAG", "").lower() == "true"
+            latest = config.latest_on_tag
     # this is a commit on default branch
-    elif ref == os.getenv("DEFAULT_BRANCH") and docker_tag_for_master:
+    elif ref == config.default_branch and docker_tag_for_master:
         version_tag = docker_tag_for_master
 
     # make sure we only use one tag if we requested "latest"
@@ -47,8 +49,16 @@ def find_tag_from_env():
     return version_tag, latest
 
 
-if __name__ == "__main__":
-    version_tag, latest = find_tag_from_env()
-    with open(os.getenv("GITHUB_ENV"), "a") as fh:
+def find_tag_from_env():
+    return find_tag(Config.from_env())
+
+
+def write_env(github_env, version_tag, latest):
+    with open(github_env, "a") as fh:
         fh.write(f"DOCKER_TAG={version_tag}\n")
         fh.write(f"DOCKER_TAG_LATEST={str(latest).lower()}\n")
+
+
+if __name__ == "__main__":
+    version_tag, latest = find_tag_from_env()
+    write_env(os.getenv("GITHUB_ENV"), version_tag, latest)
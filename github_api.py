@@ -0,0 +1,90 @@
+#!/usr/bin/env/python3
+
+""" GitHub repository metadata, fetched once per run
+
+Document is also kept on disk with its ETag so next runs send a
+conditional request: 304 responses don't count against rate-limit. """
+
+import json
+import os
+import tempfile
+import threading
+from typing import Dict
+
+from config import Config
+from http_client import get_client
+from retry import retry_call
+
+_repositories: Dict[str, Dict] = {}
+_lock = threading.Lock()
+
+
+def read_cached(path) -> Dict:
+    try:
+        with open(path, "r") as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_cached(path, etag: str, data: Dict):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".repo-")
+        with os.fdopen(fd, "w") as fh:
+            json.dump({"etag": etag, "data": data}, fh)
+        os.replace(tmp_path, path)
+    except IOError as exc:
+        print(f"Unable to cache Github API response: {exc}")
+
+
+def fetch_repository(repository: str, config: Config) -> Dict:
+    cache_file = (
+        config.get_cache_dir()
+        / "github"
+        / "{}.json".format(repository.replace("/", "_"))
+    )
+    cached = read_cached(cache_file)
+
+    headers = {"Accept": "application/vnd.github.v3+json"}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if config.github_token:
+        headers["Authorization"] = f"Bearer {config.github_token}"
+
+    response = retry_call(
+        lambda: get_client().request(
+            "GET", f"https://api.github.com/repos/{repository}", headers=headers
+        ),
+        config.get_retry_policy(),
+        "Github API",
+    )
+    if response.status == 304:
+        return cached["data"]
+
+    if not response.status == 200:
+        raise ValueError(
+            "Unable to retrieve repository from Github API HTTP {}: {}".format(
+                response.status, response.reason
+            )
+        )
+
+    try:
+        data = response.json()
+    except Exception as exc:
+        raise ValueError(
+            "Unable to read Github's API's response: {} -- {}".format(
+                exc, response.body
+            )
+        )
+    if response.headers.get("ETag"):
+        write_cached(cache_file, response.headers["ETag"], data)
+    return data
+
+
+def get_repository(repository: str, config: Config) -> Dict:
+    """API document of a Github repository, requested at most once per run"""
+    with _lock:
+        if repository not in _repositories:
+            _repositories[repository] = fetch_repository(repository, config)
+        return _repositories[repository]
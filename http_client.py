@@ -0,0 +1,222 @@
+#!/usr/bin/env/python3
+
+""" Shared HTTP client for GitHub API, docker.io's Hub API and webhook calls
+
+Connections are pooled per host and kept alive. Errors are raised as
+urllib.error exceptions so callers and retry policy handle them as before.
+
+Hosts can be redirected to another base URL (ex. a local stand-in server)
+using HTTP_BASE_URL_OVERRIDES (ex. `api.github.com=http://127.0.0.1:8000`) """
+
+import dataclasses
+import gzip
+import http.client
+import io
+import json
+import os
+import threading
+import urllib.error
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+
+USER_AGENT = "openzim-docker-publish-action"
+CONNECT_TIMEOUT = 10  # seconds
+READ_TIMEOUT = 60  # seconds
+MAX_REDIRECTS = 5
+
+
+@dataclasses.dataclass
+class Response:
+    url: str
+    status: int
+    reason: str
+    headers: http.client.HTTPMessage
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body.decode("UTF-8"))
+
+    def getcode(self) -> int:
+        return self.status
+
+
+class HTTPClient:
+    def __init__(
+        self,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        base_url_overrides: Optional[Dict[str, str]] = None,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.base_url_overrides = base_url_overrides or {}
+        self.pools: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+        self.lock = threading.Lock()
+
+    def get_target(self, url: str) -> urllib.parse.SplitResult:
+        """url, with host replaced by its override if any"""
+        parsed = urllib.parse.urlsplit(url)
+        override = self.base_url_overrides.get(parsed.hostname or "")
+        if not override:
+            return parsed
+        base = urllib.parse.urlsplit(override)
+        return parsed._replace(
+            scheme=base.scheme,
+            netloc=base.netloc,
+            path=base.path.rstrip("/") + parsed.path,
+        )
+
+    def get_connection(self, key: Tuple[str, str, int]):
+        """(connection, reused) from pool or newly connected"""
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool:
+                return pool.pop(), True
+
+        scheme, host, port = key
+        conn_cls = (
+            http.client.HTTPSConnection
+            if scheme == "https"
+            else http.client.HTTPConnection
+        )
+        conn = conn_cls(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn, False
+
+    def release_connection(self, key: Tuple[str, str, int], conn):
+        with self.lock:
+            self.pools.setdefault(key, []).append(conn)
+
+    def close(self):
+        with self.lock:
+            for pool in self.pools.values():
+                for conn in pool:
+                    conn.close()
+            self.pools.clear()
+
+    def send(
+        self, method: str, url: str, data: Optional[bytes], headers: Dict[str, str]
+    ) -> Response:
+        target = self.get_target(url)
+        key = (
+            target.scheme,
+            target.hostname,
+            target.port or (443 if target.scheme == "https" else 80),
+        )
+        path = target.path or "/"
+        if target.query:
+            path += "?" + target.query
+
+        while True:
+            conn, reused = self.get_connection(key)
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # server closed an idle kept-alive connection, use a new one
+                if reused:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            break
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self.release_connection(key, conn)
+
+        if resp.getheader("Content-Encoding", "").lower() == "gzip":
+            body = gzip.decompress(body)
+        return Response(
+            url=url,
+            status=resp.status,
+            reason=resp.reason,
+            headers=resp.headers,
+            body=body,
+        )
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        data: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Response:
+        """response to request, following redirects
+
+        HTTP errors (>= 400) raise urllib.error.HTTPError
+        and network ones urllib.error.URLError"""
+        headers = {
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "gzip",
+            **(headers or {}),
+        }
+        if data is not None:
+            headers["Content-Length"] = str(len(data))
+
+        for _ in range(MAX_REDIRECTS + 1):
+            try:
+                response = self.send(method, url, data, headers)
+            except (OSError, http.client.HTTPException) as exc:
+                raise urllib.error.URLError(exc)
+
+            location = response.headers.get("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urllib.parse.urljoin(url, location)
+                if response.status == 303:
+                    method, data = "GET", None
+                    headers.pop("Content-Length", None)
+                continue
+            break
+
+        if response.status >= 400:
+            raise urllib.error.HTTPError(
+                url,
+                response.status,
+                response.reason,
+                response.headers,
+                io.BytesIO(response.body),
+            )
+        return response
+
+    def request_json(
+        self,
+        method: str,
+        url: str,
+        payload=None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Response:
+        """response to a request with a JSON payload"""
+        return self.request(
+            method,
+            url,
+            data=None if payload is None else json.dumps(payload).encode("utf-8"),
+            headers={
+                "Content-Type": "application/json; charset=utf-8",
+                **(headers or {}),
+            },
+        )
+
+
+_client: Optional[HTTPClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HTTPClient:
+    """shared client, configured from environ"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient(
+                base_url_overrides=dict(
+                    item.split("=", 1)
+                    for item in os.getenv("HTTP_BASE_URL_OVERRIDES", "").split()
+                    if "=" in item
+                )
+            )
+        return _client
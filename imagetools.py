@@ -0,0 +1,107 @@
+#!/usr/bin/env/python3
+
+""" Registry-side manifest operations using `docker buildx imagetools` """
+
+import json
+import subprocess
+from typing import Dict, List, Optional
+
+
+def create_manifest(tags: List[str], sources: List[str]) -> int:
+    """create (or replace) tags pointing to a manifest list made of sources
+
+    sources are full references (ex. ghcr.io/openzim/test@sha256:xxx)"""
+    cmd = ["docker", "buildx", "imagetools", "create"]
+    for tag in tags:
+        cmd += ["--tag", tag]
+    cmd += sources
+
+    print(f"Running: {' '.join(cmd)}")
+    create = subprocess.run(cmd)
+    if create.returncode != 0:
+        print(f"Unable to create manifest for {', '.join(tags)}: {create.returncode}")
+    return create.returncode
+
+
+def get_config_platform(config: Dict) -> str:
+    """platform (ex. linux/arm/v7) of an image config"""
+    parts = (config.get("os"), config.get("architecture"), config.get("variant"))
+    return "/".join(part for part in parts if part)
+
+
+def get_image_labels(ref: str) -> Optional[Dict[str, Dict[str, str]]]:
+    """{platform: labels} of ref's image configs, None if it can't be read"""
+    inspect = subprocess.run(
+        [
+            "docker",
+            "buildx",
+            "imagetools",
+            "inspect",
+            ref,
+            "--format",
+            "{{json .Image}}",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if inspect.returncode != 0:
+        return None
+    try:
+        data = json.loads(inspect.stdout)
+    except ValueError:
+        return None
+    # single-platform image config or {platform: image config} for an index
+    if "rootfs" in data or "config" in data:
+        data = {get_config_platform(data): data}
+    return {
+        platform: (config.get("config") or {}).get("Labels") or {}
+        for platform, config in data.items()
+    }
+
+
+def get_repository(ref: str) -> str:
+    """repository of a reference (ex. ghcr.io/openzim/test)"""
+    if "@" in ref:
+        return ref.split("@", 1)[0]
+    name, _, tag = ref.rpartition(":")
+    return name if name and "/" not in tag else ref
+
+
+def inspect_raw(ref: str) -> Optional[Dict]:
+    """ref's manifest (or index) as stored in registry, None if it can't be read"""
+    inspect = subprocess.run(
+        ["docker", "buildx", "imagetools", "inspect", ref, "--raw"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if inspect.returncode != 0:
+        return None
+    try:
+        return json.loads(inspect.stdout)
+    except ValueError:
+        return None
+
+
+def get_layers(ref: str) -> Optional[Dict[str, List[Dict]]]:
+    """{platform: layers descriptors} of ref's images, None if it can't be read
+
+    platform is empty for a single-platform manifest (it's in its config).
+    Attestation manifests are excluded"""
+    manifest = inspect_raw(ref)
+    if manifest is None:
+        return None
+    if "manifests" not in manifest:
+        return {"": manifest.get("layers", [])}
+
+    layers = {}
+    for descriptor in manifest["manifests"]:
+        platform = get_config_platform(descriptor.get("platform") or {})
+        if not platform or platform == "unknown/unknown":
+            continue
+        image = inspect_raw(f"{get_repository(ref)}@{descriptor['digest']}")
+        if image is None:
+            return None
+        layers[platform] = image.get("layers", [])
+    return layers
@@ -0,0 +1,215 @@
+#!/usr/bin/env/python3
+
+""" Per-step metrics: wall time, exit status and retries, plus built digests
+
+Written as JSON to `metrics-file` and as a Markdown table to the job summary.
+Retries, builds and pushes are recorded from any thread into module-level
+stores. """
+
+import collections
+import datetime
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+
+_lock = threading.Lock()
+_retries: Dict[str, int] = collections.Counter()
+_builds: List[Dict] = []
+_pushes: List[Dict] = []
+
+
+def record_retry(description: str):
+    """count a retried attempt of description (ex. `docker login ghcr.io`)"""
+    with _lock:
+        _retries[description] += 1
+
+
+def record_build(
+    name: str,
+    duration: float,
+    returncode: int,
+    digest: Optional[str] = None,
+    image: str = "",
+    size: Optional[int] = None,
+):
+    """record a buildx build (name is platform or `all`) and its pushed digest
+
+    size is the pushed (compressed) layers total, when measured"""
+    with _lock:
+        _builds.append(
+            {
+                "image": image,
+                "name": name,
+                "duration": round(duration, 3),
+                "status": returncode,
+                "digest": digest,
+                "size": size,
+            }
+        )
+
+
+def record_push(
+    registry: str, duration: float, returncode: int, attempts: int, image: str = ""
+):
+    """record the push of a built image to registry (separate-push)"""
+    with _lock:
+        _pushes.append(
+            {
+                "image": image,
+                "registry": registry,
+                "duration": round(duration, 3),
+                "status": returncode,
+                "attempts": attempts,
+            }
+        )
+
+
+def get_retries() -> Dict[str, int]:
+    with _lock:
+        return dict(_retries)
+
+
+def get_builds() -> List[Dict]:
+    with _lock:
+        return list(_builds)
+
+
+def get_pushes() -> List[Dict]:
+    with _lock:
+        return list(_pushes)
+
+
+def count_retries(prefix: str = "") -> int:
+    """number of retries recorded for descriptions starting with prefix"""
+    return sum(
+        count for name, count in get_retries().items() if name.startswith(prefix)
+    )
+
+
+def get_status(ret) -> int:
+    """exit status of a step from its return value"""
+    return ret if isinstance(ret, int) and not isinstance(ret, bool) else 0
+
+
+class Metrics:
+    """steps metrics, displayed and written at the end"""
+
+    def __init__(self, started_on: float):
+        self.started_on = started_on
+        self.started_at = datetime.datetime.now(datetime.timezone.utc) - (
+            datetime.timedelta(seconds=time.monotonic() - started_on)
+        )
+        self.steps: List[Dict] = []
+        self.add("startup", time.monotonic() - started_on)
+
+    def add(self, name: str, duration: float, status: int = 0, retries: int = 0):
+        self.steps.append(
+            {
+                "name": name,
+                "duration": round(duration, 3),
+                "status": status,
+                "retries": retries,
+            }
+        )
+
+    def run(self, name, func, *args):
+        """func(*args) result, recording its duration, status and retries
+
+        steps are run sequentially so retries recorded meanwhile are theirs"""
+        started_on = time.monotonic()
+        retries = count_retries()
+        status = 1
+        try:
+            ret = func(*args)
+            status = get_status(ret)
+            return ret
+        finally:
+            self.add(
+                name,
+                time.monotonic() - started_on,
+                status,
+                count_retries() - retries,
+            )
+
+    @property
+    def total(self) -> float:
+        return time.monotonic() - self.started_on
+
+    def display(self):
+        print("Timings:")
+        for step in self.steps:
+            print(
+                f"  {step['name']:<24} {step['duration']:8.3f}s"
+                + (f" (exit {step['status']})" if step["status"] else "")
+                + (f" ({step['retries']} retries)" if step["retries"] else "")
+            )
+        print(f"  {'total':<24} {self.total:8.3f}s")
+
+    def to_dict(self, **extra) -> Dict:
+        return {
+            **extra,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "duration": round(self.total, 3),
+            "steps": self.steps,
+            "builds": get_builds(),
+            "pushes": get_pushes(),
+            "retries": get_retries(),
+        }
+
+    def write_json(self, path: str, **extra):
+        with open(path, "w") as fh:
+            json.dump(self.to_dict(**extra), fh, indent=2)
+
+    def to_markdown(self, title: str) -> str:
+        lines = [
+            f"### {title}",
+            "",
+            "| Step | Status | Duration | Retries |",
+            "| --- | --- | ---: | ---: |",
+        ]
+        for step in self.steps:
+            lines.append(
+                "| {name} | {status} | {duration:.1f}s | {retries} |".format(
+                    name=step["name"].strip().replace("|", "\\|"),
+                    status="✅" if step["status"] == 0 else f"❌ {step['status']}",
+                    duration=step["duration"],
+                    retries=step["retries"],
+                )
+            )
+        lines.append(f"| **total** | | **{self.total:.1f}s** | |")
+
+        builds = get_builds()
+        if builds:
+            lines += [
+                "",
+                "| Image | Build | Status | Duration | Size | Digest |",
+                "| --- | --- | --- | ---: | ---: | --- |",
+            ]
+            for build in builds:
+                digest = f"`{build['digest']}`" if build["digest"] else ""
+                size = f"{build['size'] / 2**20:.1f}MiB" if build["size"] else ""
+                lines.append(
+                    f"| {build['image']} | {build['name']} "
+                    f"| {'✅' if build['status'] == 0 else '❌'} "
+                    f"| {build['duration']:.1f}s | {size} | {digest} |"
+                )
+
+        pushes = get_pushes()
+        if pushes:
+            lines += [
+                "",
+                "| Image | Push | Status | Duration | Attempts |",
+                "| --- | --- | --- | ---: | ---: |",
+            ]
+            for push in pushes:
+                lines.append(
+                    f"| {push['image']} | {push['registry']} "
+                    f"| {'✅' if push['status'] == 0 else '❌'} "
+                    f"| {push['duration']:.1f}s | {push['attempts']} |"
+                )
+        return "\n".join(lines) + "\n"
+
+    def write_summary(self, path: str, title: str):
+        with open(path, "a") as fh:
+            fh.write(self.to_markdown(title))
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+""" Run the whole action in a single process
+
+Configuration is parsed once from environ and passed to every stage.
+Individual scripts remain usable on their own. """
+
+import time
+
+STARTED_ON = time.monotonic()
+
+import os
+import sys
+
+import bake
+import batch
+from builder import ensure_builder
+from check_inputs import check, write_env
+from config import Config
+from display_tag import display_tag
+from docker_build import build_and_push
+from docker_logout import docker_logout
+from docker_setup import report, setup
+from find_tag import find_tag, write_env as write_tag_env
+from metrics import Metrics, count_retries
+from run_webhook import run_webhook
+from update_dockerio_descriptions import update_dockerio_api
+
+
+def run_pipeline(config: Config, metrics: Metrics) -> int:
+    ret = metrics.run("check inputs", check, config)
+    if ret != 0:
+        return ret
+
+    config.tag, config.latest = metrics.run("find tag", find_tag, config)
+    # keep exposing inputs and found tag to next steps in the job
+    write_env(config)
+    write_tag_env(config.github_env, config.tag, config.latest)
+
+    if not config.tag:
+        print("no tag to build, skipping.")
+        return 0
+
+    if config.batch:
+        return run_batch_pipeline(config, metrics)
+    display_tag(config)
+
+    try:
+        results = metrics.run("setup", setup, config)
+        for name, (ret, duration) in results.items():
+            metrics.add(f"setup: {name}", duration, ret, count_retries(name))
+        ret = report(results)
+        if ret != 0:
+            return ret
+
+        if config.builder_name:
+            ret = metrics.run("builder", ensure_builder, config)
+            if ret != 0:
+                return ret
+
+        ret = metrics.run(
+            "docker build-push",
+            bake.bake_and_push if config.bake else build_and_push,
+            config,
+        )
+        if ret != 0:
+            return ret
+    finally:
+        # make sure to logout before aborting rest of worflow
+        metrics.run("docker logout", docker_logout, config)
+
+    # shards only push their platform's digest, merge job publishes the tag
+    if config.mode == "build-shard":
+        return 0
+
+    if config.should_update_dockerio:
+        ret = metrics.run("docker.io description", update_dockerio_api, config)
+        if ret != 0:
+            return ret
+
+    if config.webhook_url:
+        ret = metrics.run("webhook", run_webhook, config)
+        if ret != 0:
+            return ret
+
+    return 0
+
+
+def run_batch_pipeline(config: Config, metrics: Metrics) -> int:
+    """setup once then build all batch images, reporting each one"""
+    images = batch.parse_batch(config)
+    batch.display_batch(images)
+    max_parallel = int(
+        config.max_parallel or min(len(images), os.cpu_count() or 1) or 1
+    )
+
+    try:
+        results = metrics.run("setup", setup, batch.get_setup_config(config, images))
+        for name, (ret, duration) in results.items():
+            metrics.add(f"setup: {name}", duration, ret, count_retries(name))
+        ret = report(results)
+        if ret != 0:
+            return ret
+
+        if config.builder_name:
+            ret = metrics.run("builder", ensure_builder, config)
+            if ret != 0:
+                return ret
+
+        if config.bake:
+            print(f"Baking {len(images)} images")
+            results = metrics.run(
+                "docker build-push", bake.bake_batch, images, config.builder
+            )
+        else:
+            print(f"Building {len(images)} images, {max_parallel} at a time")
+            results = metrics.run(
+                "docker build-push",
+                batch.build_batch,
+                images,
+                build_and_push,
+                max_parallel,
+                config.builder,
+            )
+        for name, (ret, duration) in results.items():
+            metrics.add(f"build-push: {name}", duration, 1 if ret is None else ret)
+    finally:
+        # make sure to logout before aborting rest of worflow
+        metrics.run("docker logout", docker_logout, config)
+
+    # descriptions and webhooks only for images that got published
+    for name, image in images.items():
+        if results[name][0] != 0:
+            continue
+        if image.config.should_update_dockerio:
+            metrics.run(
+                f"docker.io description: {name}", update_dockerio_api, image.config
+            )
+        if config.webhook_url:
+            metrics.run(f"webhook: {name}", run_webhook, image.config)
+
+    return batch.report(results)
+
+
+def write_metrics(config: Config, metrics: Metrics, ret: int):
+    """metrics as JSON file (path exposed as output) and job summary table"""
+    metrics_file = config.get_metrics_file()
+    try:
+        metrics.write_json(
+            metrics_file,
+            image_name=config.image_name,
+            tag=config.tag,
+            platforms=config.platforms,
+            registries=config.registries,
+            status=ret,
+        )
+        if os.getenv("GITHUB_OUTPUT"):
+            with open(os.getenv("GITHUB_OUTPUT"), "a") as fh:
+                fh.write(f"metrics-file={metrics_file}\n")
+                fh.write(f"build-logs-dir={config.get_build_logs_dir()}\n")
+        if config.github_step_summary:
+            title = (config.image_name or "batch") + (
+                f":{config.tag}" if config.tag else ""
+            )
+            metrics.write_summary(config.github_step_summary, title)
+    except OSError as exc:
+        print(f"Unable to write metrics: {exc}")
+
+
+def main():
+    metrics = Metrics(STARTED_ON)
+    config = metrics.run("parse config", Config.from_env)
+    ret = 1
+    try:
+        ret = run_pipeline(config, metrics)
+        return ret
+    finally:
+        metrics.display()
+        write_metrics(config, metrics, ret)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
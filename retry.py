@@ -0,0 +1,114 @@
+#!/usr/bin/env/python3
+
+""" Shared retry policy for HTTP calls: exponential backoff, jitter and deadline
+
+Honours `Retry-After` and rate-limit headers sent by servers. """
+
+import dataclasses
+import email.utils
+import random
+import socket
+import time
+import urllib.error
+from typing import Callable, Optional, TypeVar
+
+from metrics import record_retry
+
+# conflict (concurrent webhook calls), rate-limited or server-side errors
+RETRYABLE_STATUSES = (409, 429, 500, 502, 503, 504)
+
+T = TypeVar("T")
+
+
+@dataclasses.dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 2.0  # seconds
+    max_delay: float = 60.0  # seconds
+    deadline: float = 180.0  # seconds, for all attempts and delays
+    jitter: float = 0.5  # ratio of delay that is randomized
+
+    def get_delay(self, attempt: int) -> float:
+        """backoff delay after a failed attempt (1-indexed)"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+def get_retry_after(headers, now: Optional[float] = None) -> Optional[float]:
+    """seconds to wait before retrying, as requested by server (if any)"""
+    if headers is None:
+        return None
+    now = time.time() if now is None else now
+
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        retry_after = retry_after.strip()
+        if retry_after.isdigit():
+            return float(retry_after)
+        try:
+            retry_on = email.utils.parsedate_to_datetime(retry_after)
+            return max(0.0, retry_on.timestamp() - now)
+        except (TypeError, ValueError):
+            pass
+
+    # only wait for rate-limit reset if there's no more requests left
+    remaining = headers.get("X-RateLimit-Remaining") or headers.get(
+        "RateLimit-Remaining"
+    )
+    reset = headers.get("X-RateLimit-Reset") or headers.get("RateLimit-Reset")
+    if remaining is not None and remaining.strip() == "0" and reset:
+        try:
+            reset = float(reset.strip())
+        except ValueError:
+            return None
+        # either an epoch timestamp or a number of seconds
+        return max(0.0, reset - now) if reset > 1e9 else reset
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    """whether a failed call is worth retrying"""
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code in RETRYABLE_STATUSES or exc.code >= 500
+    return isinstance(
+        exc, (urllib.error.URLError, ConnectionError, TimeoutError, socket.timeout)
+    )
+
+
+def retry_call(func: Callable[[], T], policy: RetryPolicy, description: str) -> T:
+    """func's result, retrying it on retryable errors according to policy
+
+    last error is raised once attempts or deadline are exhausted"""
+    started_on = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return func()
+        except Exception as exc:
+            if not is_retryable(exc):
+                raise
+            if attempt >= policy.max_attempts:
+                print(
+                    f"{description}: attempt {attempt}/{policy.max_attempts} failed: "
+                    f"{exc}. Giving up."
+                )
+                raise
+
+            delay = get_retry_after(getattr(exc, "headers", None))
+            if delay is None:
+                delay = policy.get_delay(attempt)
+            if time.monotonic() - started_on + delay > policy.deadline:
+                print(
+                    f"{description}: attempt {attempt}/{policy.max_attempts} failed: "
+                    f"{exc}. Retrying in {delay:.1f}s would exceed "
+                    f"{policy.deadline:.0f}s deadline. Giving up."
+                )
+                raise
+
+            print(
+                f"{description}: attempt {attempt}/{policy.max_attempts} failed: "
+                f"{exc}. Retrying in {delay:.1f}s…"
+            )
+            record_retry(description)
+            time.sleep(delay)
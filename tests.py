@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import json
 import tempfile
 import subprocess
 
@@ -64,16 +66,38 @@ def extract_result(fpath):
 
 
 def launch_and_retrieve(**kwargs):
+    """find_tag run in-process using kwargs as environ"""
     import pprint
+    from unittest import mock
+
+    import find_tag
 
     pprint.pprint(kwargs)
-    subprocess.run([sys.executable, "./find_tag.py"], env=kwargs)
+    with mock.patch.dict(os.environ, kwargs, clear=True):
+        find_tag.write_env(kwargs["GITHUB_ENV"], *find_tag.find_tag_from_env())
     try:
         return extract_result(kwargs.get("GITHUB_ENV", "-"))
     except Exception:
         return None, None
 
 
+def test_find_tag_script(github_env, repo_name):
+    subprocess.run(
+        [sys.executable, "./find_tag.py"],
+        env=get_env(
+            github_env=github_env,
+            repo_name=repo_name,
+            image_name="openzim/zimit",
+            on_master="dev",
+            tag_pattern="v([0-9.]+)",
+            is_on_main_branch=True,
+            is_tag="v1.1",
+            latest_on_tag=True,
+        ),
+    )
+    assert extract_result(github_env) == ("1.1", True)
+
+
 def test_dnscache_main(github_env, repo_name):
     tag, latest = launch_and_retrieve(
         **get_env(
@@ -276,3 +300,1367 @@ def test_manual_tag_latest(github_env, repo_name):
     )
     assert tag == "toto"
     assert latest
+
+
+@pytest.mark.parametrize(
+    "cache, expected",
+    [
+        ("none", []),
+        (
+            "inline",
+            [
+                "--cache-from",
+                "type=registry,ref=ghcr.io/openzim/test:dev",
+                "--cache-to",
+                "type=inline",
+            ],
+        ),
+        (
+            "registry",
+            [
+                "--cache-from",
+                "type=registry,ref=ghcr.io/openzim/test:buildcache",
+                "--cache-to",
+                "type=registry,ref=ghcr.io/openzim/test:buildcache,mode=max",
+            ],
+        ),
+        (
+            "local",
+            [
+                "--cache-from",
+                "type=local,src=/tmp/cache",
+                "--cache-to",
+                "type=local,dest=/tmp/cache-new,mode=max",
+            ],
+        ),
+    ],
+)
+def test_cache_args(cache, expected):
+    from docker_build import get_cache_args
+
+    assert (
+        get_cache_args(
+            cache, "max", "/tmp/cache", ["ghcr.io", "docker.io"], "openzim/test", "dev"
+        )
+        == expected
+    )
+
+
+@pytest.mark.parametrize(
+    "platforms, machine, expected",
+    [
+        (["linux/amd64"], "x86_64", []),
+        (["linux/amd64", "linux/386"], "x86_64", []),
+        (
+            ["linux/amd64", "linux/arm64", "linux/arm/v7", "linux/arm/v6"],
+            "x86_64",
+            [("arm64", "qemu-aarch64"), ("arm", "qemu-arm")],
+        ),
+        (["linux/amd64", "linux/arm64"], "aarch64", [("amd64", "qemu-x86_64")]),
+    ],
+)
+def test_required_emulators(platforms, machine, expected):
+    from docker_install import get_required_emulators
+
+    assert get_required_emulators(platforms, machine) == expected
+
+
+def test_parse_base_images(tmp_path):
+    from docker_setup import parse_base_images
+
+    dockerfile = tmp_path / "Dockerfile"
+    dockerfile.write_text(
+        "ARG PY=3.11\n"
+        "FROM --platform=$BUILDPLATFORM python:${PY}-slim AS builder\n"
+        "RUN echo \\\n"
+        "  hello\n"
+        "FROM builder AS second\n"
+        "FROM $UNKNOWN\n"
+        "FROM scratch\n"
+        "FROM alpine:3.19\n"
+    )
+    assert parse_base_images(str(dockerfile), {}) == ["python:3.11-slim", "alpine:3.19"]
+    assert parse_base_images(str(dockerfile), {"PY": "3.12"}) == [
+        "python:3.12-slim",
+        "alpine:3.19",
+    ]
+
+
+@pytest.mark.parametrize(
+    "headers, now, expected",
+    [
+        ({}, 40, None),
+        ({"Retry-After": "12"}, 40, 12.0),
+        ({"Retry-After": "Thu, 01 Jan 1970 00:01:40 GMT"}, 40, 60.0),
+        # epoch timestamp
+        (
+            {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "2000000070"},
+            2000000040,
+            30.0,
+        ),
+        (
+            {"X-RateLimit-Remaining": "10", "X-RateLimit-Reset": "2000000070"},
+            2000000040,
+            None,
+        ),
+        # number of seconds
+        ({"RateLimit-Remaining": "0", "RateLimit-Reset": "5"}, 40, 5.0),
+    ],
+)
+def test_retry_after(headers, now, expected):
+    from retry import get_retry_after
+
+    assert get_retry_after(headers, now=now) == expected
+
+
+def test_retry_call(monkeypatch):
+    import urllib.error
+
+    import retry
+
+    sleeps = []
+    monkeypatch.setattr(retry.time, "sleep", sleeps.append)
+
+    def failing(codes):
+        def func():
+            code = codes.pop(0)
+            if code:
+                raise urllib.error.HTTPError(
+                    "http://localhost", code, "error", {"Retry-After": "1"}, None
+                )
+            return "done"
+
+        return func
+
+    policy = retry.RetryPolicy(max_attempts=3)
+    assert retry.retry_call(failing([409, 503, 0]), policy, "test") == "done"
+    assert sleeps == [1.0, 1.0]
+
+    # non-retryable error is raised right away
+    with pytest.raises(urllib.error.HTTPError):
+        retry.retry_call(failing([401, 0]), policy, "test")
+    assert len(sleeps) == 2
+
+    # exhausted attempts
+    with pytest.raises(urllib.error.HTTPError):
+        retry.retry_call(failing([429, 429, 429, 0]), policy, "test")
+    assert len(sleeps) == 4
+
+
+def test_dockerio_changes():
+    from update_dockerio_descriptions import get_changes
+
+    current = {"description": "a", "full_description": "b", "star_count": 1}
+    assert get_changes({"description": "a", "full_description": "b"}, current) == {}
+    assert get_changes({"description": "c", "full_description": "b"}, current) == {
+        "description": "c"
+    }
+    assert get_changes({"full_description": "d"}, {}) == {"full_description": "d"}
+
+
+def test_dockerhub_token_cache(tmp_path):
+    import base64
+    import json
+    import time
+
+    from dockerhub_auth import TokenCache, get_jwt_expiry
+
+    def make_jwt(exp):
+        payload = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode())
+        return "header.{}.signature".format(payload.decode().rstrip("="))
+
+    expiry = int(time.time()) + 3600
+    valid, expiring = make_jwt(expiry), make_jwt(time.time() + 10)
+    assert get_jwt_expiry(valid) == expiry
+    assert get_jwt_expiry("not-a-jwt") is None
+
+    cache = TokenCache(tmp_path)
+    assert cache.get("user") is None
+    cache.set("user", valid)
+    assert cache.get("user") == valid
+    assert cache.get_path("user").stat().st_mode & 0o777 == 0o600
+    cache.set("user", expiring)
+    assert cache.get("user") is None
+    cache.drop("user")
+    assert not cache.get_path("user").exists()
+
+
+@pytest.fixture
+def http_stand_in():
+    """local HTTP/1.1 server, answering JSON with gzip for GET and 409 for POST"""
+    import gzip
+    import http.server
+    import json
+    import threading
+
+    connections = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            connections.append(self.client_address)
+
+        def do_GET(self):
+            body = gzip.compress(json.dumps({"path": self.path}).encode("utf-8"))
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(409)
+            self.send_header("Retry-After", "3")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", connections
+    server.shutdown()
+
+
+def test_http_client(http_stand_in):
+    import urllib.error
+
+    from http_client import HTTPClient
+
+    base_url, connections = http_stand_in
+    client = HTTPClient(base_url_overrides={"api.github.com": base_url})
+    for _ in range(3):
+        response = client.request("GET", "https://api.github.com/repos/a/b?x=1")
+        assert response.json() == {"path": "/repos/a/b?x=1"}
+    # single kept-alive connection
+    assert len(connections) == 1
+
+    with pytest.raises(urllib.error.HTTPError) as exc_info:
+        client.request_json("POST", f"{base_url}/webhook", {"a": 1})
+    assert exc_info.value.code == 409
+    assert exc_info.value.headers["Retry-After"] == "3"
+    client.close()
+
+
+def test_github_repository_etag(tmp_path, monkeypatch):
+    import email.message
+
+    import github_api
+    from config import Config
+    from http_client import Response
+
+    requests = []
+
+    class FakeClient:
+        def request(self, method, url, headers=None):
+            requests.append(headers)
+            message = email.message.Message()
+            if headers.get("If-None-Match") == '"abc"':
+                return Response(url, 304, "Not Modified", message, b"")
+            message["ETag"] = '"abc"'
+            return Response(url, 200, "OK", message, b'{"default_branch": "main"}')
+
+    monkeypatch.setattr(github_api, "get_client", FakeClient)
+    config = Config(action_cache_dir=str(tmp_path), github_token="xxx")
+
+    assert github_api.get_repository("openzim/a", config)["default_branch"] == "main"
+    # memoized for the run
+    assert github_api.get_repository("openzim/a", config)["default_branch"] == "main"
+    assert len(requests) == 1
+    assert requests[0]["Authorization"] == "Bearer xxx"
+
+    # next run revalidates using ETag
+    github_api._repositories.clear()
+    assert github_api.get_repository("openzim/a", config)["default_branch"] == "main"
+    assert requests[1]["If-None-Match"] == '"abc"'
+
+
+def test_metrics(tmp_path, monkeypatch):
+    import time
+
+    import metrics
+
+    monkeypatch.setattr(metrics, "_retries", metrics.collections.Counter())
+    monkeypatch.setattr(metrics, "_builds", [])
+    monkeypatch.setattr(metrics, "_pushes", [])
+
+    def flaky():
+        metrics.record_retry("docker.io Hub API")
+        return 0
+
+    recorder = metrics.Metrics(time.monotonic())
+    assert recorder.run("hub", flaky) == 0
+    assert recorder.run("tag", lambda: ("1.0", True)) == ("1.0", True)
+    assert recorder.run("build", lambda: 2) == 2
+    with pytest.raises(RuntimeError):
+        recorder.run("webhook", lambda: (_ for _ in ()).throw(RuntimeError()))
+    metrics.record_build("linux/amd64", 12.3456, 0, "sha256:abc")
+
+    assert [
+        (step["name"], step["status"], step["retries"]) for step in recorder.steps
+    ] == [
+        ("startup", 0, 0),
+        ("hub", 0, 1),
+        ("tag", 0, 0),
+        ("build", 2, 0),
+        ("webhook", 1, 0),
+    ]
+
+    recorder.write_json(tmp_path / "metrics.json", tag="1.0")
+    data = json.loads((tmp_path / "metrics.json").read_text())
+    assert data["tag"] == "1.0"
+    assert data["retries"] == {"docker.io Hub API": 1}
+    assert data["builds"] == [
+        {
+            "image": "",
+            "name": "linux/amd64",
+            "duration": 12.346,
+            "status": 0,
+            "digest": "sha256:abc",
+            "size": None,
+        }
+    ]
+
+    recorder.write_summary(tmp_path / "summary.md", "openzim/test:1.0")
+    summary = (tmp_path / "summary.md").read_text()
+    assert "| hub | ✅ |" in summary
+    assert "| build | ❌ 2 |" in summary
+    assert "`sha256:abc`" in summary
+
+
+@pytest.mark.parametrize(
+    "patterns, path, excluded",
+    [
+        (["*.md"], "README.md", True),
+        (["*.md"], "docs/README.md", False),
+        (["**/*.md"], "docs/README.md", True),
+        (["**/*.md"], "README.md", True),
+        (["build"], "build/lib/x.py", True),
+        (["*.md", "!README.md"], "README.md", False),
+        (["docs/", "!docs/keep.txt"], "docs/keep.txt", False),
+        (["docs/", "!docs/keep.txt"], "docs/other.txt", True),
+        (["fil?.[a-c]"], "file.b", True),
+        (["fil?.[!a-c]"], "file.b", False),
+    ],
+)
+def test_dockerignore(patterns, path, excluded):
+    from context_hash import DockerIgnore
+
+    assert DockerIgnore(patterns).is_excluded(path) is excluded
+
+
+def test_context_hash(tmp_path):
+    from context_hash import get_context_hash
+
+    context = tmp_path / "context"
+    (context / "src").mkdir(parents=True)
+    (context / "Dockerfile").write_text("FROM alpine\nCOPY src /src\n")
+    (context / ".dockerignore").write_text("*.log\n")
+    (context / "src" / "main.py").write_text("print('hello')\n")
+    dockerfile = str(context / "Dockerfile")
+    cache_dir = tmp_path / "cache"
+
+    def get_hash(build_args=None, platforms=None, target=""):
+        return get_context_hash(
+            str(context),
+            dockerfile,
+            build_args or {},
+            platforms or ["linux/amd64"],
+            cache_dir,
+            target,
+        )
+
+    initial = get_hash()
+    assert len(list(cache_dir.iterdir())) == 1
+    assert get_hash() == initial
+
+    # ignored files don't change hash
+    (context / "build.log").write_text("ignored")
+    assert get_hash() == initial
+
+    assert get_hash(build_args={"VERSION": "1.0"}) != initial
+    assert get_hash(platforms=["linux/amd64", "linux/arm64"]) != initial
+    assert get_hash(target="runtime") != initial
+    assert get_hash(target="runtime") != get_hash(target="builder")
+
+    (context / "src" / "main.py").write_text("print('hello world')\n")
+    assert get_hash() != initial
+
+
+def test_publish_existing(monkeypatch):
+    import docker_build
+
+    published = {
+        "ghcr.io/openzim/test:dev": {
+            "linux/amd64": {"org.opencontainers.image.revision": "abc"},
+            "linux/arm64": {"org.opencontainers.image.revision": "abc"},
+        },
+        "ghcr.io/openzim/test:1.0": {
+            "linux/amd64": {"org.opencontainers.image.revision": "abc"},
+        },
+    }
+    created = []
+    monkeypatch.setattr(docker_build, "get_image_labels", published.get)
+    monkeypatch.setattr(
+        docker_build,
+        "create_manifest",
+        lambda tags, sources: created.append((tags, sources)) or 0,
+    )
+
+    tags = ["ghcr.io/openzim/test:1.0", "ghcr.io/openzim/test:latest"]
+    candidates = ["ghcr.io/openzim/test:dev"]
+    label = "org.opencontainers.image.revision"
+
+    # 1.0 lacks arm64 so dev is promoted to both tags
+    assert (
+        docker_build.publish_existing(
+            tags, candidates, ["linux/amd64", "linux/arm64"], label, "abc"
+        )
+        == 0
+    )
+    assert created == [(tags, ["ghcr.io/openzim/test:dev"])]
+
+    # 1.0 is already there, only latest is missing
+    created.clear()
+    assert docker_build.publish_existing(tags, [], ["linux/amd64"], label, "abc") == 0
+    assert created == [(["ghcr.io/openzim/test:latest"], ["ghcr.io/openzim/test:1.0"])]
+
+    # other commit: nothing to promote
+    assert (
+        docker_build.publish_existing(tags, candidates, ["linux/amd64"], label, "def")
+        is None
+    )
+
+
+@pytest.fixture(scope="module")
+def bench_results(tmp_path_factory):
+    from bench.run import run_scenario
+
+    tmpdir = tmp_path_factory.mktemp("bench")
+    return {
+        name: run_scenario(name, tmpdir / name)
+        for name in (
+            "hub-and-webhook",
+            "promote",
+            "batch-bake",
+            "zstd",
+            "failed-build",
+            "multi-platform-parallel",
+        )
+    }
+
+
+def test_bench_hub_and_webhook(bench_results):
+    result = bench_results["hub-and-webhook"]
+    assert result["returncode"] == 0, result["output"]
+    assert [call["command"] for call in result["docker"]].count("build") == 1
+    steps = {step["name"]: step for step in result["metrics"]["steps"]}
+    assert steps["webhook"]["retries"] == 2
+    assert result["webhook_payloads"][0]["push_data"]["tag"] == "dev"
+    assert (
+        result["hub_repositories"]["openzim/bench"]["description"]
+        == "openzim/bench description"
+    )
+    assert result["metrics"]["builds"][0]["digest"].startswith("sha256:")
+
+
+def test_bench_promote(bench_results):
+    result = bench_results["promote"]
+    assert result["returncode"] == 0, result["output"]
+    assert "build" not in [call["command"] for call in result["docker"]]
+    assert set(result["images"]) == {
+        "ghcr.io/openzim/bench:dev",
+        "ghcr.io/openzim/bench:1.0",
+        "ghcr.io/openzim/bench:latest",
+    }
+
+
+def test_parse_batch():
+    from batch import parse_batch
+    from config import Config
+
+    config = Config(platforms=["linux/amd64"], build_args={"A": "1"})
+    config.batch = json.dumps(
+        [
+            {"image-name": "openzim/base", "context": "base"},
+            {
+                "image-name": "openzim/worker",
+                "build-args": "B=2",
+                "platforms": "linux/amd64 linux/arm64",
+                "depends-on": ["openzim/base"],
+            },
+        ]
+    )
+    images = parse_batch(config)
+    assert images["openzim/base"].config.context == "base"
+    # a builder for this run only, unless builder-name is set
+    assert (
+        images["openzim/base"].config.builder == f"docker-publish-batch-{os.getpid()}"
+    )
+    config.github_run_id, config.github_job = "42", "build images"
+    images = parse_batch(config)
+    assert (
+        images["openzim/worker"].config.builder
+        == f"docker-publish-batch-42-build-images-{os.getpid()}"
+    )
+    assert images["openzim/base"].config.build_args == {"A": "1"}
+    assert images["openzim/worker"].config.build_args == {"B": "2"}
+    assert images["openzim/worker"].config.platforms == ["linux/amd64", "linux/arm64"]
+    assert images["openzim/worker"].depends_on == ["openzim/base"]
+
+    for batch in (
+        "[]",
+        '[{"context": "x"}]',
+        '[{"image-name": "a", "tags": "x"}]',
+        '[{"image-name": "a"}, {"image-name": "a"}]',
+        '[{"image-name": "a", "depends-on": ["b"]}]',
+        '[{"image-name": "a", "depends-on": ["b"]}, '
+        '{"image-name": "b", "depends-on": ["a"]}]',
+    ):
+        config.batch = batch
+        with pytest.raises(ValueError):
+            parse_batch(config)
+
+
+def test_run_batch():
+    import threading
+    import time
+
+    from batch import BatchImage, run_batch
+    from config import Config
+
+    events, lock = [], threading.Lock()
+
+    def build(config):
+        with lock:
+            events.append(f"start {config.image_name}")
+        time.sleep(0.05)
+        with lock:
+            events.append(f"end {config.image_name}")
+        return 1 if config.image_name == "broken" else 0
+
+    images = {
+        name: BatchImage(Config(image_name=name), depends_on)
+        for name, depends_on in (
+            ("worker", ["base"]),
+            ("base", []),
+            ("api", []),
+            ("broken", []),
+            ("plugin", ["broken"]),
+            ("plugin-ui", ["plugin"]),
+        )
+    }
+    results = run_batch(images, build, max_parallel=3)
+
+    assert list(results) == list(images)
+    assert {name: ret for name, (ret, _) in results.items()} == {
+        "worker": 0,
+        "base": 0,
+        "api": 0,
+        "broken": 1,
+        "plugin": None,
+        "plugin-ui": None,
+    }
+    # independent images ran concurrently, dependent one after its dependency
+    assert events[:3] == ["start base", "start api", "start broken"]
+    assert events.index("start worker") > events.index("end base")
+
+
+def test_bake_target():
+    from bake import get_target, get_target_name
+    from config import Config
+
+    config = Config(
+        image_name="openzim/zimit",
+        registries=["ghcr.io"],
+        tag="1.2",
+        latest=True,
+        context="./app",
+        build_args={"VERSION": "{tag}"},
+        platforms=["linux/amd64"],
+        target="api",
+        cache="registry",
+    )
+    target = get_target(config, {"org.opencontainers.image.revision": "abc"})
+
+    assert get_target_name(config.image_name) == "openzim_zimit"
+    assert target["args"] == {"VERSION": "1.2"}
+    assert target["tags"] == [
+        "ghcr.io/openzim/zimit:1.2",
+        "ghcr.io/openzim/zimit:latest",
+    ]
+    assert target["target"] == "api"
+    assert target["labels"] == {"org.opencontainers.image.revision": "abc"}
+    assert target["cache-from"] == [
+        "type=registry,ref=ghcr.io/openzim/zimit:buildcache"
+    ]
+    assert len(target["cache-to"]) == 1
+
+
+def test_bench_batch_bake(bench_results):
+    result = bench_results["batch-bake"]
+    assert result["returncode"] == 0, result["output"]
+    bakes = [call for call in result["docker"] if call["command"] == "bake"]
+    # independent images in a single bake, dependent one in a second
+    assert len(bakes) == 2
+    assert "ghcr.io/openzim/bench-worker:dev" in result["images"]
+    # a builder is created for the run, and removed afterwards
+    creates = [call["args"] for call in result["docker"] if call["command"] == "create"]
+    removes = [call["args"] for call in result["docker"] if call["command"] == "rm"]
+    assert len(creates) == 1 and creates[0][3].startswith("docker-publish-batch-")
+    assert [args[-1] for args in removes] == [creates[0][3]]
+    assert {build["name"] for build in result["metrics"]["builds"]} == {"bake"}
+
+
+def test_buildkitd_config(tmp_path):
+    import tomllib
+
+    from builder import get_buildkitd_config, parse_buildkitd_config
+    from config import Config
+
+    assert get_buildkitd_config(Config()) == ""
+
+    config_file = tmp_path / "buildkitd.toml"
+    config_file.write_text(
+        "debug = true\n"
+        "[worker.oci]\n"
+        '  platforms = ["linux/amd64"]\n'
+        "  max-parallelism = 8\n"
+        "[[worker.oci.gcpolicy]]\n"
+        "  keepBytes = 1024\n"
+        "[[worker.oci.gcpolicy]]\n"
+        "  all = true\n"
+    )
+    config = Config(
+        buildkitd_config=str(config_file),
+        buildkitd_max_parallelism="4",
+        buildkitd_gc_keep_storage="20GB",
+    )
+    # inputs win over buildkitd-config's own settings
+    assert tomllib.loads(get_buildkitd_config(config)) == {
+        "debug": True,
+        "worker": {
+            "oci": {
+                "platforms": ["linux/amd64"],
+                "max-parallelism": 4,
+                "gc": True,
+                "gckeepstorage": "20GB",
+                "gcpolicy": [{"keepBytes": 1024}, {"all": True}],
+            }
+        },
+    }
+
+    config = Config(buildkitd_config="debug = true", buildkitd_max_parallelism="2")
+    assert get_buildkitd_config(config) == (
+        "debug = true\n\n[worker.oci]\nmax-parallelism = 2\n"
+    )
+
+    with pytest.raises(ValueError):
+        parse_buildkitd_config("[worker.oci\nmax-parallelism = 2")
+
+
+def test_registry_mirrors():
+    import tomllib
+
+    from builder import get_buildkitd_config, parse_mirrors
+    from config import Config
+
+    config = Config(
+        buildkitd_config='[registry."docker.io"]\n  mirrors = ["a.example"]',
+        registry_mirrors=[
+            "mirror.gcr.io",
+            "a.example",
+            "ghcr.io=http://localhost:5000/ghcr/",
+        ],
+        insecure_mirrors=True,
+    )
+    mirrors = parse_mirrors(config.registry_mirrors)
+    assert mirrors == {
+        "docker.io": ["https://mirror.gcr.io", "https://a.example"],
+        "ghcr.io": ["http://localhost:5000/ghcr"],
+    }
+    # mirrors are appended to buildkitd-config's own, once
+    assert tomllib.loads(get_buildkitd_config(config, mirrors)) == {
+        "registry": {
+            "docker.io": {"mirrors": ["a.example", "mirror.gcr.io"]},
+            "mirror.gcr.io": {"insecure": True},
+            "a.example": {"insecure": True},
+            "ghcr.io": {"mirrors": ["localhost:5000/ghcr"]},
+            "localhost:5000/ghcr": {"http": True, "insecure": True},
+        }
+    }
+
+
+def test_bench_mirror(tmp_path):
+    from bench.run import run_scenario
+
+    result = run_scenario("mirror", tmp_path / "run", tmp_path)
+    assert result["returncode"] == 0, result["output"]
+    # unreachable mirror is logged but kept, BuildKit falls back to upstream
+    assert "for ghcr.io is unreachable" in result["output"]
+    (create,) = [
+        call["args"] for call in result["docker"] if call["command"] == "create"
+    ]
+    with open(create[create.index("--buildkitd-config") + 1], "r") as fh:
+        config = fh.read()
+    assert config.startswith('[registry."docker.io"]\nmirrors = ["127.0.0.1:')
+    assert '[registry."ghcr.io"]\nmirrors = ["127.0.0.1:9"]' in config
+
+
+def test_bench_persistent_builder(tmp_path):
+    from unittest import mock
+
+    from bench.run import SCENARIOS, run_scenario
+
+    def get_creates(run):
+        result = run_scenario("persistent-builder", tmp_path / run, tmp_path)
+        assert result["returncode"] == 0, result["output"]
+        return [
+            call["args"] for call in result["docker"] if call["command"] == "create"
+        ]
+
+    # created with its config, then reused while unchanged
+    creates = get_creates("1")
+    assert len(creates) == 1
+    assert creates[0][:4] == ["buildx", "create", "--name", "bench-builder"]
+    assert "--buildkitd-config" in creates[0]
+    assert get_creates("2") == []
+
+    inputs = SCENARIOS["persistent-builder"]["inputs"]
+    with mock.patch.dict(inputs, {"buildkitd-max-parallelism": "8"}):
+        assert len(get_creates("3")) == 1
+
+
+def test_builder_nodes():
+    from builder import (
+        get_create_commands,
+        get_node_platforms,
+        get_platforms_without_node,
+    )
+    from config import Config
+
+    config = Config(
+        builder_name="native",
+        builder_nodes={
+            "linux/arm64": "ssh://user@arm-host",
+            "linux/riscv64,linux/ppc64le": "power-context",
+        },
+    )
+    assert get_node_platforms(config) == [
+        "linux/arm64",
+        "linux/riscv64",
+        "linux/ppc64le",
+    ]
+    assert get_create_commands(config, "/tmp/buildkitd.toml") == [
+        "docker buildx create --name native --driver docker-container "
+        "--buildkitd-config /tmp/buildkitd.toml".split(),
+        "docker buildx create --name native --append --driver docker-container "
+        "--buildkitd-config /tmp/buildkitd.toml --node native-linux-arm64 "
+        "--platform linux/arm64 ssh://user@arm-host".split(),
+        "docker buildx create --name native --append --driver docker-container "
+        "--buildkitd-config /tmp/buildkitd.toml --node native-linux-riscv64 "
+        "--platform linux/riscv64,linux/ppc64le power-context".split(),
+    ]
+
+    # buildkitd daemons: no local node, config is theirs
+    config.builder_nodes = {
+        "linux/amd64": "tcp://127.0.0.1:1234",
+        "linux/arm64": "tcp://arm-builder:1234",
+    }
+    assert get_create_commands(config, "/tmp/buildkitd.toml") == [
+        "docker buildx create --name native --driver remote "
+        "--node native-linux-amd64 --platform linux/amd64 "
+        "tcp://127.0.0.1:1234".split(),
+        "docker buildx create --name native --append --driver remote "
+        "--node native-linux-arm64 --platform linux/arm64 "
+        "tcp://arm-builder:1234".split(),
+    ]
+    # no local node (nor QEMU) for platforms without a node
+    platforms = ["linux/amd64", "linux/arm64", "linux/arm/v7"]
+    assert get_platforms_without_node(config, platforms) == ["linux/arm/v7"]
+    config.builder_nodes = {"linux/arm64": "ssh://user@arm-host"}
+    assert get_platforms_without_node(config, platforms) == []
+
+
+def test_uses_builder():
+    from config import Config
+    from docker_build import uses_builder
+
+    config = Config(platforms=["linux/amd64"])
+    assert not uses_builder(config)
+    # docker driver ignores exporter options
+    for changes in (
+        {"compression": "zstd"},
+        {"compression_level": "9"},
+        {"force_compression": True},
+        {"oci_mediatypes": True},
+        {"zstd_variant": True},
+    ):
+        assert uses_builder(Config(platforms=["linux/amd64"], **changes)), changes
+
+
+def test_output_options():
+    from bake import get_target, get_variant_target
+    from config import Config
+    from docker_build import get_output_args, get_output_options
+
+    assert get_output_options(Config()) == ""
+    assert get_output_args(["ghcr.io/openzim/test:1.0"], "") == [
+        "--push",
+        "--tag",
+        "ghcr.io/openzim/test:1.0",
+    ]
+
+    config = Config(
+        image_name="openzim/test",
+        registries=["ghcr.io"],
+        tag="1.0",
+        compression="gzip",
+        compression_level="9",
+        platforms=["linux/amd64"],
+    )
+    assert get_output_options(config) == "compression=gzip,compression-level=9"
+    assert get_output_options(config, "zstd") == (
+        "compression=zstd,compression-level=9,force-compression=true,"
+        "oci-mediatypes=true"
+    )
+    config.compression_level = ""
+    config.compression = "estargz"
+    assert get_output_options(config) == "compression=estargz,oci-mediatypes=true"
+
+    # bake variant only differs by its output and tags
+    target = get_target(config, {})
+    variant = get_variant_target(target, config, "zstd")
+    assert target["output"] == [
+        "type=image,push=true,compression=estargz,oci-mediatypes=true"
+    ]
+    assert variant["tags"] == ["ghcr.io/openzim/test:1.0-zstd"]
+    assert variant["output"] == [
+        "type=image,push=true,compression=zstd,force-compression=true,"
+        "oci-mediatypes=true"
+    ]
+    assert "cache-to" not in variant
+    assert variant["cache-from"] == target["cache-from"]
+
+
+def test_bench_zstd(bench_results):
+    result = bench_results["zstd"]
+    assert result["returncode"] == 0, result["output"]
+    assert "ghcr.io/openzim/bench:dev-zstd" in result["images"]
+    builds = {build["name"]: build for build in result["metrics"]["builds"]}
+    assert list(builds) == ["all", "zstd"]
+    # two platforms of two layers each
+    assert builds["all"]["size"] == 2 * (3 * 2**20 + 512)
+    assert "[linux/arm64] 2 layers, 3.0MiB compressed" in result["output"]
+
+
+def test_build_log(capsys):
+    import base64
+
+    from build_log import BuildLog
+
+    def event(**kwargs):
+        return json.dumps(kwargs) + "\n"
+
+    log = BuildLog("linux/arm64", prefix="[linux/arm64] ", tail_lines=3)
+    base = {"digest": "a", "name": "[1/2] FROM alpine", "cached": True}
+    step = {"digest": "b", "name": "[2/2] RUN make", "started": "now"}
+    log.feed(event(vertexes=[dict(base, started="now", completed="now"), step]))
+    for index in range(1000):
+        data = base64.b64encode(f"line {index}\n".encode()).decode()
+        log.feed(event(logs=[{"vertex": "b", "data": data}]))
+    # only the tail of a running step's output is kept
+    assert list(log.tails["b"]) == ["line 997", "line 998", "line 999"]
+    log.feed(event(vertexes=[dict(step, completed="now", error="exit code: 2")]))
+    log.feed("ERROR: failed to build\n")
+    assert log.tails == {}
+    log.annotate()
+
+    assert capsys.readouterr().out.splitlines() == [
+        "[linux/arm64] #1 CACHED [1/2] FROM alpine",
+        "[linux/arm64] #2 [2/2] RUN make",
+        "[linux/arm64] #2 ERROR: exit code: 2",
+        "[linux/arm64] ERROR: failed to build",
+        "::error title=linux/arm64%3A [2/2] RUN make::"
+        "exit code: 2%0Aline 997%0Aline 998%0Aline 999",
+    ]
+
+
+def test_build_log_error_with_logs(capsys):
+    import base64
+
+    from build_log import BuildLog
+
+    log = BuildLog("all")
+    step = {"digest": "b", "name": "[2/2] RUN make", "started": "now"}
+    log.feed(json.dumps({"vertexes": [step]}))
+    data = base64.b64encode(b"compiling\nmake: *** fatal error\n").decode()
+    log.feed(
+        json.dumps(
+            {
+                "vertexes": [dict(step, completed="now", error="exit code: 2")],
+                "logs": [{"vertex": "b", "data": data}],
+            }
+        )
+    )
+    assert log.failures == [
+        ("[2/2] RUN make", "exit code: 2", ["compiling", "make: *** fatal error"])
+    ]
+
+
+def test_bench_failed_build(bench_results):
+    import gzip
+
+    result = bench_results["failed-build"]
+    assert result["returncode"] == 1
+    # step output is only in the annotation, and only its tail
+    assert "\ncompiling unit" not in result["output"]
+    (annotation,) = [
+        line for line in result["output"].splitlines() if line.startswith("::error")
+    ]
+    assert annotation.startswith("::error title=all%3A [2/2] RUN make::process")
+    assert annotation.endswith("%0Acompiling unit 99")
+    assert "compiling unit 69%0A" not in annotation
+
+    log_file = result["output"].split("Full build log written to ")[1].split()[0]
+    assert log_file.endswith("/docker-publish-logs/openzim-bench-all.log.gz")
+    with gzip.open(log_file, "rt") as fh:
+        events = [json.loads(line) for line in fh if line.startswith("{")]
+    assert len(events) == 3
+
+
+def test_bench_separate_push(tmp_path):
+    from unittest import mock
+
+    from bench.run import SCENARIOS, run_scenario
+
+    # first push fails, it's retried without rebuilding
+    result = run_scenario("separate-push", tmp_path / "1")
+    assert result["returncode"] == 0, result["output"]
+    commands = [call["command"] for call in result["docker"]]
+    assert commands.count("build") == 1
+    assert commands.count("imagetools-create") == 2
+    (push,) = result["metrics"]["pushes"]
+    assert (push["registry"], push["status"], push["attempts"]) == ("ghcr.io", 0, 2)
+    assert result["images"]["ghcr.io/openzim/bench:dev"] == {
+        "linux/amd64": {"org.opencontainers.image.revision": mock.ANY},
+        "linux/arm64": {"org.opencontainers.image.revision": mock.ANY},
+    }
+
+    # registries keep failing: pushes are reported as failed, build as successful
+    scenario = SCENARIOS["separate-push"]
+    inputs = {"registries": "ghcr.io docker.io", "retry-attempts": "2"}
+    with mock.patch.dict(scenario, {"docker_failures": "imagetools-create=4"}):
+        with mock.patch.dict(scenario["inputs"], inputs):
+            result = run_scenario("separate-push", tmp_path / "2")
+    assert result["returncode"] == 1
+    assert [build["status"] for build in result["metrics"]["builds"]] == [0]
+    assert [push["status"] for push in result["metrics"]["pushes"]] == [1, 1]
+    assert "could not be pushed to ghcr.io, docker.io" in result["output"]
+
+
+@pytest.mark.parametrize(
+    "mode, notified", [("build", True), ("build-shard", False), ("merge", True)]
+)
+def test_pipeline_notifications(monkeypatch, mode, notified):
+    import time
+
+    import pipeline
+    from config import Config
+    from metrics import Metrics
+
+    calls = []
+    monkeypatch.setattr(pipeline, "check", lambda config: 0)
+    monkeypatch.setattr(pipeline, "find_tag", lambda config: ("1.0", False))
+    monkeypatch.setattr(pipeline, "write_env", lambda config: None)
+    monkeypatch.setattr(pipeline, "write_tag_env", lambda *args: None)
+    monkeypatch.setattr(pipeline, "display_tag", lambda config: None)
+    monkeypatch.setattr(pipeline, "setup", lambda config: {})
+    monkeypatch.setattr(pipeline, "report", lambda results: 0)
+    monkeypatch.setattr(pipeline, "build_and_push", lambda config: 0)
+    monkeypatch.setattr(pipeline, "docker_logout", lambda config: 0)
+    for name in ("update_dockerio_api", "run_webhook"):
+        monkeypatch.setattr(
+            pipeline, name, lambda config, name=name: calls.append(name) or 0
+        )
+
+    config = Config(
+        mode=mode,
+        registries=["docker.io"],
+        repo_description="auto",
+        webhook_url="https://example.com/hook",
+    )
+    assert pipeline.run_pipeline(config, Metrics(time.monotonic())) == 0
+    expected = ["update_dockerio_api", "run_webhook"] if notified else []
+    assert calls == expected
+
+
+def test_merge_shards(tmp_path, monkeypatch):
+    import docker_build
+
+    created = []
+    monkeypatch.delenv("GITHUB_OUTPUT", raising=False)
+    monkeypatch.setattr(
+        docker_build,
+        "create_manifest",
+        lambda tags, sources: created.append(sources) or 0,
+    )
+    monkeypatch.setattr(
+        docker_build,
+        "build_platform",
+        lambda platform, *args: "sha256:" + docker_build.get_platform_slug(platform),
+    )
+
+    shards_dir = str(tmp_path)
+    for image_name, platform, run_id in (
+        ("openzim/test", "linux/amd64", "42"),
+        ("openzim/test", "linux/arm64", "42"),
+        ("openzim/test", "linux/riscv64", "42"),  # not requested anymore
+        ("openzim/test", "linux/arm/v7", "41"),  # left by a previous run
+        # another image sharing shards_dir
+        ("openzim/other", "linux/amd64", "42"),
+        ("openzim/other", "linux/arm64", "42"),
+    ):
+        ret = docker_build.build_shard(
+            [],
+            platform,
+            ["ghcr.io"],
+            image_name,
+            shards_dir,
+            tag="1.0",
+            run_id=run_id,
+        )
+        assert ret == 0
+    assert len(os.listdir(shards_dir)) == 6
+
+    merge = [["ghcr.io"], "openzim/test", "1.0", False, "42"]
+    platforms = ["linux/amd64", "linux/arm64"]
+    assert docker_build.merge_shards(shards_dir, platforms, *merge) == 0
+    assert created == [
+        [
+            "ghcr.io/openzim/test@sha256:linux-amd64",
+            "ghcr.io/openzim/test@sha256:linux-arm64",
+        ]
+    ]
+    # each image's shards are kept
+    created.clear()
+    other = [["ghcr.io"], "openzim/other", "1.0", False, "42"]
+    assert docker_build.merge_shards(shards_dir, platforms, *other) == 0
+    assert created == [
+        [
+            "ghcr.io/openzim/other@sha256:linux-amd64",
+            "ghcr.io/openzim/other@sha256:linux-arm64",
+        ]
+    ]
+    # shard of an other run doesn't count
+    platforms = ["linux/amd64", "linux/arm/v7"]
+    assert docker_build.merge_shards(shards_dir, platforms, *merge) == 1
+
+
+def test_bench_parallel(bench_results, tmp_path):
+    import re
+    from unittest import mock
+
+    from bench.run import SCENARIOS, run_scenario
+
+    result = bench_results["multi-platform-parallel"]
+    assert result["returncode"] == 0, result["output"]
+    calls = result["docker"]
+    # one builder per platform, named after the run
+    created = [call["args"][3] for call in calls if call["command"] == "create"]
+    assert len(set(created)) == 3
+    assert all(re.match(r"docker-publish-\d+-linux-", name) for name in created)
+    removed = [call["args"][2] for call in calls if call["command"] == "rm"]
+    assert sorted(removed) == sorted(created)
+    assert [call["command"] for call in calls].count("build") == 3
+    (merge,) = [
+        call["args"] for call in calls if call["command"] == "imagetools-create"
+    ]
+    assert len([arg for arg in merge if "@sha256:" in arg]) == 3
+
+    # a builder that can't be created fails its platform, nothing is published
+    scenario = SCENARIOS["multi-platform-parallel"]
+    with mock.patch.dict(scenario, {"docker_failures": "create=1"}):
+        result = run_scenario("multi-platform-parallel", tmp_path)
+    assert result["returncode"] == 1
+    assert "Unable to create builder instance" in result["output"]
+    commands = [call["command"] for call in result["docker"]]
+    assert "imagetools-create" not in commands
+
+
+def test_login_registry(monkeypatch):
+    import docker_login
+    from retry import RetryPolicy
+
+    returncodes = [1, 1, 0]
+    sleeps = []
+    monkeypatch.setattr(docker_login.time, "sleep", sleeps.append)
+    monkeypatch.setattr(
+        docker_login.subprocess,
+        "run",
+        lambda *args, **kwargs: subprocess.CompletedProcess(
+            args, returncodes.pop(0), stdout="denied"
+        ),
+    )
+
+    policy = RetryPolicy(max_attempts=3, base_delay=1.0, jitter=0)
+    assert docker_login.login_registry("ghcr.io", "user", "token", policy) == (
+        0,
+        "denied",
+    )
+    assert sleeps == [1.0, 2.0]
+
+    returncodes[:] = [1, 1, 1]
+    assert docker_login.login_registry("ghcr.io", "user", "token", policy) == (
+        1,
+        "denied (after 3 attempts)",
+    )
+
+    # no attempt once deadline would be exceeded
+    returncodes[:] = [1, 1]
+    sleeps.clear()
+    policy.deadline = 1.5
+    assert docker_login.login_registry("ghcr.io", "user", "token", policy) == (
+        1,
+        "denied (after 2 attempts)",
+    )
+    assert sleeps == [1.0]
+
+    # no docker login runs past the deadline, waiting for others included
+    clock, timeouts = [0.0], []
+
+    def run(*args, timeout, **kwargs):
+        timeouts.append(timeout)
+        clock[0] += timeout
+        raise subprocess.TimeoutExpired(args[0], timeout)
+
+    monkeypatch.setattr(docker_login.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(docker_login.subprocess, "run", run)
+    policy = RetryPolicy(max_attempts=3, base_delay=0.5, jitter=0, deadline=40)
+    assert docker_login.login_registry("ghcr.io", "user", "token", policy) == (
+        -1,
+        "timed out after 10s (after 2 attempts)",
+    )
+    assert timeouts == [docker_login.LOGIN_TIMEOUT, 10]
+    timeouts.clear()
+    with docker_login.CONFIG_LOCK:
+        policy.deadline = 0.1
+        assert docker_login.login_registry("ghcr.io", "user", "token", policy)[0] == -1
+    assert timeouts == []
+
+
+def test_run_concurrently():
+    import threading
+
+    from docker_setup import run_concurrently
+
+    release = threading.Event()
+
+    def fail():
+        raise RuntimeError("failed")
+
+    results = run_concurrently(
+        {
+            "ok": (lambda: 0, 5),
+            "stuck": (lambda: release.wait(), 0.2),
+            "failed": (lambda: 2, 5),
+            "raising": (fail, 5),
+        }
+    )
+    release.set()
+    assert list(results) == ["ok", "stuck", "failed", "raising"]
+    assert {name: ret for name, (ret, _) in results.items()} == {
+        "ok": 0,
+        "stuck": -1,
+        "failed": 2,
+        "raising": 1,
+    }
+    # timed out tasks are reported at their timeout, not when they end
+    assert results["stuck"][1] == 0.2
+
+
+def test_docker_login(monkeypatch):
+    import docker_login
+    from config import Config
+
+    logged_out = []
+    monkeypatch.setattr(
+        docker_login,
+        "login_registry",
+        lambda registry, username, token, policy: (
+            (0, "") if username else (1, "denied")
+        ),
+    )
+    monkeypatch.setattr(
+        docker_login,
+        "docker_logout",
+        lambda config, registries: logged_out.append(registries),
+    )
+
+    config = Config(
+        registries=["ghcr.io", "docker.io", "quay.io"],
+        credentials={"GHCRIO_USERNAME": "user", "QUAYIO_USERNAME": "user"},
+    )
+    assert docker_login.docker_login(config) == 1
+    # registries we could login to aren't left with credentials
+    assert logged_out == [["ghcr.io", "quay.io"]]
+
+    logged_out.clear()
+    config.registries = ["ghcr.io", "quay.io"]
+    assert docker_login.docker_login(config) == 0
+    assert logged_out == []
+
+
+def test_docker_login_config_file(tmp_path, monkeypatch):
+    import docker_login
+    from config import Config
+
+    # docker CLI's read-modify-write of its config file, slow enough to race
+    docker = tmp_path / "docker"
+    docker.write_text(
+        f"#!{sys.executable}\n"
+        "import json, os, sys, time\n"
+        "path = os.path.join(os.environ['DOCKER_CONFIG'], 'config.json')\n"
+        "with open(path) as fh:\n"
+        "    auths = json.load(fh)['auths']\n"
+        "time.sleep(0.2)\n"
+        "if sys.argv[1] == 'login':\n"
+        "    auths[sys.argv[-1]] = {'auth': sys.stdin.read().strip()}\n"
+        "else:\n"
+        "    auths.pop(sys.argv[-1], None)\n"
+        "with open(path, 'w') as fh:\n"
+        "    json.dump({'auths': auths}, fh)\n"
+    )
+    docker.chmod(0o755)
+    config_file = tmp_path / "config.json"
+    config_file.write_text('{"auths": {}}')
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("DOCKER_CONFIG", str(tmp_path))
+
+    registries = ["ghcr.io", "docker.io", "quay.io"]
+    config = Config(
+        registries=registries,
+        credentials={
+            f"{registry.replace('.', '').upper()}_{key}": registry
+            for registry in registries
+            for key in ("USERNAME", "TOKEN")
+        },
+    )
+    assert docker_login.docker_login(config) == 0
+    assert json.loads(config_file.read_text())["auths"] == {
+        registry: {"auth": registry} for registry in registries
+    }
+
+    docker_login.docker_logout(config)
+    assert json.loads(config_file.read_text())["auths"] == {}
+
+
+class FakeResponse:
+    """urlopen() response serving data"""
+
+    def __init__(self, data: bytes):
+        import io
+
+        self.stream = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+@pytest.mark.parametrize(
+    "machine, arch",
+    [
+        ("x86_64", "amd64"),
+        ("AMD64", "amd64"),
+        ("aarch64", "arm64"),
+        ("arm64", "arm64"),
+        ("armv7l", "arm-v7"),
+        ("armv6l", "arm-v6"),
+        ("ppc64le", "ppc64le"),
+        ("s390x", "s390x"),
+        ("riscv64", "riscv64"),
+        ("mips64", "mips64"),  # unknown machines are used as-is
+    ],
+)
+def test_buildx_arch(monkeypatch, machine, arch):
+    import docker_install
+
+    monkeypatch.setattr(docker_install.platform, "machine", lambda: machine)
+    assert docker_install.get_buildx_arch() == arch
+
+
+def test_download_buildx(tmp_path, monkeypatch):
+    import hashlib
+
+    import docker_install
+
+    binary = b"buildx binary"
+    checksum = hashlib.sha256(binary).hexdigest()
+    files = {
+        "checksums.txt": (
+            f"{'0' * 64}  buildx-v0.31.1.linux-arm64\n"
+            f"{checksum.upper()} *buildx-v0.31.1.linux-amd64\n"
+        ).encode(),
+        "buildx-v0.31.1.linux-amd64": binary,
+    }
+
+    def urlopen(url, timeout=None):
+        return FakeResponse(files[url.rsplit("/", 1)[1]])
+
+    monkeypatch.setattr(docker_install.urllib.request, "urlopen", urlopen)
+
+    asset = "buildx-v0.31.1.linux-amd64"
+    assert docker_install.get_release_checksum("0.31.1", asset) == checksum
+    with pytest.raises(ValueError, match="no checksum"):
+        docker_install.get_release_checksum("0.31.1", "buildx-v0.31.1.linux-s390x")
+
+    dest = tmp_path / "cache" / "docker-buildx"
+    docker_install.download_buildx("0.31.1", "amd64", dest)
+    assert dest.read_bytes() == binary
+    assert os.access(dest, os.X_OK)
+
+    # mismatch: nothing (not even a partial file) is left at dest
+    dest.unlink()
+    files[asset] = b"tampered binary"
+    with pytest.raises(ValueError, match="checksum mismatch"):
+        docker_install.download_buildx("0.31.1", "amd64", dest)
+    assert list(dest.parent.iterdir()) == []
+
+
+def test_install_docker_from_cache(tmp_path, monkeypatch):
+    import docker_install
+    from config import Config
+
+    config = Config(action_cache_dir=str(tmp_path / "cache"), buildx_version="0.31.1")
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.setattr(docker_install, "check_installed_version", lambda: "0.12.0")
+    monkeypatch.setattr(docker_install, "get_buildx_arch", lambda: "arm64")
+
+    def download(*args):
+        raise AssertionError("cached binary is not downloaded again")
+
+    monkeypatch.setattr(docker_install, "download_buildx", download)
+
+    cached = tmp_path / "cache" / "buildx" / "0.31.1" / "arm64" / "docker-buildx"
+    cached.parent.mkdir(parents=True)
+    cached.write_bytes(b"cached buildx")
+    assert docker_install.install_docker(config) == 0
+    plugin = tmp_path / "home" / ".docker" / "cli-plugins" / "docker-buildx"
+    assert plugin.read_bytes() == b"cached buildx"
+    assert os.access(plugin, os.X_OK)
+
+    # requested version already installed
+    monkeypatch.setattr(docker_install, "check_installed_version", lambda: "0.31.1")
+    plugin.unlink()
+    assert docker_install.install_docker(config) == 0
+    assert not plugin.exists()
@@ -1,124 +1,103 @@
+import hashlib
 import json
-import os
 import pathlib
 import re
 import sys
-import time
 import urllib.error
-import urllib.request
-from typing import Dict, Tuple
+from typing import Dict, Optional
+
+from config import Config
+from dockerhub_auth import call_with_token
+from github_api import get_repository
+from http_client import get_client
+from retry import retry_call
 
 FULLDESC_MAX_FILE_SIZE = 25000  # 25KB
 DESC_MAX_CHARS = 100
 
 
-def get_credentials(registry: str) -> Tuple[str, str]:
-    """Username, password for a registry reading environ"""
-    credentials = dict(
-        [
-            [x.strip() for x in item.split("=")] if "=" in item else (item.strip(), "")
-            for item in os.getenv("CREDENTIALS", "").split()
-        ]
-    )
-
-    prefix = registry.upper().replace(".", "")
-    return (
-        credentials.get(f"{prefix}_USERNAME", ""),
-        credentials.get(f"{prefix}_TOKEN", ""),
-    )
-
-
-def get_dockerhub_jwt(username: str, password: str) -> str:
-    """docker.io's Hub API JWT from logging-in with username and password"""
-    json_payload = json.dumps({"username": username, "password": password}).encode(
-        "utf-8"
-    )
-    response = urllib.request.urlopen(
-        urllib.request.Request(
-            url="https://hub.docker.com/v2/users/login",
-            data=json_payload,
-            headers={
-                "Content-Type": "application/json; charset=utf-8",
-                "Content-Length": len(json_payload),
-            },
-            method="POST",
-        )
+def get_github_description(repository: str, config: Config) -> str:
+    """API-provided description of a public repository on Github"""
+    return get_repository(repository, config).get("description")
+
+
+def get_dockerio_repository(image_name: str, token: Optional[str] = None) -> Dict:
+    """docker.io's Hub API repository metadata (token not needed if public)"""
+    headers = {"Accept": "application/json"}
+    if token:
+        headers["Authorization"] = "JWT {}".format(token)
+    response = get_client().request(
+        "GET",
+        "https://hub.docker.com/v2/repositories/{}/".format(image_name),
+        headers=headers,
     )
-
-    if not response.getcode() == 200:
-        raise ValueError(
-            "Unable to login to docker.io's hub API: HTTP {}: {}".format(
-                response.getcode(), response.reason
-            )
-        )
-
     try:
-        body = response.read()
-        return json.loads(body.decode("UTF-8")).get("token")
+        return response.json()
     except Exception as exc:
         raise ValueError(
-            "Unable to read hub API's response: {} -- {}".format(exc, body)
+            "Unable to read hub API's response: {} -- {}".format(exc, response.body)
         )
 
 
-def get_github_description(repository: str) -> str:
-    """API-provided description of a public repository on Github"""
-    response = urllib.request.urlopen(
-        urllib.request.Request(
-            url="https://api.github.com/repos/{}".format(
-                os.getenv("GITHUB_REPOSITORY")
-            ),
-            headers={"Accept": "application/vnd.github.v3+json"},
-        )
+def get_changes(payload: Dict, current: Dict) -> Dict:
+    """fields of payload that differ from current repository metadata"""
+    return {key: value for key, value in payload.items() if current.get(key) != value}
+
+
+def get_payload_digest(payload: Dict) -> str:
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def get_state_file(config: Config) -> pathlib.Path:
+    """where last applied payload's digest is stored for this image"""
+    return (
+        config.get_cache_dir()
+        / "dockerio"
+        / "{}.sha256".format(config.image_name.replace("/", "_"))
     )
-    if not response.getcode() == 200:
-        raise ValueError(
-            "Unable to retrieve description from Github API HTTP {}: {}".format(
-                response.getcode(), response.reason
-            )
-        )
 
+
+def read_state(config: Config) -> Optional[str]:
     try:
-        body = response.read()
-        return json.loads(body.decode("UTF-8")).get("description")
-    except Exception as exc:
-        raise ValueError(
-            "Unable to read Github's API's response: {} -- {}".format(exc, body)
-        )
+        return get_state_file(config).read_text().strip()
+    except IOError:
+        return None
 
 
-def do_update_dockerio_api(payload: Dict, token: str) -> int:
-    json_payload = json.dumps(payload).encode("utf-8")
-    response = urllib.request.urlopen(
-        urllib.request.Request(
-            url="https://hub.docker.com/v2/repositories/{}/".format(
-                os.getenv("IMAGE_NAME")
-            ),
-            data=json_payload,
-            headers={
-                "Authorization": "JWT {}".format(token),
-                "Content-Type": "application/json; charset=utf-8",
-                "Content-Length": len(json_payload),
-            },
-            method="PATCH",
-        )
+def write_state(config: Config, payload: Dict):
+    try:
+        state_file = get_state_file(config)
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        state_file.write_text(get_payload_digest(payload))
+    except IOError as exc:
+        print("Unable to store Hub state: {}".format(exc))
+
+
+def do_update_dockerio_api(image_name: str, payload: Dict, token: str) -> int:
+    response = get_client().request_json(
+        "PATCH",
+        "https://hub.docker.com/v2/repositories/{}/".format(image_name),
+        payload,
+        headers={"Authorization": "JWT {}".format(token)},
     )
 
-    if response.code >= 300:
-        print("Unexpected HTTP {}/{} response".format(response.code, response.msg))
-        print(response.read().decode("UTF-8"))
+    if response.status >= 300:
+        print("Unexpected HTTP {}/{} response".format(response.status, response.reason))
+        print(response.body.decode("UTF-8"))
         return 1
 
     return 0
 
 
-def read_overview_from(hint: str) -> str:
+def read_overview_from(hint: str, workspace: str, context: str) -> str:
     """README/file content found and read from hint
 
     should hint be a relative path prefixed with `file`:
     or should hint be `auto`."""
-    repo_root = pathlib.Path(os.getenv("GITHUB_WORKSPACE")).resolve()
-    context_root = repo_root.joinpath(os.getenv("CONTEXT")).resolve()
+    repo_root = pathlib.Path(workspace).resolve()
+    context_root = repo_root.joinpath(context).resolve()
 
     # relative file path
     if re.match(r"^file\:.+", hint):
@@ -157,18 +136,18 @@ def read_overview_from(hint: str) -> str:
                     break
 
 
-def update_dockerio_api():
-    description = os.getenv("REPO_DESCRIPTION")
+def update_dockerio_api(config: Config):
+    description = config.repo_description
     if description == "auto":
-        description = get_github_description(os.getenv("GITHUB_REPOSITORY"))
+        description = get_github_description(config.github_repository, config)
 
-    full_description = os.getenv("REPO_FULL_DESCRIPTION")
+    full_description = config.repo_full_description
     if full_description and (
         re.match(r"^file\:.+", full_description) or full_description == "auto"
     ):
-        full_description = read_overview_from(full_description)
-
-    jwt_token = get_dockerhub_jwt(*get_credentials("docker.io"))
+        full_description = read_overview_from(
+            full_description, config.github_workspace, config.context
+        )
 
     payload = {}
     if description is not None:
@@ -176,33 +155,68 @@ def update_dockerio_api():
     if full_description is not None:
         payload["full_description"] = full_description
 
-    print("Updating docker.io's Hub API for {}…".format(os.getenv("IMAGE_NAME")))
-    print("---\n{}\n---".format(json.dumps(payload, indent=4)))
+    # payload applied on a previous run, no need to query the Hub
+    if read_state(config) == get_payload_digest(payload):
+        print("docker.io's Hub for {} unchanged (cached).".format(config.image_name))
+        return 0
 
-    # allow a few attempts at updating the Hub
-    attempts = 0
-    max_attempts = 3
-    while attempts < max_attempts + 1:
-        attempts += 1
+    policy = config.get_retry_policy()
+    try:
         try:
-            return do_update_dockerio_api(payload, jwt_token)
+            # public repositories don't require logging-in
+            current = retry_call(
+                lambda: get_dockerio_repository(config.image_name),
+                policy,
+                "docker.io's Hub API",
+            )
         except urllib.error.HTTPError as exc:
-            print(
-                "Unexpected Error on Attempt {}/{}: {}. ".format(
-                    attempts, max_attempts, exc
-                )
+            if exc.code not in (401, 403, 404):
+                raise
+            current = call_with_token(
+                config,
+                lambda token: retry_call(
+                    lambda: get_dockerio_repository(config.image_name, token),
+                    policy,
+                    "docker.io's Hub API",
+                ),
             )
-            time.sleep(attempts * 30)
-            continue
-    print("Exhausted retry attempts")
-    return 1
+    except (OSError, ValueError) as exc:
+        print(f"Unable to read docker.io's Hub API: {exc}")
+        return 1
+
+    changes = get_changes(payload, current)
+    if not changes:
+        print("docker.io's Hub for {} unchanged.".format(config.image_name))
+        write_state(config, payload)
+        return 0
+
+    print("Updating docker.io's Hub API for {}…".format(config.image_name))
+    print("---\n{}\n---".format(json.dumps(changes, indent=4)))
+
+    try:
+        ret = call_with_token(
+            config,
+            lambda token: retry_call(
+                lambda: do_update_dockerio_api(config.image_name, changes, token),
+                policy,
+                "docker.io's Hub API",
+            ),
+        )
+    except (OSError, ValueError) as exc:
+        print(f"Unable to update docker.io's Hub API: {exc}")
+        return 1
+
+    if ret == 0:
+        write_state(config, payload)
+    return ret
 
 
 if __name__ == "__main__":
-    if not os.getenv("SHOULD_UPDATE_DOCKERIO"):
+    config = Config.from_env()
+    if not config.should_update_dockerio:
         sys.exit(0)
 
-    if not os.getenv("REPO_DESCRIPTION") and not os.getenv("REPO_FULL_DESCRIPTION"):
+    if not config.repo_description and not config.repo_full_description:
         print("no description, skipping.")
         sys.exit(0)
-    sys.exit(update_dockerio_api())
+    sys.exit(update_dockerio_api(config))